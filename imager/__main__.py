@@ -6,11 +6,18 @@ this is the file that is executed. This file works as traffic cop that directs t
 application to the correct entry point.  It allows you to launch the GUI, or to do 
 something simple from the command line.
 
+The command 'batch' is handled separately (see a6batch), as in
+
+    python imager batch samples -f monochromify:sepia,vignette
+
+It processes image files without ever loading the GUI.
+
 Author: Walker M. White (wmw2)
 Date:   October 29, 2019
 """
 # To handle command line options
 import argparse
+import sys
 
 # This is necessary to prevent conflicting command line arguments
 import os
@@ -28,6 +35,7 @@ def parse():
     parser.add_argument('image', type=str, nargs='?', help='the image file to process')
     parser.add_argument('-t','--test',   action='store_true',  help='run a unit test on Image and Editor')
     parser.add_argument('-g','--grade',   action='store_true', help='grade the assignment')
+    parser.add_argument('-b','--bench',   action='store_true', help='benchmark the image processing code')
     return parser.parse_args()
 
 
@@ -53,6 +61,28 @@ def unittest():
     test_all()
 
 
+def bench(image):
+    """
+    Benchmarks the image processing code.
+    
+    Parameter image: The image file to use for the benchmarks
+    Precondition: image is a filename string or None
+    """
+    from a6bench import bench_all
+    bench_all(image)
+
+
+def batch(arguments):
+    """
+    Runs the headless batch command, exiting with its status.
+    
+    Parameter arguments: The command line arguments after 'batch'
+    Precondition: arguments is a list of strings
+    """
+    from a6batch import main
+    sys.exit(main(arguments))
+
+
 def grade(image):
     """
     Grades the assignment.
@@ -71,6 +101,9 @@ def execute():
     """
     Executes the application, according to the command line arguments specified.
     """
+    if sys.argv[1:2] == ['batch']:
+        batch(sys.argv[2:])
+    
     args = parse()
     
     image = args.image
@@ -80,8 +113,11 @@ def execute():
         unittest()
     elif args.grade:
         grade(image)
+    elif args.bench:
+        bench(image)
     else:
         launch(image)
 
-# Do it
-execute()
\ No newline at end of file
+# Do it (but not in a batch worker process, which imports this module)
+if __name__ == '__main__':
+    execute()
\ No newline at end of file
@@ -0,0 +1,606 @@
+"""
+Batch processing for the imager application.
+
+This module applies filter chains to many image files without the GUI. It is
+run from the command line as
+
+    python imager batch INPUT [INPUT ...] -f CHAIN [-f CHAIN ...]
+
+Each input is an image file, a directory of image files, or a glob pattern
+like 'samples/*.png'. Each chain is a comma-separated list of Filter
+operations, applied in order. Operations that take an argument put it after
+a colon. For example, the chain
+
+    monochromify:sepia,vignette,pixellate:20
+
+makes a sepia image, vignettes it, and then pixellates it with a step of 20.
+The result for an input file Name.png is written to
+
+    OUTPUT/Name/Name-sepia-vignette-pixellate-20.png
+
+This is the same layout as the outputs folder. As the folder and extension of
+an input are not part of the output path, inputs like a/Name.png, b/Name.png
+and Name.jpg would write the same files. Only the first of them is processed,
+and each of the others is reported as a failure (see screen).
+
+Chains that only differ in the
+step of a final pixellate, like
+
+    -f vignette,pixellate:10 -f vignette,pixellate:20 -f vignette,pixellate:50
+
+are applied together: the rest of the chain is applied once, and every
+pixellated result comes from a single summed-area table of that image (see
+Filter.pixellations).
+
+This module never imports Kivy, and each process only keeps one image (and
+the result being written) in memory at a time, so it can stream through any
+number of files.
+
+The files are processed by a pool of worker processes, one per core by
+default, so the batch speeds up with the number of cores. When it is done,
+the batch reports its throughput in images and megapixels per second.
+
+Julia Ludwig (jal545)
+11/14/20
+"""
+import a6file
+import a6filter
+import a6lut
+import argparse
+import os
+import sys
+
+
+# The file name label for each operation that does not take an argument
+LABELS = {'invert':'invert', 'transpose':'transpose',
+          'reflectHori':'reflect-horizontal', 'reflectVert':'reflect-vertical',
+          'rotateLeft':'rotate-left', 'rotateRight':'rotate-right',
+          'jail':'jail', 'vignette':'vignette'}
+
+# The arguments of monochromify
+MONOCHROME = {'grey':False, 'greyscale':False, 'sepia':True}
+
+# The file extensions read when an input is a directory
+EXTENSIONS = ('.png','.jpg','.jpeg','.bmp','.gif','.tif','.tiff')
+
+
+class Chain(object):
+    """
+    A class representing a sequence of Filter operations.
+
+    A chain is created from a text specification (see the module docstring)
+    and can be applied to any Filter. Each chain has a label, which is used in
+    the name of the output file.
+    """
+    # IMMUTABLE ATTRIBUTES (Fixed after initialization)
+    # Attribute _actions: The operations, in order
+    # Invariant: _actions is a non-empty list of tuples, where the first element
+    # is a Filter method name and the rest are its arguments
+    #
+    # Attribute _label: The output file label
+    # Invariant: _label is a non-empty string
+
+    def getActions(self):
+        """
+        Returns a COPY of the list of operations in this chain.
+
+        Each operation is a tuple whose first element is a Filter method name,
+        followed by the arguments to that method.
+        """
+        return self._actions[:]
+
+    def getLabel(self):
+        """
+        Returns the label of this chain.
+
+        The label is the part of the output file name after the input name.
+        It is the labels of the individual operations joined by hyphens.
+        """
+        return self._label
+
+    def __init__(self, spec):
+        """
+        Initializes a filter chain from the given specification.
+
+        Parameter spec: The chain specification, like 'monochromify:sepia,jail'
+        Precondition: spec is a string
+
+        Raises ValueError if spec is not a valid chain.
+        """
+        assert type(spec) == str, repr(spec)+' is not a string.'
+        self._actions = []
+        labels = []
+        for step in spec.split(','):
+            action, label = parse_step(step.strip())
+            self._actions.append(action)
+            labels.append(label)
+        self._label = '-'.join(labels)
+
+    def __str__(self):
+        """
+        Returns the label of this chain
+        """
+        return self._label
+
+    def apply(self, editor):
+        """
+        Applies the operations of this chain to the current image of editor.
+
+        Consecutive pointwise operations are fused into a single pass over
+        the image (see Filter.pipeline).
+
+        Parameter editor: The editor whose image is changed
+        Precondition: editor is a Filter object
+        """
+        editor.pipeline(self._actions)
+
+
+# HELPER FUNCTIONS
+def parse_step(spec):
+    """
+    Returns a tuple (action, label) for one step of a filter chain.
+
+    The step is a Filter method name, followed by a colon and an argument for
+    monochromify (grey or sepia), pixellate (the step size) and look (the
+    name of a look registered in a6lut). The value
+    action is a tuple of the method name and its arguments, and label is the
+    name of this step in an output file.
+
+    Parameter spec: The step specification, like 'pixellate:20'
+    Precondition: spec is a string
+
+    Raises ValueError if spec is not a valid step.
+    """
+    name, colon, arg = spec.partition(':')
+    if name == 'monochromify':
+        if not arg in MONOCHROME:
+            raise ValueError('monochromify needs an argument grey or sepia, not '+repr(arg))
+        sepia = MONOCHROME[arg]
+        return (('monochromify',sepia), 'sepia' if sepia else 'grey')
+    elif name == 'pixellate':
+        if not arg.isdigit() or int(arg) == 0:
+            raise ValueError('pixellate needs a step > 0, not '+repr(arg))
+        return (('pixellate',int(arg)), 'pixellate-'+str(int(arg)))
+    elif name == 'look':
+        if not arg in a6lut.LOOKS:
+            raise ValueError('look needs the name of a registered look, not '+repr(arg))
+        return (('look',arg), 'look-'+arg)
+    elif name in LABELS:
+        if colon:
+            raise ValueError(name+' does not take an argument')
+        return ((name,), LABELS[name])
+    raise ValueError('unknown filter '+repr(name))
+
+
+def group(chains):
+    """
+    Returns the chains as a list of groups that can be applied together.
+
+    Chains that only differ in the step of a final pixellate are put in the
+    same group, in their original order. Every other chain is a group on its
+    own. The groups are in the order of their first chains.
+
+    Parameter chains: The filter chains
+    Precondition: chains is a list of Chain objects
+    """
+    groups = []
+    shared = {}
+    for chain in chains:
+        actions = chain.getActions()
+        if actions[-1][0] != 'pixellate':
+            groups.append([chain])
+            continue
+        prefix = tuple(actions[:-1])
+        if prefix not in shared:
+            shared[prefix] = []
+            groups.append(shared[prefix])
+        shared[prefix].append(chain)
+    return groups
+
+
+def parse_chain(spec):
+    """
+    Returns the Chain for spec, converting errors for argparse.
+
+    Parameter spec: The chain specification
+    Precondition: spec is a string
+    """
+    try:
+        return Chain(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def positive(text):
+    """
+    Returns text as an int > 0, converting errors for argparse.
+
+    Parameter text: The command line argument
+    Precondition: text is a string
+    """
+    if not text.isdigit() or int(text) == 0:
+        raise argparse.ArgumentTypeError(repr(text)+' is not an int > 0')
+    return int(text)
+
+
+def expand(inputs):
+    """
+    Yields the image files named by inputs, one at a time.
+
+    Each input may be a file, a directory (whose image files are used in
+    sorted order), or a glob pattern. This is a generator, so a pattern that
+    matches thousands of files is never expanded into a list all at once.
+
+    Parameter inputs: The input names
+    Precondition: inputs is a list of strings
+    """
+    import glob
+    for item in inputs:
+        if os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                if name.lower().endswith(EXTENSIONS):
+                    yield os.path.join(item,name)
+        elif any(char in item for char in '*?['):
+            for path in glob.iglob(item):
+                if os.path.isfile(path):
+                    yield path
+        else:
+            yield item
+
+
+def screen(files, rejected):
+    """
+    Yields the files whose outputs do not collide with those of an earlier file.
+
+    The outputs of a file are named after it without its folder or extension
+    (see output_path), so files like a/x.png, b/x.png and x.jpg would write
+    the same outputs, possibly at the same time in different processes. Only
+    the first such file is yielded. Each later one is added to rejected as a
+    failed result of attempt, whose error names the first file. Only the
+    names seen so far are kept in memory, not the files.
+
+    Parameter files: The input files
+    Precondition: files is an iterable of strings
+
+    Parameter rejected: The list to add the results for colliding files to
+    Precondition: rejected is a list
+    """
+    seen = {}
+    for file in files:
+        name = os.path.normcase(os.path.splitext(os.path.basename(file))[0])
+        if name in seen:
+            rejected.append((file,[],0,'its outputs would overwrite those of '+seen[name]))
+        else:
+            seen[name] = file
+            yield file
+
+
+def output_path(output, file, chain):
+    """
+    Returns the output file for the given input file and chain.
+
+    For input Name.png, the result is output/Name/Name-LABEL.png, where LABEL
+    is the chain label.
+
+    Parameter output: The output folder
+    Precondition: output is a string
+
+    Parameter file: The input file
+    Precondition: file is a string
+
+    Parameter chain: The filter chain
+    Precondition: chain is a Chain object
+    """
+    name = os.path.splitext(os.path.basename(file))[0]
+    return os.path.join(output,name,name+'-'+chain.getLabel()+'.png')
+
+
+def process(file, chains, output, compress_level=a6file.COMPRESS_LEVEL,
+            optimize=a6file.OPTIMIZE):
+    """
+    Returns a tuple (paths, size) after applying each chain to file.
+
+    The value paths is the list of files written, and size is the number of
+    pixels in the input image. Every chain starts from the original image.
+    The chains are applied in groups (see group), so the paths of chains in
+    the same group are next to each other.
+    This function does not catch errors; if the file cannot be read or
+    written, the error is raised.
+
+    Parameter file: The input image file
+    Precondition: file is a string
+
+    Parameter chains: The filter chains to apply
+    Precondition: chains is a non-empty list of Chain objects
+
+    Parameter output: The output folder
+    Precondition: output is a string
+
+    Parameter compress_level: The zlib compression level of the output files
+    Precondition: compress_level is an int in 0..9
+
+    Parameter optimize: Whether to optimize the output files for size
+    Precondition: optimize is a bool
+    """
+    image  = a6file.read_image(file)
+    editor = a6filter.Filter(image)
+    editor.LAZY = True      # Optimize each chain as a whole when it is written
+
+    paths = []
+    for chains in group(chains):
+        editor.clear()
+        if len(chains) == 1:
+            chains[0].apply(editor)
+            results = [editor.getCurrent()]
+        else:
+            prefix = chains[0].getActions()[:-1]
+            if prefix:
+                editor.pipeline(prefix)
+            steps = [chain.getActions()[-1][1] for chain in chains]
+            results = (image for (step, image) in editor.pixellations(steps))
+
+        for (chain, result) in zip(chains,results):
+            path = output_path(output,file,chain)
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+            a6file.write_png(result,path,compress_level,optimize)
+            paths.append(path)
+    return (paths, len(image))
+
+
+def attempt(file, chains, output, compress_level, optimize, retries):
+    """
+    Returns a tuple (file, paths, size, error) for processing file.
+
+    This calls process, trying again up to retries more times if it fails.
+    On success, paths and size are the values returned by process and error
+    is None. If every try fails, paths is empty, size is 0, and error is a
+    string describing the last error. So a corrupt file is skipped instead
+    of stopping the batch.
+
+    See process for the other parameters.
+
+    Parameter retries: The number of times to try again after a failure
+    Precondition: retries is an int >= 0
+    """
+    error = None
+    for x in range(retries+1):
+        try:
+            paths, size = process(file,chains,output,compress_level,optimize)
+            return (file, paths, size, None)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+    return (file, [], 0, error)
+
+
+def work(files, chains, output, compress_level, optimize, retries):
+    """
+    Returns the list of results of attempt for each file in files.
+
+    This is the function run by a worker process. Each call handles one chunk
+    of the input files.
+
+    See attempt for the other parameters.
+
+    Parameter files: The input files
+    Precondition: files is a list of strings
+    """
+    return [attempt(file,chains,output,compress_level,optimize,retries) for file in files]
+
+
+def chunk(items, size):
+    """
+    Yields the elements of items in lists of the given size.
+
+    The last list may be shorter. This is a generator, so it does not read
+    more of items than it needs for the next list.
+
+    Parameter items: The elements to group
+    Precondition: items is an iterable
+
+    Parameter size: The number of elements in each list
+    Precondition: size is an int > 0
+    """
+    group = []
+    for item in items:
+        group.append(item)
+        if len(group) == size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def execute(inputs, chains, output, compress_level=a6file.COMPRESS_LEVEL,
+            optimize=a6file.OPTIMIZE, workers=1, chunksize=1, ordered=True, retries=0):
+    """
+    Yields the result of attempt for every input file.
+
+    If workers is 1, the files are processed one at a time in this process.
+    Otherwise they are processed by a pool of worker processes, which each
+    get chunksize files at a time. Pure-Python filters cannot run in parallel
+    in threads, but separate processes can use every core.
+
+    If ordered is True, the results are yielded in the same order as the
+    input files, except that a file whose outputs collide with an earlier
+    one is reported as soon as it is found (see screen). Otherwise each
+    result is yielded as soon as it is ready.
+    Either way, at most two chunks per worker are in progress at once, so the
+    memory needed does not depend on the number of files.
+
+    See run for the other parameters.
+
+    Parameter workers: The number of worker processes
+    Precondition: workers is an int > 0
+
+    Parameter chunksize: The number of files given to a worker at a time
+    Precondition: chunksize is an int > 0
+
+    Parameter ordered: Whether to yield the results in input order
+    Precondition: ordered is a bool
+
+    Parameter retries: The number of times to try again after a failure
+    Precondition: retries is an int >= 0
+    """
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    assert type(workers) == int and workers > 0, repr(workers)+' is not an int > 0.'
+    assert type(chunksize) == int and chunksize > 0, repr(chunksize)+' is not an int > 0.'
+    assert type(retries) == int and retries >= 0, repr(retries)+' is not an int >= 0.'
+
+    settings = (chains,output,compress_level,optimize,retries)
+    rejected = []
+    chunks = chunk(screen(expand(inputs),rejected),chunksize)
+    if workers == 1:
+        for files in chunks:
+            yield from rejected
+            rejected.clear()
+            yield from work(files,*settings)
+        yield from rejected
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for files in chunks:
+            yield from rejected
+            rejected.clear()
+            pending.append(executor.submit(work,files,*settings))
+            if len(pending) >= 2*workers:
+                yield from collect(pending,ordered)
+        yield from rejected
+        while pending:
+            yield from collect(pending,ordered)
+
+
+def collect(pending, ordered):
+    """
+    Returns the results of the next chunk, removing it from pending.
+
+    If ordered is True, this waits for the oldest chunk. Otherwise it waits
+    for whichever chunk finishes first.
+
+    Parameter pending: The chunks in progress, oldest first
+    Precondition: pending is a non-empty deque of Future objects
+
+    Parameter ordered: Whether to collect the results in input order
+    Precondition: ordered is a bool
+    """
+    from concurrent.futures import wait, FIRST_COMPLETED
+    if ordered:
+        future = pending.popleft()
+    else:
+        future = next(iter(wait(pending,return_when=FIRST_COMPLETED)[0]))
+        pending.remove(future)
+    return future.result()
+
+
+def run(inputs, chains, output, compress_level=a6file.COMPRESS_LEVEL,
+        optimize=a6file.OPTIMIZE, quiet=False, workers=1, chunksize=1,
+        ordered=True, retries=0):
+    """
+    Returns the number of input files that could not be processed.
+
+    This function applies every chain to every input file (see execute). A
+    file that fails is reported and skipped; it does not stop the batch. At
+    the end, it prints the throughput in images and megapixels per second.
+
+    Parameter inputs: The input names (files, directories or glob patterns)
+    Precondition: inputs is a list of strings
+
+    Parameter chains: The filter chains to apply
+    Precondition: chains is a non-empty list of Chain objects
+
+    Parameter output: The output folder
+    Precondition: output is a string
+
+    Parameter compress_level: The zlib compression level of the output files
+    Precondition: compress_level is an int in 0..9
+
+    Parameter optimize: Whether to optimize the output files for size
+    Precondition: optimize is a bool
+
+    Parameter quiet: Whether to suppress the progress messages
+    Precondition: quiet is a bool
+
+    Parameter workers: The number of worker processes
+    Precondition: workers is an int > 0
+
+    Parameter chunksize: The number of files given to a worker at a time
+    Precondition: chunksize is an int > 0
+
+    Parameter ordered: Whether to report the files in input order
+    Precondition: ordered is a bool
+
+    Parameter retries: The number of times to try again after a failure
+    Precondition: retries is an int >= 0
+    """
+    import time
+    start = time.perf_counter()
+
+    images = 0
+    pixels = 0
+    failures = 0
+    for file, paths, size, error in execute(inputs,chains,output,compress_level,optimize,
+                                            workers,chunksize,ordered,retries):
+        if error is None:
+            images += 1
+            pixels += size
+            if not quiet:
+                for path in paths:
+                    print('Wrote '+path)
+        else:
+            print('Could not process '+file+': '+error,file=sys.stderr)
+            failures += 1
+
+    if not quiet:
+        elapsed = max(time.perf_counter()-start,1e-9)
+        summary = 'Processed {} images ({:.1f} megapixels) in {:.2f}s: {:.1f} images/sec, {:.2f} megapixels/sec'
+        print(summary.format(images,pixels/1e6,elapsed,images/elapsed,pixels/1e6/elapsed))
+    return failures
+
+
+def parse(arguments):
+    """
+    Returns the batch command line arguments
+
+    Parameter arguments: The command line arguments after 'batch'
+    Precondition: arguments is a list of strings
+    """
+    parser = argparse.ArgumentParser(prog='imager batch',
+                                     description='Apply filter chains to many image files.')
+    parser.add_argument('inputs', type=str, nargs='+',
+                        help='image files, directories or glob patterns')
+    parser.add_argument('-f','--filters', type=parse_chain, action='append', required=True,
+                        metavar='CHAIN', help='a filter chain, like monochromify:sepia,vignette,pixellate:20 '+
+                        '(may be repeated)')
+    parser.add_argument('-o','--output', type=str, default='outputs',
+                        help='the output folder (default: outputs)')
+    parser.add_argument('-c','--compress-level', type=int, default=a6file.COMPRESS_LEVEL,
+                        choices=range(10), metavar='0-9', help='the PNG compression level')
+    parser.add_argument('--optimize', action='store_true', help='optimize the PNG files for size')
+    parser.add_argument('-q','--quiet', action='store_true', help='do not list the files written')
+    parser.add_argument('-w','--workers', type=positive, default=os.cpu_count() or 1,
+                        help='the number of worker processes (default: one per core)')
+    parser.add_argument('--chunksize', type=positive, default=1,
+                        help='the number of files given to a worker at a time (default: 1)')
+    parser.add_argument('--unordered', action='store_true',
+                        help='report files as they finish instead of in input order')
+    parser.add_argument('--retries', type=int, default=0, choices=range(10), metavar='0-9',
+                        help='the number of times to retry a file that fails (default: 0)')
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    """
+    Runs the batch command with the given command line arguments.
+
+    This function is called by __main__.py. It returns the exit status of the
+    command, which is 1 if any of the inputs failed and 0 otherwise.
+
+    Parameter arguments: The command line arguments after 'batch'
+    Precondition: arguments is a list of strings
+    """
+    args = parse(arguments)
+    failures = run(args.inputs,args.filters,args.output,
+                   args.compress_level,args.optimize,args.quiet,
+                   args.workers,args.chunksize,not args.unordered,args.retries)
+    return 1 if failures else 0
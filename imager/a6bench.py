@@ -0,0 +1,363 @@
+"""
+Benchmarks for the imager application.
+
+This module times the parts of the application that matter for large images.
+It is run from the command line with the --bench option. Each benchmark
+prints one line per measurement, comparing a baseline against the faster
+alternative.
+
+Julia Ludwig (jal545)
+11/14/20
+"""
+import a6image
+import a6filter
+import a6file
+import time
+
+
+# The image to use if none is given
+DEFAULT = 'im_walker.png'
+
+
+def get_resource(filename):
+    """
+    Returns the absolute pathname for a file stored in the imager folder.
+
+    Parameter filename: The relative name of the file
+    Precondition: filename is a string
+    """
+    import os.path
+    dir = os.path.split(__file__)[0]
+    return os.path.join(dir,filename)
+
+
+def read_pixels(file):
+    """
+    Returns a tuple (pixels, width) for the given image file.
+
+    The value pixels is a pixel list, exactly as the application used to
+    read it before compact images.
+
+    Parameter file: An image file
+    Precondition: file is a string naming a readable image file
+    """
+    from PIL import Image as CoreImage
+    image = CoreImage.open(file).convert('RGB')
+    return (list(image.getdata()), image.size[0])
+
+
+def measure(func, *args, repeat=3):
+    """
+    Returns the fastest time (in seconds) of repeat calls to func(*args)
+
+    Parameter func: The function to time
+    Precondition: func is callable
+
+    Parameter args: The function arguments
+    Precondition: args are valid arguments for func
+
+    Parameter repeat: The number of times to call the function
+    Precondition: repeat is an int > 0
+    """
+    best = None
+    for x in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(name, before, after, labels=('before','after')):
+    """
+    Prints a single line comparing two times.
+
+    Parameter name: The name of the measurement
+    Precondition: name is a string
+
+    Parameter before: The baseline time in seconds
+    Precondition: before is a float >= 0
+
+    Parameter after: The improved time in seconds
+    Precondition: after is a float >= 0
+
+    Parameter labels: The names of the two alternatives
+    Precondition: labels is a tuple of two strings
+    """
+    speedup = before/after if after > 0 else float('inf')
+    print('  {:<24} {} {:8.4f}s   {} {:8.4f}s   x{:.1f}'.format(
+          name,labels[0],before,labels[1],after,speedup))
+
+
+def apply(image, action, unchecked):
+    """
+    Applies a pure-Python filter operation to a new editor for image.
+
+    Parameter image: The image to edit
+    Precondition: image is an Image object
+
+    Parameter action: The operation name followed by its arguments
+    Precondition: action is a tuple whose first element is a Filter method name
+
+    Parameter unchecked: Whether to skip pixel validation
+    Precondition: unchecked is a bool
+    """
+    editor = a6filter.Filter(image)
+    editor.VECTORIZE = False
+    editor.UNCHECKED = unchecked
+    getattr(editor,action[0])(*action[1:])
+
+
+def bench_validation(file):
+    """
+    Measures the cost of pixel validation when loading, copying and filtering.
+
+    The baseline is the validated path: the Image initializer, a copy made by
+    passing getData() to the initializer, and filters that check every write.
+    It is compared against fromTrusted, copy(), and the unchecked filters.
+
+    Parameter file: An image file
+    Precondition: file is a string naming a readable image file
+    """
+    pixels, width = read_pixels(file)
+    image = a6image.Image(pixels,width)
+    print('Validation overhead ({}x{} image)'.format(width,len(pixels)//width))
+    labels = ('checked','trusted')
+
+    before = measure(a6image.Image,pixels,width)
+    after  = measure(a6image.Image.fromTrusted,pixels,width)
+    report('load',before,after,labels)
+
+    before = measure(lambda : a6image.Image(image.getData(),width))
+    after  = measure(image.copy)
+    report('copy',before,after,labels)
+
+    for action in [('invert',),('monochromify',True),('vignette',)]:
+        before = measure(apply,image,action,False,repeat=1)
+        after  = measure(apply,image,action,True,repeat=1)
+        report('filter '+action[0],before,after,labels)
+
+
+def bench_loading(file):
+    """
+    Measures the time to read an image file into an Image object.
+
+    The baseline is the original loader, which creates a pixel list with
+    getdata() and then validates it in the Image initializer. It is compared
+    against a6file.read_image, which decodes straight into a compact image.
+
+    Parameter file: An image file
+    Precondition: file is a string naming a readable image file
+    """
+    image = a6file.read_image(file)
+    print('Image loading ({}x{} image)'.format(image.getWidth(),image.getHeight()))
+    before = measure(lambda : a6image.Image(*read_pixels(file)))
+    after  = measure(a6file.read_image,file)
+    report('read image',before,after,('pixels','bytes '))
+
+
+def write_pixels(image, file):
+    """
+    Writes image to file the way the application used to save images.
+
+    This makes a tuple out of the pixel list and gives it to PIL with putdata.
+
+    Parameter image: The image to write
+    Precondition: image is an Image object
+
+    Parameter file: The file to write to
+    Precondition: file is a string
+    """
+    from PIL import Image as CoreImage
+    im = CoreImage.new('RGBA',(image.getWidth(),image.getHeight()))
+    im.putdata(tuple(image.getData()))
+    im.save(file,'PNG')
+
+
+def bench_saving(file):
+    """
+    Measures the time to write an Image object to a PNG file.
+
+    The baseline is the original writer, which uses putdata on a tuple of
+    pixels. It is compared against a6file.write_png at the default and lowest
+    compression levels.
+
+    Parameter file: An image file
+    Precondition: file is a string naming a readable image file
+    """
+    import os.path
+    import tempfile
+    image = a6file.read_image(file)
+    print('Image saving ({}x{} image)'.format(image.getWidth(),image.getHeight()))
+    with tempfile.TemporaryDirectory() as folder:
+        output = os.path.join(folder,'output.png')
+        before = measure(write_pixels,image,output)
+        after  = measure(a6file.write_png,image,output)
+        report('write png',before,after,('pixels','bytes '))
+        after  = measure(a6file.write_png,image,output,1)
+        report('write png (level 1)',before,after,('pixels','bytes '))
+
+
+def bench_parallel(file, workers=None):
+    """
+    Measures the speed-up from processing an image in bands.
+
+    The baseline is a Filter operation on the whole image in one process. It
+    is compared against the same operation split across several processes
+    (see a6parallel). The speed-up depends on the number of cores.
+
+    Parameter file: An image file
+    Precondition: file is a string naming a readable image file
+
+    Parameter workers: The number of processes (or None for one per core)
+    Precondition: workers is None or an int > 1
+    """
+    import os
+    image = a6file.read_image(file)
+    if workers is None:
+        workers = max(2,os.cpu_count() or 1)
+    print('Parallel bands ({}x{} image, {} workers)'.format(
+          image.getWidth(),image.getHeight(),workers))
+
+    def run(action,count):
+        editor = a6filter.Filter(image)
+        editor.WORKERS = count
+        editor.PARALLEL_MINIMUM = 0
+        getattr(editor,action[0])(*action[1:])
+
+    run(('invert',),workers)    # Start the worker pool
+    for action in [('invert',),('monochromify',True),('vignette',),('pixellate',20)]:
+        before = measure(run,action,1)
+        after  = measure(run,action,workers)
+        report('filter '+action[0],before,after,('serial  ','parallel'))
+
+
+def bench_pipeline(file):
+    """
+    Measures the speed-up from fusing a chain of pointwise operations.
+
+    The baseline calls monochromify, vignette and invert one after the other.
+    It is compared against Filter.pipeline, which applies all three in a
+    single pass over the image.
+
+    Parameter file: An image file
+    Precondition: file is a string naming a readable image file
+    """
+    image = a6file.read_image(file)
+    chain = [('monochromify',True),('vignette',),('invert',)]
+    print('Fused pipelines ({}x{} image)'.format(image.getWidth(),image.getHeight()))
+
+    def serial():
+        editor = a6filter.Filter(image)
+        for action in chain:
+            getattr(editor,action[0])(*action[1:])
+
+    before = measure(serial)
+    after  = measure(lambda : a6filter.Filter(image).pipeline(chain))
+    report('sepia-vignette-invert',before,after,('serial','fused '))
+
+
+def bench_orientation(file):
+    """
+    Measures the speed-up from moving pixels with the Image orientation kernels.
+
+    The baseline is the pure-Python rotateRight, which copies the image and
+    reads the copy one pixel at a time. It is compared against the symbolic
+    rotation (see Image.reorient), including the pass that moves the pixels.
+    Both are measured on a square crop of the image, which is rotated in
+    place, and on the top half of that crop, which is not.
+
+    Parameter file: An image file
+    Precondition: file is a string naming a readable image file
+    """
+    image = a6file.read_image(file)
+    size  = min(image.getWidth(),image.getHeight())
+    data  = image.getBytes()
+    square = a6image.Image.fromBytes(data[:3*size*size],size)
+    wide   = a6image.Image.fromBytes(data[:3*size*max(1,size//2)],size)
+    print('Orientation kernels ({}x{} image)'.format(size,size))
+
+    def rotate(source,symbolic):
+        editor = a6filter.Filter(source)
+        editor.VECTORIZE = False
+        editor.SYMBOLIC = symbolic
+        editor.rotateRight()
+        editor.getCurrent().getBuffer()
+
+    for (name,source) in [('rotateRight square',square),('rotateRight half',wide)]:
+        before = measure(rotate,source,False)
+        after  = measure(rotate,source,True)
+        report(name,before,after,('pixels','kernel'))
+
+
+def bench_pixellations(file):
+    """
+    Measures the speed-up from pixellating with several steps at once.
+
+    The baseline pixellates a copy of the image with each of the block sizes
+    in the GUI menu, one at a time. It is compared against Filter.pixellations,
+    which makes all of them from a single summed-area table.
+
+    Parameter file: An image file
+    Precondition: file is a string naming a readable image file
+    """
+    image = a6file.read_image(file)
+    steps = [10,20,50,100,200]
+    print('Pixellate previews ({}x{} image)'.format(image.getWidth(),image.getHeight()))
+
+    def separate():
+        for step in steps:
+            a6filter.Filter(image).pixellate(step)
+
+    before = measure(separate)
+    after  = measure(lambda : list(a6filter.Filter(image).pixellations(steps)))
+    report('pixellate 10-200',before,after,('separate','shared  '))
+
+
+def bench_lookup(file):
+    """
+    Measures the speed-up from applying the color transforms as lookups.
+
+    The baseline is the pure-Python version of each operation. The lookup
+    tables are compared both without and with NumPy (see a6lut).
+
+    Parameter file: An image file
+    Precondition: file is a string naming a readable image file
+    """
+    image = a6file.read_image(file)
+    print('Lookup tables ({}x{} image)'.format(image.getWidth(),image.getHeight()))
+    for action in [('invert',),('monochromify',True)]:
+        def run(vectorize, lookup):
+            editor = a6filter.Filter(image.copy())
+            editor.VECTORIZE = vectorize
+            editor.LOOKUP = lookup
+            getattr(editor,action[0])(*action[1:])
+
+        before = measure(run,False,False)
+        after  = measure(run,False,True)
+        report(' '.join(map(str,action)),before,after,('python','lookup'))
+        before = measure(run,True,False)
+        after  = measure(run,True,True)
+        report(' '.join(map(str,action)),before,after,('numpy ','lookup'))
+
+
+def bench_all(file=None):
+    """
+    Runs all of the benchmarks on the given image file.
+
+    This function is called by __main__.py
+
+    Parameter file: The image file (or None for the default image)
+    Precondition: file is a string naming a readable image file, or None
+    """
+    if file is None:
+        file = get_resource(DEFAULT)
+    bench_loading(file)
+    bench_saving(file)
+    bench_validation(file)
+    bench_parallel(file)
+    bench_pipeline(file)
+    bench_orientation(file)
+    bench_pixellations(file)
+    bench_lookup(file)
@@ -1,10 +1,10 @@
 """
 The base class for modifying an image in the imager application.
 
-When we work with an image, we like to have an edit history. An edit history 
-keeps track of all modifications of an original image.  It allows for 
+When we work with an image, we like to have an edit history. An edit history
+keeps track of all modifications of an original image.  It allows for
 (step-by-step) undos of any changes.  The class in this module provides an
-edit history. The filter functions are in a subclass of this class so that 
+edit history. The filter functions are in a subclass of this class so that
 they can take advantage of the edit history.
 
 Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
@@ -12,99 +12,400 @@ Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
 Author: Walker White (wmw2)
 Date:   October 29, 2019
 """
-# THIS FILE IS COMPLETE.  DO NOT MODIFY THIS FILE AT ALL
 import a6image
+import a6history
+import time
 
 
 class Editor(object):
     """
     A class that keeps track of edits from an original image.
-    
-    This class is what allows us to implement the Undo functionality in our 
-    application. It separates the image into the original (saved) image and 
+
+    This class is what allows us to implement the Undo functionality in our
+    application. It separates the image into the original (saved) image and
     the current modification. It also keeps track of all edits in-between
     (up to a maximum of MAX_HISTORY edits) in order. It can undo any of
     these edits, rolling the current image back.
-    
+
     If the number of edits exceeds MAX_HISTORY, the oldest edit will be
-    deleted.  
-    
+    deleted.
+
+    The earlier versions of the image are stored as snapshots (see the module
+    a6history), which share any part of the image that an edit did not
+    change. So the history takes little more memory than the changes made.
+
+    The memory for these snapshots is limited to MEMORY_BUDGET bytes. When the
+    history grows past this, the oldest snapshots are compressed and spilled
+    to a temporary folder, and read back if they are ever undone. The spilled
+    snapshots are limited to DISK_BUDGET bytes; past that, the oldest edits
+    are deleted, just as if there were more than MAX_HISTORY of them. Use
+    getStats to see how much memory and disk the history is using.
+
+    If REPLAY is True, edits made with perform are recorded as operations
+    instead of snapshots, and only some of them (the keyframes) store a
+    snapshot as well. An edit without a snapshot is undone by restoring the
+    nearest keyframe before it and running the recorded operations again.
+    Each operation is timed, and a new keyframe is taken once replaying the
+    operations since the last one would take REPLAY_LIMIT seconds. So cheap
+    operations share a keyframe, while an expensive one always gets its own.
+    Edits made with increment always get a keyframe, since the editor does
+    not know what operation follows.
+
+    Some operations can be undone exactly by another operation (e.g. a left
+    rotation undoes a right rotation). A subclass lists these in INVERSES.
+    An edit made with perform for one of these gets no snapshot (unless it
+    is needed as a keyframe to replay from), and it is undone by applying the
+    inverse operation to the current image.
+
     Attribute MAX_HISTORY: A CLASS ATTRIBUTE for the maximum number of edits
     Invariant: MAX_HISTORY is an int > 0
+
+    Attribute MEMORY_BUDGET: A CLASS ATTRIBUTE for the history memory in bytes
+    Invariant: MEMORY_BUDGET is an int >= 0
+
+    Attribute DISK_BUDGET: A CLASS ATTRIBUTE for the spilled history in bytes
+    Invariant: DISK_BUDGET is an int >= 0
+
+    Attribute REPLAY: A CLASS ATTRIBUTE for whether to record operations
+    Invariant: REPLAY is a bool
+
+    Attribute REPLAY_LIMIT: A CLASS ATTRIBUTE for the replay time of an undo
+    Invariant: REPLAY_LIMIT is a float >= 0 (in seconds)
+
+    Attribute INVERSES: A CLASS ATTRIBUTE for the operations that can be inverted
+    Invariant: INVERSES is a dictionary mapping names of methods that take no
+    arguments to the names of the methods that undo them
     """
     # IMMUTABLE ATTRIBUTES (Fixed after initialization)
-    # Attribute _original: The original image 
+    # Attribute _original: The original image
     # Invariant: _original is an Image object
     #
-    # Attribute _history: The edit history
-    # Invariant: _history is a non-empty list of Image objects. In addition, 
-    #the length of _history should never be longer than MAX_HISTORY.
-    
+    # MUTABLE ATTRIBUTES
+    # Attribute _current: The most recent edit
+    # Invariant: _current is an Image object
+    #
+    # Attribute _history: The images before each edit, from oldest to newest
+    # Invariant: _history is a list of Snapshot objects or None (if the image
+    # is not a keyframe). In addition, the length of _history should always
+    # be less than MAX_HISTORY.
+    #
+    # Attribute _log: The operation of each edit, from oldest to newest
+    # Invariant: _log is a list the same length as _history. Each element is
+    # a tuple (name, args, cost) for an edit made with perform, where cost is
+    # the time it took in seconds, or None if the edit is unknown. If
+    # _history[pos] is None, then either _log[pos] is an operation in INVERSES
+    # or there is a keyframe before pos and no None in _log from there to pos.
+    #
+    # Attribute _base: The first snapshot taken of the original image
+    # Invariant: _base is an unspilled Snapshot object or None
+    #
+    # Attribute _folder: The folder for spilled snapshots
+    # Invariant: _folder is a TemporaryDirectory object or None (if nothing has
+    # been spilled yet)
+
     # The number of edits that we are allowed to keep track of.
     # (THIS GOES IN CLASS FOLDER)
     MAX_HISTORY = 20
-    
+
+    # The number of bytes of snapshots to keep in memory (256 MB)
+    MEMORY_BUDGET = 256 << 20
+
+    # The number of bytes of snapshots to keep on disk (2 GB)
+    DISK_BUDGET = 2 << 30
+
+    # Whether to record operations instead of snapshots
+    REPLAY = False
+
+    # The most time (in seconds) an undo should spend replaying operations
+    REPLAY_LIMIT = 0.25
+
+    # The operations that are undone by another operation (none here)
+    INVERSES = {}
+
     # GETTERS
     def getOriginal(self):
         """
         Returns the original image
         """
         return self._original
-    
+
     def getCurrent(self):
         """
         Returns the most recent edit
         """
-        return self._history[-1]
-    
+        return self._current
+
+    def getStats(self):
+        """
+        Returns a dictionary of statistics about the edit history.
+
+        The dictionary has the following keys:
+
+            'edits':   the number of edits that can be undone
+            'keyframes': the number of edits with a snapshot
+            'memory':  the bytes of snapshots in memory (shared chunks count once)
+            'spilled': the number of snapshots spilled to disk
+            'disk':    the bytes of snapshots on disk (compressed)
+            'size':    the bytes the snapshots would take as separate images
+
+        The memory includes the first snapshot of the original image, which is
+        kept to share with after the history is cleared.
+        """
+        snapshots = self._getSnapshots()
+        spilled = [snapshot for snapshot in snapshots if snapshot.isSpilled()]
+        return {'edits':   len(self._history),
+                'keyframes': len(snapshots),
+                'memory':  self._getMemory(),
+                'spilled': len(spilled),
+                'disk':    sum(snapshot.getDiskSize() for snapshot in spilled),
+                'size':    sum(snapshot.getSize() for snapshot in snapshots)}
+
     # INITIALIZER
     def __init__(self,original):
         """
         Initializes an edit history for the given image.
-        
-        The edit history starts with exactly one element, which is an 
+
+        The edit history starts with exactly one element, which is an
         (uneditted) copy of the original image.
-        
+
         Parameter original: The image to edit
         Precondition: original is an Image object
         """
         assert isinstance(original,a6image.Image), repr(original)+' is not an image'
         self._original = original
-        self._history  = [original.copy()]
-    
+        self._current  = original.copy()
+        self._history  = []
+        self._log      = []
+        self._base     = None
+        self._folder   = None
+
     # EDIT METHODS
     def undo(self):
         """
         Returns True if the latest edit can be undone, False otherwise.
-        
-        This method attempts to undo the latest element by removing the last 
+
+        This method attempts to undo the latest element by removing the last
         element of the edit history.  However, the edit history can never
         be empty.  If this method is called on an edit history of one element,
         this method returns False instead.
+
+        If the edit was an operation in INVERSES, its inverse is applied to
+        the current image. Otherwise, if the edit has no snapshot, the image
+        is rebuilt from the nearest keyframe by replaying the operations
+        since then.
         """
-        if len(self._history) > 1:
-            self._history.pop()
+        if len(self._history) > 0:
+            if self._log[-1] is not None and self._log[-1][0] in self.INVERSES:
+                getattr(self,self.INVERSES[self._log[-1][0]])()
+            else:
+                self._current = self._rebuild(len(self._history)-1)
+            self._log.pop()
+            snapshot = self._history.pop()
+            if snapshot is not None:
+                snapshot.discard()
             return True
         return False
-    
+
     def clear(self):
         """
         Deletes the entire edit history, retoring the original image.
-        
-        When this method completes, the object should have the same values that 
+
+        When this method completes, the object should have the same values that
         it did once it was first initialized.
         """
-        self._history = [self._original.copy()]
-    
+        self._current = self._original.copy()
+        for snapshot in self._getSnapshots():
+            snapshot.discard()
+        self._history = []
+        self._log = []
+
     def increment(self):
         """
         Adds a new copy of the image to the edit history.
-        
-        This method copies the current most recent edit and adds it to the 
-        end of the history.  If this causes the history to grow to larger 
+
+        This method copies the current most recent edit and adds it to the
+        end of the history.  If this causes the history to grow to larger
         (greater than MAX_HISTORY), this method deletes the oldest edit.
+
+        The copy is a snapshot that shares storage with the previous one
+        wherever the image has not changed since then. The first snapshot
+        after a clear shares with the first snapshot of the original image.
+        Older snapshots are then spilled to disk (or deleted) to keep within
+        MEMORY_BUDGET and DISK_BUDGET.
+
+        The current image is marked clean with each snapshot, so the next one
+        only reads the parts of the image written since then (see Snapshot).
+        """
+        snapshots = self._getSnapshots()
+        previous = snapshots[-1] if snapshots else self._base
+        dirty = None
+        if previous is not None:
+            dirty = self._current.getDirty(previous.getToken())
+        snapshot = a6history.Snapshot(self._current,previous,dirty)
+        self._current.markClean(snapshot.getToken(),previous and previous.getToken())
+        if self._base is None:
+            self._base = snapshot
+        self._history.append(snapshot)
+        self._log.append(None)
+        if len(self._history) >= self.MAX_HISTORY:
+            self._drop()
+        self._budget()
+
+    def perform(self, name, *args):
+        """
+        Adds a new edit to the history and applies the given operation.
+
+        This is the same as calling increment, followed by the method with the
+        given name and arguments. But operations in INVERSES never get a
+        snapshot, and if REPLAY is True, the edit only gets a snapshot if it
+        is a keyframe.
+
+        Parameter name: The name of the operation
+        Precondition: name is a string naming a method of this object that
+        edits the current image
+
+        Parameter args: The arguments to the operation
+        Precondition: args are valid arguments for the operation
+        """
+        if name in self.INVERSES:
+            assert args == (), repr(name)+' does not take arguments.'
+        if self._isKeyframe(name):
+            self.increment()
+        else:
+            self._history.append(None)
+            self._log.append(None)
+            if len(self._history) >= self.MAX_HISTORY:
+                self._drop()
+
+        start = time.perf_counter()
+        getattr(self,name)(*args)
+        self._log[-1] = (name,args,time.perf_counter()-start)
+
+    # HELPER METHODS
+    def _getSnapshots(self):
+        """
+        Returns the list of snapshots in the history (the keyframes).
+        """
+        return [snapshot for snapshot in self._history if snapshot is not None]
+
+    def _isReplay(self):
+        """
+        Returns True if perform should record operations instead of snapshots.
+
+        This is the value of REPLAY. A subclass may record operations for
+        other reasons too.
+        """
+        return self.REPLAY
+
+    def _isKeyframe(self, name):
+        """
+        Returns True if the next edit should get a snapshot.
+
+        The edit is for the operation with the given name. Operations in
+        INVERSES do not need a snapshot, and neither do other operations
+        unless perform is taking snapshots (see REPLAY). But if perform is
+        recording operations, any edit must get a snapshot if there is no
+        keyframe to replay from, or if any of the operations since the last
+        keyframe are unknown. Otherwise, an operation that is not in INVERSES
+        gets a snapshot if replaying the operations since the last keyframe
+        would take at least REPLAY_LIMIT seconds.
+
+        Parameter name: The name of the operation
+        Precondition: name is a string
+        """
+        if not self._isReplay():
+            return name not in self.INVERSES
+
+        cost = 0
+        for pos in range(len(self._history)-1,-1,-1):
+            if self._log[pos] is None:
+                return True
+            cost += self._log[pos][2]
+            if self._history[pos] is not None:
+                return name not in self.INVERSES and cost >= self.REPLAY_LIMIT
+        return True
+
+    def _rebuild(self, pos):
+        """
+        Returns a new Image with the image from before the edit at pos.
+
+        If that edit has no snapshot, this restores the nearest keyframe before
+        it and replays the operations in between on the restored image.
+
+        Parameter pos: The position of the edit in the history
+        Precondition: pos is an int, 0 <= pos < len(_history)
+        """
+        start = pos
+        while self._history[start] is None:
+            start -= 1
+            assert start >= 0, 'There is no keyframe before edit '+repr(pos)
+        image = self._history[start].restore()
+        if start == pos:
+            return image
+
+        current = self._current
+        self._current = image
+        try:
+            for (name,args,cost) in self._log[start:pos]:
+                getattr(self,name)(*args)
+        finally:
+            self._current = current
+        return image
+
+    def _drop(self):
         """
-        self._history.append(self.getCurrent().copy())
-        if len(self._history) > self.MAX_HISTORY:
-            self._history.pop(0)
+        Deletes the oldest edit in the history.
+
+        If the oldest edit is a keyframe and the next edit is not, the next
+        one is made into a keyframe first, as later edits may need to be
+        replayed from it.
+        """
+        keyframe = self._history[0] is not None
+        if keyframe and len(self._history) > 1 and self._history[1] is None:
+            self._history[1] = a6history.Snapshot(self._rebuild(1),self._history[0])
+        self._log.pop(0)
+        snapshot = self._history.pop(0)
+        if keyframe:
+            snapshot.discard()
+
+    def _getMemory(self):
+        """
+        Returns the bytes of snapshots in memory, counting shared chunks once.
+        """
+        chunks = {}
+        snapshots = self._getSnapshots()
+        if self._base is not None:
+            snapshots.append(self._base)
+        for snapshot in snapshots:
+            if not snapshot.isSpilled():
+                for chunk in snapshot.getChunks():
+                    chunks[id(chunk)] = len(chunk)
+        return sum(chunks.values())
+
+    def _budget(self):
+        """
+        Spills or deletes the oldest snapshots until the history is in budget.
+
+        The first snapshot of the original image is given up first, unless it
+        is still in the history. Then the oldest snapshots are spilled until
+        the memory is within MEMORY_BUDGET. Finally the oldest snapshots are
+        deleted until the disk is within DISK_BUDGET.
+        """
+        import tempfile
+        if self._getMemory() > self.MEMORY_BUDGET and self._base is not None:
+            if not any(snapshot is self._base for snapshot in self._history):
+                self._base = None
+
+        for snapshot in self._getSnapshots():
+            if self._getMemory() <= self.MEMORY_BUDGET:
+                break
+            if self._folder is None:
+                self._folder = tempfile.TemporaryDirectory(prefix='imager')
+            if snapshot is self._base:
+                self._base = None
+            snapshot.spill(self._folder.name)
 
+        disk = sum(snapshot.getDiskSize() for snapshot in self._getSnapshots())
+        while disk > self.DISK_BUDGET:
+            self._drop()
+            disk = sum(snapshot.getDiskSize() for snapshot in self._getSnapshots())
@@ -0,0 +1,123 @@
+"""
+Image file support for the imager application.
+
+This module reads image files into Image objects and writes Image objects
+back out as PNG files. It is shared by the GUI (interface.py) and the test
+script (a6test.py), so that both handle images in exactly the same way.
+
+The image is decoded by PIL straight into the byte buffer of a compact Image
+(see Image.fromBytes). No Python object is created for an individual pixel,
+so even large photos load in a few milliseconds. Writing works the same way
+in reverse, and it can be done in a background thread.
+
+Julia Ludwig (jal545)
+11/14/20
+"""
+import a6image
+
+
+# The default zlib compression level for PNG files (0 is none, 9 is maximum)
+COMPRESS_LEVEL = 6
+
+# Whether PNG files are optimized for size by default (this is slow)
+OPTIMIZE = False
+
+
+def read_image(file):
+    """
+    Returns a compact Image object for the given image file.
+
+    The file may be in any format that PIL can read. Images that are not RGB
+    (e.g. RGBA or greyscale) are converted to RGB first. Unlike the GUI, this
+    function does not catch errors; if the file cannot be read, PIL raises
+    an exception (usually an OSError).
+
+    Parameter file: The image file
+    Precondition: file is a string naming a readable image file
+    """
+    from PIL import Image as CoreImage
+
+    with CoreImage.open(file) as image:
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return a6image.Image.fromBytes(image.tobytes(),image.size[0])
+
+
+def write_png(image, file, compress_level=COMPRESS_LEVEL, optimize=OPTIMIZE):
+    """
+    Writes image to the given file in PNG format.
+
+    The pixels are handed to PIL in a single call, so this takes little more
+    time than the PNG compression itself. Lower compression levels are faster
+    but produce larger files. Setting optimize makes PIL search for the
+    smallest encoding, which is much slower.
+
+    Like read_image, this function does not catch errors.
+
+    Parameter image: The image to write
+    Precondition: image is an Image object
+
+    Parameter file: The file to write to
+    Precondition: file is a string
+
+    Parameter compress_level: The zlib compression level
+    Precondition: compress_level is an int in 0..9
+
+    Parameter optimize: Whether to search for the smallest possible file
+    Precondition: optimize is a bool
+    """
+    from PIL import Image as CoreImage
+    assert type(compress_level) == int, repr(compress_level)+' is not an int.'
+    assert 0 <= compress_level <= 9, repr(compress_level)+' is not in 0..9.'
+    assert type(optimize) == bool, repr(optimize)+' is not a bool.'
+
+    size = (image.getWidth(),image.getHeight())
+    with image.getView() as view:
+        result = CoreImage.frombytes('RGB',size,view)
+    result.save(file,'PNG',compress_level=compress_level,optimize=optimize)
+
+
+def write_png_async(image, file, compress_level=COMPRESS_LEVEL, optimize=OPTIMIZE,
+                    callback=None):
+    """
+    Writes image to the given file in PNG format in a background thread.
+
+    This function returns the thread immediately. The thread writes a copy of
+    image, so the image may be edited while it is being saved. When the thread
+    is done, it calls callback(file, error), where error is None on success
+    or the exception that stopped the write. Note that the callback is called
+    in the background thread, not in the thread that called this function.
+
+    The thread is not a daemon, so the application will not quit halfway
+    through writing a file.
+
+    Parameter image: The image to write
+    Precondition: image is an Image object
+
+    Parameter file: The file to write to
+    Precondition: file is a string
+
+    Parameter compress_level: The zlib compression level
+    Precondition: compress_level is an int in 0..9
+
+    Parameter optimize: Whether to search for the smallest possible file
+    Precondition: optimize is a bool
+
+    Parameter callback: The function to call when the write is finished
+    Precondition: callback is None or callable with two arguments
+    """
+    import threading
+    snapshot = image.copy()
+
+    def work():
+        error = None
+        try:
+            write_png(snapshot,file,compress_level,optimize)
+        except Exception as e:
+            error = e
+        if callback:
+            callback(file,error)
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    return thread
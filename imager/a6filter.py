@@ -16,7 +16,56 @@ Julia Ludwig (jal545)
 11/14/20
 """
 import a6editor
+import a6image
+import a6vector
+import a6parallel
+import a6lut
 import math # Just in case
+import time
+import functools
+from contextlib import contextmanager
+
+
+def _trusted(method):
+    """
+    Returns a version of method that turns off pixel validation while it runs.
+
+    The filter operations compute every pixel they write, so there is no need
+    for the current image to check them (see Image.setChecked). This decorator
+    makes the current image unchecked for the duration of the call, provided
+    that the Filter attribute UNCHECKED is True.
+
+    Parameter method: The Filter method to wrap
+    Precondition: method is a Filter method that edits the current image
+    """
+    @functools.wraps(method)
+    def wrapper(self,*args):
+        if not self.UNCHECKED:
+            return method(self,*args)
+        with self.getCurrent().unchecked():
+            return method(self,*args)
+    return wrapper
+
+
+def _lazy(method):
+    """
+    Returns a version of method that is only recorded in lazy mode.
+
+    If the Filter attribute LAZY is True, calling the method adds it (with its
+    arguments) to the list of pending operations and returns immediately. The
+    operation is applied the next time someone reads the current image (see
+    Filter.getCurrent). Otherwise the method runs as usual.
+
+    Parameter method: The Filter method to wrap
+    Precondition: method is a Filter method that edits the current image
+    """
+    @functools.wraps(method)
+    def wrapper(self,*args):
+        if self.LAZY and not self._evaluating:
+            self._pending.append((method.__name__,args,self._editing))
+            return
+        return method(self,*args)
+    return wrapper
 
 
 class Filter(a6editor.Editor):
@@ -35,13 +84,284 @@ class Filter(a6editor.Editor):
 
     Each one of the non-hidden functions should edit the most recent image
     in the edit history (which is inherited from Editor).
+
+    If NumPy is installed, every operation runs on the whole image at once
+    using the engine in a6vector. The pure-Python code below is used when
+    NumPy is missing, or when VECTORIZE is False. Both produce identical
+    images.
+
+    The pure-Python operations skip the precondition checks on the pixels
+    that they write, since they compute those pixels themselves (see the
+    decorator _trusted). Set UNCHECKED to False to check them anyway.
+
+    Attribute VECTORIZE: A CLASS ATTRIBUTE for whether to use the NumPy engine
+    Invariant: VECTORIZE is a bool
+
+    The color transforms (invert, monochromify and look) map each color to a
+    new color, so they can be done with lookup tables (see a6lut). If LOOKUP
+    is True, monochromify and invert use those tables when they are faster
+    than the code below (invert without NumPy, monochromify always). The
+    result is identical either way.
+
+    Attribute LOOKUP: A CLASS ATTRIBUTE for whether to use lookup tables
+    Invariant: LOOKUP is a bool
+
+    The operations invert, monochromify, vignette and pixellate can also
+    split a large image into bands and process them in several worker
+    processes at once (see a6parallel). This is off by default; set WORKERS
+    to the number of processes to use. Images with fewer than PARALLEL_MINIMUM
+    pixels are always processed in one piece, since starting the work costs
+    more than it saves. Again, the result is identical either way.
+
+    The operations invert, monochromify and vignette (listed in POINTWISE)
+    change each pixel on its own. A chain of them can be applied in a single
+    pass over the image with pipeline, which gives the same result as calling
+    them one at a time.
+
+    The operations invert, transpose, reflectHori, reflectVert, rotateLeft
+    and rotateRight are exactly undone by another operation (listed in
+    INVERSES). So the Editor does not need a snapshot to undo them.
+
+    Those same operations (except invert) only move pixels around. If
+    SYMBOLIC is True, they just record the new orientation of the current
+    image (see Image.reorient), which takes constant time. A chain of them
+    is carried out in a single pass over the pixels the next time the image
+    is read, or not at all if they cancel out.
+
+    If LAZY is True, calling an operation only records it. The pending
+    operations are applied all at once the next time the current image is
+    read with getCurrent (by the display, by saving, or by another operation).
+    Before that they are optimized as a whole: an operation followed by its
+    inverse is dropped, and runs of pointwise operations are fused (see
+    pipeline). An edit that is undone before anyone reads the image is never
+    computed at all. Note that the preconditions of a pending operation are
+    only checked when it is applied.
+
+    Attribute UNCHECKED: A CLASS ATTRIBUTE for whether to skip pixel validation
+    Invariant: UNCHECKED is a bool
+
+    Attribute WORKERS: A CLASS ATTRIBUTE for the number of worker processes
+    Invariant: WORKERS is an int > 0
+
+    Attribute PARALLEL_MINIMUM: A CLASS ATTRIBUTE for the smallest image to split
+    Invariant: PARALLEL_MINIMUM is an int >= 0
+
+    Attribute LAZY: A CLASS ATTRIBUTE for whether to defer the operations
+    Invariant: LAZY is a bool
+
+    Attribute SYMBOLIC: A CLASS ATTRIBUTE for whether to reorient symbolically
+    Invariant: SYMBOLIC is a bool
+
+    A Filter can also report its progress (see setMonitor). Then the
+    operations that can be split into bands (see a6parallel.OPERATIONS)
+    process the current image one band of about PROGRESS_SIZE bytes at a
+    time when they are called by perform, and call the monitor after each
+    band. In parallel, each band is WORKERS times as large and is split among
+    the worker processes. This lets the display show the result as it fills in. The monitor
+    can stop the operation, in which case perform undoes the edit. This is
+    only done when LAZY is False. Again, the result is identical either way.
+
+    Attribute PROGRESS_SIZE: A CLASS ATTRIBUTE for the bytes in a monitored band
+    Invariant: PROGRESS_SIZE is an int > 0
     """
+    # MUTABLE ATTRIBUTES (In addition to those in Editor)
+    # Attribute _pending: The operations not yet applied to the current image
+    # Invariant: _pending is a list of tuples (name, args, edit), where edit is
+    # True if the operation was recorded in the history by perform. All of the
+    # pending edits are the most recent edits in the history.
+    #
+    # Attribute _evaluating: Whether operations are being applied right now
+    # Invariant: _evaluating is a bool
+    #
+    # Attribute _editing: Whether perform is running
+    # Invariant: _editing is a bool
+    #
+    # Attribute _monitor: The function called after each band (see setMonitor)
+    # Invariant: _monitor is None or a function as described in setMonitor
+    #
+    # Attribute _aborted: Whether the monitor stopped the running operation
+    # Invariant: _aborted is a bool
+
+    # Whether to use the vectorized engine when it is available
+    VECTORIZE = True
+
+    # Whether to apply the color transforms with lookup tables
+    LOOKUP = True
+
+    # Whether to skip pixel validation inside of the operations
+    UNCHECKED = True
+
+    # The number of processes to use for large images (1 means no parallelism)
+    WORKERS = 1
+
+    # The number of pixels an image needs before it is split into bands
+    PARALLEL_MINIMUM = 1000000
+
+    # Whether to record the operations and apply them when the image is read
+    LAZY = False
+
+    # Whether to transpose, rotate and reflect by changing the orientation
+    SYMBOLIC = True
+
+    # The number of bytes in a band of rows processed between calls to the monitor (1M)
+    PROGRESS_SIZE = 1 << 20
+
+    # The operations that change each pixel on its own
+    POINTWISE = ('invert','monochromify','vignette')
+
+    # The operations that are undone by another operation
+    INVERSES = {'invert':'invert', 'transpose':'transpose',
+                'reflectHori':'reflectHori', 'reflectVert':'reflectVert',
+                'rotateLeft':'rotateRight', 'rotateRight':'rotateLeft'}
+
+    # GETTERS
+    def getCurrent(self):
+        """
+        Returns the most recent edit
+
+        Any pending operations (see LAZY) are applied first.
+        """
+        if self._pending and not self._evaluating:
+            self._flush()
+        return super().getCurrent()
+
+    # INITIALIZER
+    def __init__(self,original):
+        """
+        Initializes an edit history for the given image.
+
+        Parameter original: The image to edit
+        Precondition: original is an Image object
+        """
+        self._pending = []
+        self._evaluating = False
+        self._editing = False
+        self._monitor = None
+        self._aborted = False
+        super().__init__(original)
+
+    # EDIT METHODS
+    def undo(self):
+        """
+        Returns True if the latest edit can be undone, False otherwise.
+
+        If the latest edit is still pending (see LAZY), it is simply dropped.
+        Otherwise this is the same as Editor.undo.
+        """
+        if self._pending and self._pending[-1][2]:
+            self._pending.pop()
+            self._log.pop()
+            snapshot = self._history.pop()
+            if snapshot is not None:
+                snapshot.discard()
+            return True
+        self._flush()
+        return super().undo()
+
+    def clear(self):
+        """
+        Deletes the entire edit history, retoring the original image.
+
+        Any pending operations are dropped.
+        """
+        self._pending = []
+        super().clear()
+
+    def increment(self):
+        """
+        Adds a new copy of the image to the edit history.
+
+        Any pending operations are applied first.
+        """
+        self._flush()
+        super().increment()
+
+    def perform(self, name, *args):
+        """
+        Adds a new edit to the history and applies the given operation.
+
+        In lazy mode the operation is only recorded, and the edit gets no
+        snapshot unless it must be a keyframe (see Editor).
+
+        This method returns True, unless the monitor stops the operation (see
+        setMonitor). Then the edit is undone and it returns False.
+
+        Parameter name: The name of the operation
+        Precondition: name is a string naming a Filter operation
+
+        Parameter args: The arguments to the operation
+        Precondition: args are valid arguments for the operation
+        """
+        self._editing = True
+        self._aborted = False
+        try:
+            super().perform(name,*args)
+        finally:
+            self._editing = False
+        if not self._aborted:
+            return True
+
+        self._aborted = False
+        if name in self.INVERSES:
+            # The finished rows are already restored (see _progress)
+            self._log.pop()
+            snapshot = self._history.pop()
+            if snapshot is not None:
+                snapshot.discard()
+        else:
+            self._log[-1] = None    # Restore the snapshot
+            self.undo()
+        return False
+
+    def getMonitor(self):
+        """
+        Returns the function called as each band of an operation is finished.
+
+        The value is None if there is no monitor.
+        """
+        return self._monitor
+
+    def setMonitor(self, monitor):
+        """
+        Sets the function called as each band of an operation is finished.
+
+        The monitor is called as monitor(image, top, bottom) after rows top
+        up to (but not including) bottom of image, the current image, are
+        finished. It is called from the thread running perform, so it should
+        not do any more than hand those rows to the display (see
+        InterfacePanel.publish_band). If it returns False, the operation stops
+        and perform undoes the edit. The rows of a band are marked dirty (see
+        Image.getDirty) before the monitor is called.
+
+        Parameter monitor: The function to call after each band
+        Precondition: monitor is None or a function as described above
+        """
+        assert monitor is None or callable(monitor), repr(monitor)+' is not callable.'
+        self._monitor = monitor
 
     # PROVIDED ACTIONS (STUDY THESE)
+    @_lazy
+    @_trusted
     def invert(self):
         """
         Inverts the current image, replacing each element with its color complement
         """
+        if self._isMonitored():
+            self._progress('invert',())
+            return
+
+        if self._isParallel():
+            a6parallel.apply(self.getCurrent(),'invert',(),self.WORKERS,editor=self)
+            return
+
+        if self._isVectorized():
+            a6vector.invert(self.getCurrent())
+            return
+
+        if self.LOOKUP:
+            a6lut.INVERT.apply(self.getCurrent(),False)
+            return
+
         current = self.getCurrent()
         for pos in range(len(current)): # We can do this because of __len__
             rgb = current[pos]          # We can do this because of __getitem__
@@ -51,6 +371,8 @@ class Filter(a6editor.Editor):
             rgb = (red,green,blue)      # New pixel value
             current[pos] = rgb          # We can do this because of __setitem__
 
+    @_lazy
+    @_trusted
     def transpose(self):
         """
         Transposes the current image
@@ -60,6 +382,13 @@ class Filter(a6editor.Editor):
         current image and use that as a reference.  So we change the current
         image with setPixel, but read (with getPixel) from the copy.
         """
+        if self.SYMBOLIC:
+            self.getCurrent().reorient('transpose')
+            return
+        if self._isVectorized():
+            a6vector.transpose(self.getCurrent())
+            return
+
         current  = self.getCurrent()
         original = current.copy()
         current.setWidth(current.getHeight())
@@ -68,16 +397,27 @@ class Filter(a6editor.Editor):
             for col in range(current.getWidth()):   # Loop over the columnns
                 current.setPixel(row,col,original.getPixel(col,row))
 
+    @_lazy
+    @_trusted
     def reflectHori(self):
         """
         Reflects the current image around the horizontal middle.
         """
+        if self.SYMBOLIC:
+            self.getCurrent().reorient('reflectHori')
+            return
+        if self._isVectorized():
+            a6vector.reflectHori(self.getCurrent())
+            return
+
         current = self.getCurrent()
         for h in range(current.getWidth()//2):      # Loop over the columnns
             for row in range(current.getHeight()):  # Loop over the rows
                 k = current.getWidth()-1-h
                 current.swapPixels(row,h,row,k)
 
+    @_lazy
+    @_trusted
     def rotateRight(self):
         """
         Rotates the current image right by 90 degrees.
@@ -86,6 +426,13 @@ class Filter(a6editor.Editor):
         horizontal reflection. However, this is slow, so we use the faster
         strategy below.
         """
+        if self.SYMBOLIC:
+            self.getCurrent().reorient('rotateRight')
+            return
+        if self._isVectorized():
+            a6vector.rotateRight(self.getCurrent())
+            return
+
         current  = self.getCurrent()
         original = current.copy()
         current.setWidth(current.getHeight())
@@ -94,6 +441,8 @@ class Filter(a6editor.Editor):
             for col in range(current.getWidth()):   # Loop over the columnns
                 current.setPixel(row,col,original.getPixel(original.getHeight()-col-1,row))
 
+    @_lazy
+    @_trusted
     def rotateLeft(self):
         """
         Rotates the current image left by 90 degrees.
@@ -102,6 +451,13 @@ class Filter(a6editor.Editor):
         vertical reflection. However, this is slow, so we use the faster
         strategy below.
         """
+        if self.SYMBOLIC:
+            self.getCurrent().reorient('rotateLeft')
+            return
+        if self._isVectorized():
+            a6vector.rotateLeft(self.getCurrent())
+            return
+
         current  = self.getCurrent()
         original = current.copy()
         current.setWidth(current.getHeight())
@@ -111,16 +467,27 @@ class Filter(a6editor.Editor):
                 current.setPixel(row,col,original.getPixel(col,original.getWidth()-row-1))
 
     # ASSIGNMENT METHODS (IMPLEMENT THESE)
+    @_lazy
+    @_trusted
     def reflectVert(self):
         """
         Reflects the current image around the vertical middle.
         """
+        if self.SYMBOLIC:
+            self.getCurrent().reorient('reflectVert')
+            return
+        if self._isVectorized():
+            a6vector.reflectVert(self.getCurrent())
+            return
+
         current = self.getCurrent()
         for col in range(current.getWidth()):
             for row in range(current.getHeight()//2):
                 row_to_swap = current.getHeight()-1-row
                 current.swapPixels(row,col,row_to_swap,col)
 
+    @_lazy
+    @_trusted
     def monochromify(self, sepia):
         """
         Converts the current image to monochrome (greyscale or sepia tone).
@@ -140,6 +507,23 @@ class Filter(a6editor.Editor):
         """
         assert type(sepia)==bool, repr(sepia)+' is not a bool.'
 
+        if self._isMonitored():
+            self._progress('monochromify',(sepia,))
+            return
+
+        if self._isParallel():
+            a6parallel.apply(self.getCurrent(),'monochromify',(sepia,),self.WORKERS,editor=self)
+            return
+
+        if self.LOOKUP:
+            look = a6lut.SEPIA if sepia else a6lut.GREYSCALE
+            look.apply(self.getCurrent(),self._isVectorized())
+            return
+
+        if self._isVectorized():
+            a6vector.monochromify(self.getCurrent(),sepia)
+            return
+
         current=self.getCurrent()
         if not sepia:
             for x in range(len(current)):
@@ -151,6 +535,8 @@ class Filter(a6editor.Editor):
                 current[x]=(
                 int(brightness),int(0.6*brightness),int(0.4*brightness))
 
+    @_lazy
+    @_trusted
     def jail(self):
         """
         Puts jail bars on the current image
@@ -165,21 +551,31 @@ class Filter(a6editor.Editor):
         not counting the two bars on the outside.
 
         The n+2 vertical bars should be as evenly spaced as possible.
+
+        The bars are drawn with Image.drawGrid, which writes whole slices of
+        pixels at a time, so there is no separate vectorized version.
+
+        Precondition: the current image has at least 3 rows (for the bars across
+        top and bottom) and 8 columns (for the bars down left and right)
         """
         pixel = (255,0,0)
         current = self.getCurrent()
-
-        self._drawHBar(0,pixel)
-        self._drawHBar(current.getHeight()-3,pixel)
+        assert current.getHeight()>=3, 'The image is too short for a jail.'
+        assert current.getWidth()>=8, 'The image is too narrow for a jail.'
 
         n=(current.getWidth()-8)//50
         space=(current.getWidth()-(4*(n+2)))/(n+1)
 
+        cols=[]
         col=0
         for x in range(n+2):
-            self._drawVBar(int(col),pixel)
+            cols.append(int(col))
             col = col + 4 + space
 
+        current.drawGrid([0,current.getHeight()-3],cols,pixel,3,4)
+
+    @_lazy
+    @_trusted
     def vignette(self):
         """
         Modifies the current image to simulates vignetting (corner darkening).
@@ -199,24 +595,18 @@ class Filter(a6editor.Editor):
         Furthermore, when the final color value is calculated for each pixel,
         the result should be converted to int, but not rounded.
         """
-        current=self.getCurrent()
-        hfD=0.5*math.sqrt((current.getWidth()**2+current.getHeight()**2))
+        if self._isMonitored():
+            self._progress('vignette',())
+            return
 
-        for row in range(current.getHeight()):
-            for col in range(current.getWidth()):
-                d = math.sqrt(
-                (row-current.getHeight()/2)**2+(col-current.getWidth()/2)**2)
-                v=1 - (d / hfD)**2
-                pixel=current.getPixel(row,col)
-                red=pixel[0]
-                green=pixel[1]
-                blue=pixel[2]
-                new_red=v*red
-                new_green=v*green
-                new_blue=v*blue
-                new_pixel=(int(new_red),int(new_green),int(new_blue))
-                current.setPixel(row,col,new_pixel)
+        if self._isParallel():
+            a6parallel.apply(self.getCurrent(),'vignette',(),self.WORKERS,editor=self)
+            return
+
+        self._vignette(0,self.getCurrent().getHeight())
 
+    @_lazy
+    @_trusted
     def pixellate(self,step):
         """
         Pixellates the current image to give it a blocky feel.
@@ -240,79 +630,557 @@ class Filter(a6editor.Editor):
         assert type(step)==int, repr(step)+' is not an int.'
         assert step>0, repr(step)+' is not > 0.'
 
-        current=self.getCurrent()
-        num_x_blocks=math.ceil(current.getWidth()/step)
-        num_y_blocks=math.ceil(current.getHeight()/step)
-        for x_block in range(num_x_blocks):
-            for y_block in range(num_y_blocks):
-                red=0
-                green=0
-                blue=0
-                pixels=0
-                for x in range(step):
-                    for y in range(step):
-                        x_location=x+x_block*step
-                        y_location=y+y_block*step
-                        if x_location < current.getWidth() and
-                        \y_location < current.getHeight():
-                            pixel=current.getPixel(y_location,x_location)
-                            red+=pixel[0]
-                            green+=pixel[1]
-                            blue+=pixel[2]
-                            pixels+=1
-                red=red//pixels
-                green=green//pixels
-                blue=blue//pixels
-                avg_pixel=(red,green,blue)
-                for x in range(step):
-                    for y in range(step):
-                        x_location=x+x_block*step
-                        y_location=y+y_block*step
-                        if x_location < current.getWidth() and \
-                        y_location < current.getHeight():
-                            current.setPixel(y_location,x_location,avg_pixel)
+        if self._isMonitored():
+            self._progress('pixellate',(step,),step)
+            return
+
+        if self._isParallel():
+            # Bands must not split a block
+            a6parallel.apply(self.getCurrent(),'pixellate',(step,),self.WORKERS,step,editor=self)
+            return
+
+        if self._isVectorized():
+            a6vector.pixellate(self.getCurrent(),step)
+            return
+
+        self._pixellate(self.getCurrent(),step)
 
+    def pixellations(self, steps):
+        """
+        Returns an iterator of tuples (step, image) pixellating the current image.
+
+        There is one tuple for each step, in order, where image is a copy of
+        the current image pixellated with that step (see pixellate). The
+        current image is not changed. With the vectorized engine, all of the
+        images come from a single summed-area table of the current image (see
+        a6vector.integral), so each step only adds the pass that fills in its
+        blocks. The images are made one at a time, as they are needed.
+
+        Parameter steps: The numbers of pixels in a pixellated block
+        Precondition: steps is a non-empty list of ints > 0
+        """
+        assert type(steps)==list and len(steps)>0, repr(steps)+' is not a non-empty list.'
+        for step in steps:
+            assert type(step)==int, repr(step)+' is not an int.'
+            assert step>0, repr(step)+' is not > 0.'
+        return self._pixellations(self.getCurrent(),steps)
+
+    @_lazy
+    @_trusted
+    def look(self, name):
+        """
+        Applies the look registered under name to the current image.
+
+        A look is a color transform made of lookup tables, like a levels or
+        curves adjustment (see a6lut). New looks are added with a6lut.register.
+
+        Parameter name: The name of the look
+        Precondition: name is a key of a6lut.LOOKS
+        """
+        assert name in a6lut.LOOKS, repr(name)+' is not a registered look.'
+        a6lut.LOOKS[name].apply(self.getCurrent(),self._isVectorized())
+
+    def preview(self, width, height, name, *args):
+        """
+        Returns a quick preview of the given operation on the current image.
+
+        The preview is the result of the operation on a copy of the current
+        image that is shrunk to fit in width x height (see Image.downscale),
+        so it takes a fraction of the time of the real operation. Pixellate
+        uses a step shrunk by the same amount, so the blocks look the same.
+        The current image is not changed, and nothing is added to the history.
+
+        The value returned is None if the current image already fits, since
+        then the preview would be no faster than the operation itself. It is
+        also None for jail, as the number of bars depends on the width, and
+        the bars are too thin to shrink.
+
+        Parameter width: The most columns in the preview
+        Precondition: width is an int > 0
+
+        Parameter height: The most rows in the preview
+        Precondition: height is an int > 0
+
+        Parameter name: The operation to preview
+        Precondition: name is the name of a Filter operation, and args are
+        valid arguments for it
+        """
+        assert type(width)==int and width>0, repr(width)+' is not an int > 0.'
+        assert type(height)==int and height>0, repr(height)+' is not an int > 0.'
+        factor = self._getFactor(width,height)
+        if factor == 1 or name == 'jail':
+            return None
+
+        if name == 'pixellate':
+            args = (max(1,args[0]//factor),)
+        editor = type(self)(self.getCurrent().downscale(factor))
+        getattr(editor,name)(*args)
+        return editor.getCurrent()
+
+    def shrink(self, width, height):
+        """
+        Returns a tuple (image, factor) with a copy of the current image that fits in width x height.
+
+        The image is the current image shrunk factor times (see Image.downscale),
+        where factor is the smallest int that makes it fit. This is the image
+        that preview applies an operation to. If the current image already
+        fits, factor is 1 and image is a plain copy. Like any copy, the image
+        can be used in another thread while the current image changes.
+
+        Parameter width: The most columns in the image
+        Precondition: width is an int > 0
+
+        Parameter height: The most rows in the image
+        Precondition: height is an int > 0
+        """
+        assert type(width)==int and width>0, repr(width)+' is not an int > 0.'
+        assert type(height)==int and height>0, repr(height)+' is not an int > 0.'
+        factor = self._getFactor(width,height)
+        return (self.getCurrent().downscale(factor),factor)
+
+    # PIPELINES
+    @_lazy
+    @_trusted
+    def pipeline(self, actions):
+        """
+        Applies a chain of operations to the current image.
+
+        This is the same as calling each operation in order, except that any
+        run of consecutive operations in POINTWISE is fused into a single pass
+        over the image (see _fuse). Each pixel is then read and written once
+        for the whole run, rather than once for each operation. The other
+        operations are called as usual.
+
+        Parameter actions: The operations to apply, in order
+        Precondition: actions is a list of tuples whose first element is the
+        name of a Filter operation, followed by valid arguments for it
+        """
+        assert type(actions) in [list,tuple], repr(actions)+' is not a list.'
+        run = []
+        for action in actions:
+            assert type(action) == tuple and len(action) > 0, \
+            repr(action)+' is not an action.'
+            if action[0] in self.POINTWISE:
+                self._checkPointwise(action)
+                run.append(action)
+            else:
+                self._applyRun(run)
+                run = []
+                getattr(self,action[0])(*action[1:])
+        self._applyRun(run)
 
     # HELPER METHODS
-    def _drawHBar(self, row, pixel):
+    @contextmanager
+    def _evaluation(self):
+        """
+        Returns a context manager that makes the operations run immediately.
+
+        Inside of the with block, operations are applied instead of recorded,
+        and reading the current image does not apply the pending operations.
+        """
+        evaluating = self._evaluating
+        self._evaluating = True
+        try:
+            yield
+        finally:
+            self._evaluating = evaluating
+
+    def _flush(self):
+        """
+        Applies all of the pending operations to the current image.
+
+        The operations are optimized first (see _optimize) and applied with
+        pipeline. The time this takes is shared out among the pending edits
+        in the history, so that keyframes are placed as usual.
+        """
+        if not self._pending or self._evaluating:
+            return
+
+        pending = self._pending
+        self._pending = []
+        actions = self._optimize([(name,)+args for (name,args,edit) in pending])
+
+        start = time.perf_counter()
+        with self._evaluation():
+            self.pipeline(actions)
+        cost = time.perf_counter()-start
+
+        edits = sum(1 for (name,args,edit) in pending if edit)
+        for pos in range(len(self._log)-min(edits,len(self._log)),len(self._log)):
+            if self._log[pos] is not None:
+                (name,args,old) = self._log[pos]
+                self._log[pos] = (name,args,cost/edits)
+
+    def _optimize(self, actions, result=None):
+        """
+        Returns an equivalent, but cheaper, list of operations.
+
+        Pipelines are expanded into their operations, and any operation that
+        is followed by its inverse (see INVERSES) is dropped along with the
+        inverse. This is repeated, so rotateLeft, invert, invert, rotateRight
+        is no operation at all.
+
+        Parameter actions: The operations to optimize, in order
+        Precondition: actions is a list of tuples whose first element is the
+        name of a Filter operation, followed by valid arguments for it
+
+        Parameter result: The list to add the operations to (or None for a new list)
+        Precondition: result is None or an optimized list of operations
+        """
+        if result is None:
+            result = []
+        for action in actions:
+            if action[0] == 'pipeline':
+                self._optimize(action[1],result)
+            elif result and self._cancels(result[-1],action):
+                result.pop()
+            else:
+                result.append(action)
+        return result
+
+    def _cancels(self, first, second):
+        """
+        Returns True if the operation second undoes the operation first.
+
+        Parameter first: The first operation
+        Precondition: first is a tuple whose first element is an operation name
+
+        Parameter second: The second operation
+        Precondition: second is a tuple whose first element is an operation name
+        """
+        return first[0] in self.INVERSES and second == (self.INVERSES[first[0]],)
+
+    def _isReplay(self):
+        """
+        Returns True if perform should record operations instead of snapshots.
+
+        Lazy mode always records operations, as the point is to not compute
+        the image.
+        """
+        return self.REPLAY or self.LAZY
+
+    def _rebuild(self, pos):
+        """
+        Returns a new Image with the image from before the edit at pos.
+
+        The operations replayed on the image are applied immediately, even
+        in lazy mode.
+
+        Parameter pos: The position of the edit in the history
+        Precondition: pos is an int, 0 <= pos < len(_history)
+        """
+        with self._evaluation():
+            return super()._rebuild(pos)
+
+    def _drop(self):
         """
-        Draws a horizontal bar on the current image at the given row.
+        Deletes the oldest edit in the history.
 
-        This method draws a horizontal 3-pixel-wide bar at the given row
-        of the current image. This means that the bar includes the pixels
-        row, row+1, and row+2. The bar uses the color given by the pixel
-        value.
+        If that edit is still pending (see LAZY), its operation is kept, as
+        the later edits depend on it, but it can no longer be undone on its
+        own. The pending edits are always the latest ones in the history,
+        except that perform adds an edit to the history before its operation
+        is recorded.
+        """
+        edits = [pos for pos in range(len(self._pending)) if self._pending[pos][2]]
+        newest = 1 if self._editing else 0
+        if edits and len(edits)+newest >= len(self._log):
+            (name,args,edit) = self._pending[edits[0]]
+            self._pending[edits[0]] = (name,args,False)
+        super()._drop()
+
+    def _getFactor(self, width, height):
+        """
+        Returns the smallest int that the current image can be shrunk by to fit in width x height.
 
-        Parameter row: The start of the row to draw the bar
-        Precondition: row is an int, 0 <= row  &&  row+2 < image height
+        Parameter width: The most columns
+        Precondition: width is an int > 0
 
-        Parameter pixel: The pixel color to use
-        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        Parameter height: The most rows
+        Precondition: height is an int > 0
         """
         current = self.getCurrent()
-        for col in range(current.getWidth()):
-            current.setPixel(row,   col, pixel)
-            current.setPixel(row+1, col, pixel)
-            current.setPixel(row+2, col, pixel)
+        return max(-(-current.getWidth()//width),-(-current.getHeight()//height))
+
+    def _isVectorized(self):
+        """
+        Returns True if the operations should use the vectorized engine.
+
+        This is the case if VECTORIZE is True and NumPy is installed.
+        """
+        return self.VECTORIZE and a6vector.AVAILABLE
+
+    def _isParallel(self):
+        """
+        Returns True if the operations should split the image into bands.
+
+        This is the case if WORKERS > 1 and the current image has at least
+        PARALLEL_MINIMUM pixels.
+        """
+        return self.WORKERS > 1 and len(self.getCurrent()) >= self.PARALLEL_MINIMUM
+
+    def _isMonitored(self):
+        """
+        Returns True if the operations should process bands for the monitor.
+
+        This is the case if there is a monitor, LAZY is False and the
+        operation is being applied by perform.
+        """
+        return self._monitor is not None and not self.LAZY and self._editing
+
+    def _progress(self, name, args, align=1):
+        """
+        Applies the given operation to the current image one band at a time.
+
+        Each band is about PROGRESS_SIZE bytes, and starts on a multiple of
+        align rows. It is processed by a Filter with the same class and flags
+        as this one, just like a band in a worker process (see
+        a6parallel.apply_band), and written back to the
+        current image as soon as it is done. If the image is large enough to
+        be processed in parallel (see WORKERS), the bands are WORKERS times as
+        large instead, and each one is split among the worker processes. Then
+        the monitor is called. If it
+        returns False, the remaining bands are skipped. An operation in
+        INVERSES (which can only be invert here) has no snapshot to undo the
+        edit with, so in that case the finished rows are put back right away.
+
+        Parameter name: The operation to apply
+        Precondition: name is an element of a6parallel.OPERATIONS
 
-    def _drawVBar(self, col, pixel):
+        Parameter args: The arguments to the operation
+        Precondition: args is a tuple of valid arguments for the operation
+
+        Parameter align: The number that band boundaries must be a multiple of
+        Precondition: align is an int > 0
+        """
+        current = self.getCurrent()
+        width  = current.getWidth()
+        height = current.getHeight()
+        workers = self.WORKERS if self._isParallel() else 1
+        rows   = max(1,self.PROGRESS_SIZE//(3*width))*workers
+        count  = -(-height//rows)
+        for (top, bottom) in a6parallel.bands(height,count,align):
+            band = a6image.Image.fromBytes(current.getRegion(top,0,bottom-top,width),width)
+            if workers > 1:
+                a6parallel.apply(band,name,args,workers,align,top,height,editor=self)
+            else:
+                editor = a6parallel.make_editor(band,a6parallel.settings(self))
+                a6parallel.apply_band(editor,name,args,top,height)
+                band = editor.getCurrent()
+            with current.unchecked():
+                current.setRegion(top,0,bottom-top,width,band.getBytes())
+            if self._monitor(current,top,bottom) is False:
+                self._aborted = True
+                if name in self.INVERSES:
+                    editor = type(self)(a6image.Image.fromBytes(current.getRegion(0,0,bottom,width),width))
+                    getattr(editor,self.INVERSES[name])()
+                    with current.unchecked():
+                        current.setRegion(0,0,bottom,width,editor.getCurrent().getBytes())
+                return
+
+    def _checkPointwise(self, action):
+        """
+        Asserts that action is a valid pointwise operation with its arguments.
+
+        Parameter action: The operation to check
+        Precondition: action is a tuple whose first element is in POINTWISE
+        """
+        if action[0] == 'monochromify':
+            assert len(action) == 2, repr(action)+' does not have one argument.'
+            assert type(action[1])==bool, repr(action[1])+' is not a bool.'
+        else:
+            assert len(action) == 1, repr(action)+' does not take arguments.'
+
+    def _applyRun(self, actions):
+        """
+        Applies a run of pointwise operations to the current image in one pass.
+
+        An empty run does nothing, and a single operation is simply called.
+        Longer runs are fused, in bands across several processes if the image
+        is large enough.
+
+        Parameter actions: The operations to apply, in order
+        Precondition: actions is a list of valid pointwise operations
         """
-        Draws a vertical bar on the current image at the given row.
+        if not actions:
+            return
+        if len(actions) == 1:
+            getattr(self,actions[0][0])(*actions[0][1:])
+        elif self._isParallel():
+            a6parallel.apply(self.getCurrent(),'fuse',(actions,),self.WORKERS,editor=self)
+        else:
+            self._fuse(actions,0,self.getCurrent().getHeight())
+
+    def _fuse(self, actions, top, height):
+        """
+        Applies a chain of pointwise operations to the current image in one pass.
+
+        Like _vignette, the current image is treated as the rows starting at
+        top of an image that is height rows tall. The result is the same as
+        calling the operations one after the other.
 
-        This method draws a vertical 4-pixel-wide bar at the given col
-        of the current image. This means that the bar includes the pixels
-        col, col+1, and col+2. The bar uses the color given by the pixel
-        value.
+        Parameter actions: The operations to apply, in order
+        Precondition: actions is a list of valid pointwise operations
 
-        Parameter col: The start of the col to draw the bar
-        Precondition: col is an int, 0 <= col  &&  col+3 < image width
+        Parameter top: The row of the taller image where this image starts
+        Precondition: top is an int >= 0
 
-        Parameter pixel: The pixel color to use
-        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        Parameter height: The height of the taller image
+        Precondition: height is an int >= top + current image height
         """
+        if self._isVectorized():
+            a6vector.fuse(self.getCurrent(),actions,top,height)
+            return
+
         current = self.getCurrent()
+        width = current.getWidth()
+        steps = [self._getKernel(action,width,top,height) for action in actions]
+        for row in range(current.getHeight()):
+            for col in range(width):
+                pixel = current.getPixel(row,col)
+                for step in steps:
+                    pixel = step(pixel,row,col)
+                current.setPixel(row,col,pixel)
+
+    def _getKernel(self, action, width, top, height):
+        """
+        Returns a function that applies a pointwise operation to one pixel.
+
+        The function is called as kernel(pixel, row, col) and returns the new
+        pixel, computed exactly as the operation itself would. The position is
+        relative to the current image (see _fuse).
+
+        Parameter action: The operation to apply
+        Precondition: action is a valid pointwise operation
+
+        Parameter width: The width of the image
+        Precondition: width is an int > 0
+
+        Parameter top: The row of the taller image where this image starts
+        Precondition: top is an int >= 0
+
+        Parameter height: The height of the taller image
+        Precondition: height is an int > 0
+        """
+        if action[0] == 'invert':
+            return lambda rgb, row, col: (255-rgb[0],255-rgb[1],255-rgb[2])
+
+        if action[0] == 'monochromify':
+            sepia = action[1]
+            def monochromify(rgb, row, col):
+                brightness=0.3*rgb[0]+0.6*rgb[1]+0.1*rgb[2]
+                if sepia:
+                    return (int(brightness),int(0.6*brightness),int(0.4*brightness))
+                return (int(brightness),int(brightness),int(brightness))
+            return monochromify
+
+        hfD=0.5*math.sqrt((width**2+height**2))
+        def vignette(rgb, row, col):
+            d = math.sqrt((top+row-height/2)**2+(col-width/2)**2)
+            v=1 - (d / hfD)**2
+            return (int(v*rgb[0]),int(v*rgb[1]),int(v*rgb[2]))
+        return vignette
+
+    def _pixellations(self, current, steps):
+        """
+        Yields a tuple (step, image) pixellating current for each step.
+
+        This is the generator returned by pixellations. The table is shared
+        when the steps have a common divisor of at least 3; on a finer grid it
+        would take more memory than the image itself, so each step gets a
+        table of its own instead.
+
+        Parameter current: The image to pixellate
+        Precondition: current is an Image object
+
+        Parameter steps: The numbers of pixels in a pixellated block
+        Precondition: steps is a non-empty list of ints > 0
+        """
+        table=None
+        grid=functools.reduce(math.gcd,steps)
+        if self._isVectorized() and grid >= 3:
+            table=a6vector.integral(current,grid)
+
+        for step in steps:
+            image=current.copy()
+            if table is not None:
+                a6vector.pixellate(image,step,table,grid)
+            elif self._isVectorized():
+                a6vector.pixellate(image,step)
+            else:
+                self._pixellate(image,step)
+            yield (step,image)
+
+    def _pixellate(self, image, step):
+        """
+        Pixellates image without the vectorized engine.
+
+        See pixellate for the formula. Each block is summed one row at a time,
+        with a slice for each color, and each row of blocks is written with a
+        single slice per row. So no Python work is done for an individual
+        pixel, and edge blocks are never scanned beyond the image.
+
+        Parameter image: The image to change
+        Precondition: image is an Image object
+
+        Parameter step: The number of pixels in a pixellated block
+        Precondition: step is an int > 0
+        """
+        width=image.getWidth()
+        height=image.getHeight()
+        data=image.getBytes()
+        size=3*width
+        for top in range(0,height,step):
+            bottom=min(top+step,height)
+            line=bytearray()
+            for left in range(0,width,step):
+                right=min(left+step,width)
+                pixels=(bottom-top)*(right-left)
+                block=bytearray(3)
+                for k in range(3):
+                    total=0
+                    for row in range(top*size,bottom*size,size):
+                        total+=sum(data[row+3*left+k:row+3*right:3])
+                    block[k]=total//pixels
+                line+=block*(right-left)
+            for row in range(top*size,bottom*size,size):
+                data[row:row+size]=line
+        image.setBytes(data)
+
+    def _vignette(self, top, height):
+        """
+        Vignettes the current image as if it were a band of a taller image.
+
+        The current image is treated as the rows starting at top of an image
+        that is height rows tall (and just as wide). Every pixel is darkened
+        by its distance to the center of that taller image. This allows
+        a6parallel to vignette an image one band at a time. To vignette the
+        whole image, top is 0 and height is the image height.
+
+        Parameter top: The row of the taller image where this image starts
+        Precondition: top is an int >= 0
+
+        Parameter height: The height of the taller image
+        Precondition: height is an int >= top + current image height
+        """
+        if self._isVectorized():
+            a6vector.vignette(self.getCurrent(),top,height)
+            return
+
+        current=self.getCurrent()
+        hfD=0.5*math.sqrt((current.getWidth()**2+height**2))
+
         for row in range(current.getHeight()):
-            current.setPixel(row, col, pixel)
-            current.setPixel(row, col+1, pixel)
-            current.setPixel(row, col+2, pixel)
-            current.setPixel(row, col+3, pixel)
+            for col in range(current.getWidth()):
+                d = math.sqrt(
+                (top+row-height/2)**2+(col-current.getWidth()/2)**2)
+                v=1 - (d / hfD)**2
+                pixel=current.getPixel(row,col)
+                red=pixel[0]
+                green=pixel[1]
+                blue=pixel[2]
+                new_red=v*red
+                new_green=v*green
+                new_blue=v*blue
+                new_pixel=(int(new_red),int(new_green),int(new_blue))
+                current.setPixel(row,col,new_pixel)
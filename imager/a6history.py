@@ -0,0 +1,342 @@
+"""
+Edit history storage for the imager application.
+
+The Editor keeps an image for every edit that can be undone. Storing a full
+copy of the image for each one wastes a lot of memory, since most edits leave
+much of the image unchanged. This module provides Snapshot, an immutable copy
+of an image that is stored in fixed-size chunks. When a snapshot is taken, any
+chunk that is the same as in the previous snapshot is shared with it instead
+of being copied. So a history of edits costs one full image plus the chunks
+that the edits actually changed.
+
+The Editor marks the image clean after each snapshot (see Image.markClean),
+so the next snapshot is given the rectangles written since then. Only the
+chunks that overlap them are read, and every other chunk is shared without
+looking at it. So taking a snapshot after a small edit is fast as well. When
+the written rectangles are not known (for example, after a rotation), every
+chunk of the image is compared with the previous snapshot instead, which
+reads the whole image.
+
+A snapshot can also be spilled to disk, where its chunks are compressed with
+zlib. The Editor does this to older snapshots when the history grows larger
+than its memory budget. A spilled snapshot is read back when it is restored.
+
+Julia Ludwig (jal545)
+11/14/20
+"""
+import a6image
+import os
+import zlib
+import tempfile
+
+
+class Snapshot(object):
+    """
+    A class representing an immutable copy of an image.
+
+    The pixels are stored as interleaved RGB bytes (see Image.getBytes), split
+    into chunks of CHUNK_SIZE bytes. Each chunk is a bytes object, so it can
+    safely be shared by several snapshots. A chunk covers a few rows of a
+    typical image, so an edit that only changes some rows only adds the
+    chunks for those rows.
+
+    Attribute CHUNK_SIZE: A CLASS ATTRIBUTE for the number of bytes in a chunk
+    Invariant: CHUNK_SIZE is an int > 0 and a multiple of 3
+
+    Attribute COMPRESS_LEVEL: A CLASS ATTRIBUTE for the zlib level when spilling
+    Invariant: COMPRESS_LEVEL is an int in 0..9
+    """
+    # IMMUTABLE ATTRIBUTES (Fixed after initialization)
+    # Attribute _size: The number of bytes in the image
+    # Invariant: _size is an int > 0
+    #
+    # Attribute _width: The image width
+    # Invariant: _width is an int > 0 that evenly divides the number of pixels
+    #
+    # Attribute _compact: Whether the image was compact
+    # Invariant: _compact is a bool
+    #
+    # Attribute _token: The token for marking the image clean (see Image.markClean)
+    # Invariant: _token is an object unique to this snapshot
+    #
+    # MUTABLE ATTRIBUTES
+    # Attribute _chunks: The pixel data (if in memory)
+    # Invariant: _chunks is None or a non-empty tuple of non-empty bytes objects.
+    # The concatenation of the chunks is a pixel buffer (see a6image._is_pixel_buffer)
+    #
+    # Attribute _file: The file holding the compressed chunks (if spilled)
+    # Invariant: _file is None or a string naming a file. Exactly one of _chunks
+    # and _file is None (unless the snapshot has been discarded).
+    #
+    # Attribute _sizes: The size of each compressed chunk in _file
+    # Invariant: _sizes is a tuple of ints > 0 (one per chunk), or () if not spilled
+
+    # The number of bytes in a chunk (64K pixels)
+    CHUNK_SIZE = 3 << 16
+
+    # The zlib compression level for spilled snapshots (speed over size)
+    COMPRESS_LEVEL = 1
+
+    # GETTERS
+    def getChunks(self):
+        """
+        Returns the tuple of chunks storing this snapshot.
+
+        The tuple is not copied, but it cannot be changed anyway. If the
+        snapshot is spilled, the chunks are read back from disk (they are not
+        kept in memory, so the snapshot stays spilled).
+        """
+        if self._chunks is not None:
+            return self._chunks
+        return tuple(map(zlib.decompress,self._load()))
+
+    def getToken(self):
+        """
+        Returns the token for marking an image clean after this snapshot.
+
+        An image marked clean with this token can give the rectangles
+        written to it since this snapshot (see Image.getDirty).
+        """
+        return self._token
+
+    def getWidth(self):
+        """
+        Returns the width of the image in this snapshot.
+        """
+        return self._width
+
+    def isCompact(self):
+        """
+        Returns True if the image in this snapshot was compact.
+        """
+        return self._compact
+
+    def getSize(self):
+        """
+        Returns the size of the image in this snapshot, in bytes.
+
+        This is the size of all of the chunks, whether or not they are
+        shared with another snapshot or spilled to disk.
+        """
+        return self._size
+
+    def getDiskSize(self):
+        """
+        Returns the number of bytes this snapshot takes on disk.
+
+        This is 0 if the snapshot is not spilled.
+        """
+        return sum(self._sizes)
+
+    def isSpilled(self):
+        """
+        Returns True if this snapshot is stored on disk instead of in memory.
+        """
+        return self._file is not None
+
+    # INITIALIZER
+    def __init__(self, image, previous=None, dirty=None):
+        """
+        Initializes a snapshot of the given image.
+
+        If previous is not None, every chunk with the same contents as the
+        chunk in the same place in previous is shared with previous instead
+        of copied. Nothing is shared with a spilled snapshot. The image is
+        not changed.
+
+        If dirty is a list, it has the rectangles written to the image since
+        previous was taken (see Image.getDirty). Then only the chunks that
+        overlap them are read, and the rest are shared with previous as they
+        are. Otherwise every chunk is read and compared, so this takes time
+        in proportion to the size of the image.
+
+        Parameter image: The image to copy
+        Precondition: image is an Image object
+
+        Parameter previous: A snapshot to share chunks with
+        Precondition: previous is a Snapshot object or None
+
+        Parameter dirty: The rectangles written since previous
+        Precondition: dirty is None or a list of rectangles (row, col, height,
+        width) inside of image that covers every pixel changed since previous
+        """
+        assert isinstance(image,a6image.Image), repr(image)+' is not an image.'
+        assert previous is None or isinstance(previous,Snapshot), \
+        repr(previous)+' is not a snapshot.'
+        assert dirty is None or type(dirty) == list, repr(dirty)+' is not a list.'
+
+        old = ()
+        if previous is not None and not previous.isSpilled():
+            old = previous.getChunks()
+
+        total = 3*len(image)
+        width = image.getWidth()
+        if dirty is None or not old or previous.getSize() != total or previous.getWidth() != width:
+            chunks = self._compare(image,old)
+        else:
+            chunks = self._copy(image,old,dirty)
+
+        self._chunks  = tuple(chunks)
+        self._size    = total
+        self._width   = width
+        self._compact = image.isCompact()
+        self._token   = object()
+        self._file    = None
+        self._sizes   = ()
+
+    # OPERATIONS
+    def restore(self):
+        """
+        Returns a new Image with the contents of this snapshot.
+
+        This works whether or not the snapshot is spilled. The image is
+        compact if the original image was compact, and a list of pixels
+        otherwise. Changing it does not affect this snapshot.
+        """
+        data = bytearray().join(self.getChunks())
+        image = a6image.Image.fromBytes(data,self._width)
+        if not self._compact:
+            image = a6image.Image.fromTrusted(image.getData(),self._width)
+        return image
+
+    def shares(self, other):
+        """
+        Returns the number of bytes this snapshot shares with other.
+
+        Parameter other: The snapshot to compare against
+        Precondition: other is a Snapshot object
+        """
+        assert isinstance(other,Snapshot), repr(other)+' is not a snapshot.'
+        if self.isSpilled() or other.isSpilled():
+            return 0
+        mine = set(map(id,self._chunks))
+        return sum(len(chunk) for chunk in other.getChunks() if id(chunk) in mine)
+
+    def spill(self, folder):
+        """
+        Moves the chunks of this snapshot to a new file in the given folder.
+
+        The chunks are compressed and written to disk, and this snapshot no
+        longer refers to them. The memory is only freed for chunks that are
+        not shared with another snapshot. If the snapshot is already spilled,
+        this method does nothing.
+
+        Parameter folder: The folder for the file
+        Precondition: folder is a string naming a writable folder
+        """
+        if self.isSpilled():
+            return
+
+        sizes = []
+        handle, path = tempfile.mkstemp(suffix='.snap',dir=folder)
+        try:
+            with os.fdopen(handle,'wb') as file:
+                for chunk in self._chunks:
+                    data = zlib.compress(chunk,self.COMPRESS_LEVEL)
+                    file.write(data)
+                    sizes.append(len(data))
+        except:
+            os.remove(path)
+            raise
+
+        self._file   = path
+        self._sizes  = tuple(sizes)
+        self._chunks = None
+
+    def discard(self):
+        """
+        Deletes the file of a spilled snapshot.
+
+        The snapshot cannot be used after this method is called. This method
+        does nothing if the snapshot is not spilled, as its chunks may still
+        be shared with other snapshots.
+        """
+        if self._file is None:
+            return
+        try:
+            os.remove(self._file)
+        except OSError:
+            pass        # The temporary folder is already gone
+        self._file  = None
+        self._sizes = ()
+
+    # HELPER METHODS
+    def _compare(self, image, old):
+        """
+        Returns the chunks of image, sharing those equal to the chunks in old.
+
+        Parameter image: The image to copy
+        Precondition: image is an Image object
+
+        Parameter old: The chunks of the previous snapshot
+        Precondition: old is a (possibly empty) tuple of chunks
+        """
+        data = image.getView()
+        chunks = []
+        size = self.CHUNK_SIZE
+        for pos in range(0,len(data),size):
+            index = pos//size
+            piece = data[pos:pos+size]
+            if index < len(old) and piece == old[index]:
+                chunks.append(old[index])
+            else:
+                chunks.append(bytes(piece))
+        del piece
+        data.release()
+        return chunks
+
+    def _copy(self, image, old, dirty):
+        """
+        Returns the chunks of image, where only the chunks overlapping dirty changed.
+
+        Each chunk that overlaps a rectangle in dirty is read from the image
+        (and still shared if it did not change). The others are taken from
+        old without reading them. A compact image is read through its view
+        and any other image one chunk at a time, so neither is copied whole.
+
+        Parameter image: The image to copy
+        Precondition: image is an Image object the same size as old
+
+        Parameter old: The chunks of the previous snapshot
+        Precondition: old is a non-empty tuple of chunks
+
+        Parameter dirty: The rectangles written since the previous snapshot
+        Precondition: dirty is a list of rectangles inside of image
+        """
+        size = self.CHUNK_SIZE
+        width = image.getWidth()
+        stride = 3*width
+        written = set()
+        for (row, col, height, cols) in dirty:
+            if cols == width:
+                spans = [(row*stride,(row+height)*stride)]
+            else:
+                spans = [(top*stride+3*col,top*stride+3*(col+cols)) for top in range(row,row+height)]
+            for (start, stop) in spans:
+                written.update(range(start//size,(stop-1)//size+1))
+
+        chunks = list(old)
+        data = image.getView() if image.isCompact() else None
+        piece = None
+        for index in written:
+            pos = index*size
+            if data is not None:
+                piece = data[pos:pos+size]
+            else:
+                stop = min(pos+size,len(image)*3)
+                top = pos//stride
+                rows = image.getRegion(top,0,(stop-1)//stride-top+1,width)
+                piece = rows[pos-top*stride:stop-top*stride]
+            if piece != old[index]:
+                chunks[index] = bytes(piece)
+        if data is not None:
+            piece = None
+            data.release()
+        return chunks
+
+    def _load(self):
+        """
+        Returns the list of compressed chunks of a spilled snapshot.
+        """
+        with open(self._file,'rb') as file:
+            return [file.read(size) for size in self._sizes]
@@ -9,6 +9,8 @@ Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
 Julia Ludwig (jal545)
 11/14/20
 """
+from array import array
+from contextlib import contextmanager
 
 
 def _is_pixel(item):
@@ -50,6 +52,39 @@ def _is_pixel_list(data):
     return True
 
 
+def _is_pixel_buffer(data):
+    """
+    Returns True if data is a pixel buffer, False otherwise.
+
+    A pixel buffer is a bytes-like object (bytes, bytearray or array('B'))
+    whose contents are interleaved RGB values. Every three consecutive bytes
+    form one pixel, so the length must be a multiple of 3.
+
+    Parameter data: The data to check
+    Precondition: NONE (data can be anything)
+    """
+    if type(data) not in (bytes, bytearray) and not \
+        (isinstance(data, array) and data.typecode == 'B'):
+        return False
+    return len(data) % 3 == 0
+
+
+# The number of bytes in a band of columns moved at once by a transpose (1M)
+TILE_SIZE = 1 << 20
+
+# The symbolic operations (see Image.reorient), as transposes and reflections
+ORIENTATIONS = {'transpose':('transpose',), 'reflectHori':('reflectHori',),
+                'reflectVert':('reflectVert',),
+                'rotateRight':('transpose','reflectHori'),
+                'rotateLeft':('transpose','reflectVert')}
+
+# The most dirty rectangles an image tracks before it is all marked dirty
+DIRTY_LIMIT = 256
+
+# The most tokens an image keeps dirty rectangles for at once (see markClean)
+MARK_LIMIT = 8
+
+
 # TASK 1: IMPLEMENT THIS CLASS
 class Image(object):
     """
@@ -77,10 +112,66 @@ class Image(object):
         image.__setitem__(pos, (255,0,0))
 
     These operations are used by the greyscale filters in particular.
+
+    An image can store its pixels in one of two ways. By default it keeps the
+    pixel list it was given. A compact image (created with `fromBytes`) instead
+    keeps a flat bytearray of interleaved RGB values, three bytes per pixel.
+    This is more than 30 times smaller than a list of tuples, and copying it is
+    a single memory copy. A compact image can also keep its bytes in memory it
+    does not own, such as shared memory (see `fromView`), so other processes
+    see what is written to it. Both kinds of image support exactly the same methods;
+    the only difference is that a compact image creates a new tuple each time a
+    pixel is read. The methods `getBytes` and `setBytes` give bulk access to the
+    pixels as interleaved RGB bytes in either storage mode.
+
+    Validating pixels is expensive. The initializer checks every pixel in the
+    list, and every write checks the new pixel. Code that already knows its
+    pixels are valid can skip this work in two ways. The class method
+    `fromTrusted` creates an image without looking at the individual pixels;
+    `copy` uses it, since the pixels of an image are always valid. And an
+    unchecked image (see `setChecked` and `unchecked`) skips all of the
+    precondition checks in `__getitem__`, `__setitem__`, `getPixel` and
+    `setPixel`. The filters use this for the pixels they compute themselves.
+    Images are always checked when they are created, so anything coming from
+    outside of the application is still validated.
+
+    Transposing, rotating or reflecting an image moves every pixel. The method
+    `reorient` does this symbolically instead: it only records the new
+    orientation of the image, and several of these operations combine into a
+    single orientation in constant time. The width and height change right
+    away, but the pixels are only moved (in a single pass) the next time they
+    are accessed, and not at all if the operations cancel out.
+
+    The drawing methods (`fillRect`, `drawHSpan`, `drawVSpan`, `drawOutline`
+    and `drawGrid`) paint solid shapes in a single color. They write the
+    pixels with slices, one for each row of a shape (or one for the whole
+    shape if its rows are contiguous), instead of one pixel at a time. Like
+    `setPixel`, they only check their preconditions if the image is checked.
+
+    An image keeps track of the rectangles that have been written since it
+    was last shown (see `markClean` and `getDirty`), so that the display only
+    has to upload the pixels that changed. Single pixel writes in the same
+    row are merged into one rectangle. Writes that can touch any pixel (like
+    `setBytes`, `getBuffer` or moving the pixels for a new orientation) mark
+    the whole image as dirty.
     """
     # IMMUTABLE ATTRIBUTES (Fixed after initialization)
-    # Attribute _data: The underlying list of pixels
-    # Invariant: _data is a non-empty pixel list (see _is_pixel_list)
+    # Attribute _data: The underlying pixel storage
+    # Invariant: _data is a non-empty pixel list (see _is_pixel_list), or a
+    # non-empty bytearray (or writable memoryview of bytes, see fromView) of
+    # interleaved RGB values for a compact image
+    #
+    # Attribute _checked: Whether pixel access enforces its preconditions
+    # Invariant: _checked is a bool
+    #
+    # Attribute _orientation: The pending orientation of _data
+    # Invariant: _orientation is None if _data is in row-major order. Otherwise
+    # it is a tuple (transposed, flipRows, flipCols) of bools, not all False.
+    # If transposed is False, the pixel at (row, col) is stored at (row, col)
+    # of a _height x _width image, after reversing the row if flipRows is True
+    # and the column if flipCols is True. If transposed is True, it is stored
+    # at (col, row) of a _width x _height image, reversing that row if
+    # flipRows is True and that column if flipCols is True.
     #
     # MUTABLE ATTRIBUTES (Can be changed at any time, via the setters)
     # Attribute _width:  The image width, which is the number of columns
@@ -89,6 +180,18 @@ class Image(object):
     # Attribute _height:  The image height, which is the number of rows
     # Invariant: _height is an int > 0, _width*_height = len(_data)
     #
+    # Attribute _dirty: The rectangles written since the oldest markClean
+    # Invariant: _dirty is None if the whole image may have changed. Otherwise
+    # it is a list of at most DIRTY_LIMIT tuples (row, col, height, width),
+    # each a non-empty rectangle inside of the image.
+    #
+    # Attribute _marks: The position in _dirty for each token given to markClean
+    # Invariant: _marks is a dict of at most MARK_LIMIT tokens (oldest first),
+    # each mapped to an int 0..len(_dirty)
+    #
+    # Attribute _floor: The position in _dirty of the newest mark
+    # Invariant: _floor is an int 0..len(_dirty) if _dirty is a list
+    #
     # Note that if you change width, you must change height (to satisfy the invariant)
 
     # PART A
@@ -100,9 +203,139 @@ class Image(object):
         The image data is a 1-dimensional list of 3-element tuples.  The list
         returned by this method is a copy of the one managed by this object.
         """
+        if self._orientation:
+            self._materialize()
+        if self.isCompact():
+            data=self._data
+            return list(zip(data[0::3],data[1::3],data[2::3]))
         copy=self._data[:]
         return copy    # Implement me
 
+    def getBytes(self):
+        """
+        Returns a COPY of the image data as interleaved RGB bytes.
+
+        The value returned is a bytearray of length 3*len(self), where the
+        bytes at 3*pos, 3*pos+1 and 3*pos+2 are the red, green, and blue values
+        of the pixel at position pos. This works for both storage modes, but it
+        is much faster for a compact image.
+        """
+        if self._orientation:
+            self._materialize()
+        if self.isCompact():
+            return bytearray(self._data)
+        result=bytearray(3*len(self._data))
+        result[0::3]=bytes(pixel[0] for pixel in self._data)
+        result[1::3]=bytes(pixel[1] for pixel in self._data)
+        result[2::3]=bytes(pixel[2] for pixel in self._data)
+        return result
+
+    def setBytes(self,buffer):
+        """
+        Replaces all of the image data with the given interleaved RGB bytes.
+
+        This is the bulk version of __setitem__. The dimensions of the image
+        do not change, and the storage mode of the image does not change
+        either (a list-backed image gets a list of new tuples).
+
+        Parameter buffer: The new pixel values as interleaved RGB bytes
+        Precondition: buffer is a pixel buffer (see _is_pixel_buffer) with
+        exactly 3*len(self) bytes
+        """
+        assert _is_pixel_buffer(buffer), repr(buffer)+' is not a pixel buffer.'
+        assert len(buffer)==3*len(self), repr(buffer)+' does not have '\
+        'the same number of pixels as the image.'
+
+        self._orientation=None     # All of the pixels are replaced
+        self._dirty=None
+        if self.isCompact():
+            self._data[:]=buffer
+        else:
+            self._data[:]=zip(buffer[0::3],buffer[1::3],buffer[2::3])
+
+    def getBuffer(self):
+        """
+        Returns the underlying byte buffer of a compact image.
+
+        Unlike getBytes, this does not copy anything. The value returned is a
+        writable memoryview of the interleaved RGB bytes managed by this
+        object, so changes to it change the image. This is for code (like the
+        vectorized filters) that wants to work on the raw bytes directly. The
+        whole image is marked as dirty (see getDirty).
+
+        Precondition: this image is compact (see isCompact)
+        """
+        assert self.isCompact(), 'The image is not compact.'
+        if self._orientation:
+            self._materialize()
+        self._dirty=None    # The caller may write anything
+        return memoryview(self._data)
+
+    def getView(self):
+        """
+        Returns a memoryview of the image data as interleaved RGB bytes.
+
+        The bytes are in the same layout as getBytes. For a compact image this
+        is a view of the buffer itself, so nothing is copied; otherwise it is a
+        view of a new copy made with getBytes. This is for code (like the
+        display and the image writers) that only reads the raw bytes, so
+        unlike getBuffer it does not mark the image as dirty. The view should
+        be released once it has been read.
+        """
+        if not self.isCompact():
+            return memoryview(self.getBytes())
+        if self._orientation:
+            self._materialize()
+        return memoryview(self._data)
+
+    def isChecked(self):
+        """
+        Returns True if pixel access enforces its preconditions.
+
+        This is True unless it has been turned off with setChecked.
+        """
+        return self._checked
+
+    def setChecked(self,value):
+        """
+        Sets whether pixel access enforces its preconditions.
+
+        If value is False, then `__getitem__`, `__setitem__`, `getPixel` and
+        `setPixel` no longer check their arguments. This makes them much
+        faster, but an invalid position or pixel will silently corrupt the
+        image. Only turn this off for code that is known to be correct.
+
+        Parameter value: Whether to enforce the preconditions
+        Precondition: value is a bool
+        """
+        assert type(value)==bool, repr(value)+' is not a bool.'
+        self._checked=value
+
+    @contextmanager
+    def unchecked(self):
+        """
+        Returns a context manager that turns off precondition checks.
+
+        This is used in a with statement. Pixel access is unchecked inside of
+        the with block (see setChecked), and the previous setting is restored
+        afterwards, even if there is an error.
+        """
+        checked=self._checked
+        self._checked=False
+        try:
+            yield self
+        finally:
+            self._checked=checked
+
+    def isCompact(self):
+        """
+        Returns True if this image stores its pixels as a compact byte buffer.
+
+        A compact image is created by `fromBytes` or `fromView` (or by copying
+        a compact image). Otherwise the image stores its pixels as a pixel list.
+        """
+        return type(self._data) in (bytearray,memoryview)
+
     def getWidth(self):
         """
         Returns the image width
@@ -128,10 +361,14 @@ class Image(object):
         """
         assert type(value)==int, repr(value)+' is not an int.'
         assert value>0, repr(value)+' is not > 0.'
-        assert len(self._data)%value==0, repr(value)+' does not evenly '\
+        assert len(self)%value==0, repr(value)+' does not evenly '\
         'divide the # of pixels in the image.'
 
-        new_height=len(self._data)//value
+        if value!=self._width:
+            self._dirty=None
+        if self._orientation and value!=self._width:
+            self._materialize()
+        new_height=len(self)//value
         self._width=value
         if self.getHeight()!=new_height:
             self.setHeight(new_height)
@@ -161,10 +398,14 @@ class Image(object):
         """
         assert type(value)==int, repr(value)+' is not an int.'
         assert value>0, repr(value)+' is not > 0.'
-        assert len(self._data)%value==0,repr(value)+' does not evenly '\
+        assert len(self)%value==0,repr(value)+' does not evenly '\
         'divide the # of pixels in the image.'
 
-        new_width=len(self._data)//value
+        if value!=self._height:
+            self._dirty=None
+        if self._orientation and value!=self._height:
+            self._materialize()
+        new_width=len(self)//value
         self._height=value
         if self.getWidth()!=new_width:
             self.setWidth(new_width)
@@ -207,6 +448,125 @@ class Image(object):
         self._data=data
         self._width=width
         self._height=len(data)//width
+        self._checked=True
+        self._orientation=None
+        self._dirty=None
+        self._marks={}
+        self._floor=0
+
+    @classmethod
+    def fromTrusted(cls, data, width):
+        """
+        Returns a new Image for pixel data that is known to be valid.
+
+        This is the same as the initializer (or fromBytes, if data is a
+        bytearray), except that it does not check the individual pixels. So
+        it takes constant time instead of time proportional to the size of
+        the image. Only use it for data that came from another Image or that
+        was computed by code known to be correct.
+
+        Like the initializer, the image stores a reference to data.
+
+        Parameter data: The image data
+        Precondition: data is a non-empty pixel list or a non-empty bytearray
+        of interleaved RGB values
+
+        Parameter width: The image width
+        Precondition: width is an int > 0 and evenly divides the number of pixels
+        """
+        if type(data)==bytearray:
+            return cls.fromBytes(data,width)
+
+        assert type(data)==list, repr(data)+' is not a list.'
+        assert data!=[], repr(data)+' cannot be an empty list.'
+        assert type(width)==int, repr(width)+' is not an int.'
+        assert width>0, repr(width)+' is not > 0.'
+        assert len(data)%width==0,repr(width)+' does not evenly '\
+        'divide the # of pixels in the image.'
+
+        result=cls.__new__(cls)
+        result._data=data
+        result._width=width
+        result._height=len(data)//width
+        result._checked=True
+        result._orientation=None
+        result._dirty=None
+        result._marks={}
+        result._floor=0
+        return result
+
+    @classmethod
+    def fromBytes(cls, buffer, width):
+        """
+        Returns a new compact Image for the given interleaved RGB bytes.
+
+        Every three consecutive bytes of buffer are the red, green, and blue
+        values of one pixel. If buffer is a bytearray, the image stores a
+        reference to it (just like the initializer does for a pixel list).
+        Otherwise the bytes are copied into a new bytearray.
+
+        Parameter buffer: The image data as interleaved RGB bytes
+        Precondition: buffer is a non-empty pixel buffer (see _is_pixel_buffer)
+
+        Parameter width: The image width
+        Precondition: width is an int > 0 and evenly divides the number of
+        pixels (len(buffer)//3)
+        """
+        assert _is_pixel_buffer(buffer), repr(buffer)+' is not a pixel buffer.'
+        assert len(buffer)>0, repr(buffer)+' cannot be empty.'
+        assert type(width)==int, repr(width)+' is not an int.'
+        assert width>0, repr(width)+' is not > 0.'
+        assert (len(buffer)//3)%width==0,repr(width)+' does not evenly '\
+        'divide the # of pixels in the image.'
+
+        if type(buffer)!=bytearray:
+            buffer=bytearray(buffer)
+
+        result=cls.__new__(cls)
+        result._data=buffer
+        result._width=width
+        result._height=len(buffer)//3//width
+        result._checked=True
+        result._orientation=None
+        result._dirty=None
+        result._marks={}
+        result._floor=0
+        return result
+
+    @classmethod
+    def fromView(cls, view, width):
+        """
+        Returns a new compact Image that keeps its pixels in the given memoryview.
+
+        Nothing is copied: every write to the image is a write to the memory
+        under view, and the other way around. This is for memory the image
+        does not own, like a band of an image in shared memory that a worker
+        process edits in place (see a6parallel). A copy of the image is an
+        ordinary compact image with a bytearray of its own. The memory must
+        stay open as long as the image is used.
+
+        Parameter view: The image data as interleaved RGB bytes
+        Precondition: view is a non-empty writable memoryview of unsigned
+        bytes (format 'B'), whose length is a multiple of 3
+
+        Parameter width: The image width
+        Precondition: width is an int > 0 and evenly divides the number of
+        pixels (len(view)//3)
+        """
+        assert type(view)==memoryview, repr(view)+' is not a memoryview.'
+        assert view.format=='B' and view.ndim==1, repr(view)+' is not a view of bytes.'
+        assert not view.readonly, repr(view)+' is not writable.'
+        assert len(view)>0 and len(view)%3==0, repr(view)+' is not a pixel buffer.'
+        assert type(width)==int, repr(width)+' is not an int.'
+        assert width>0, repr(width)+' is not > 0.'
+        assert (len(view)//3)%width==0,repr(width)+' does not evenly '\
+        'divide the # of pixels in the image.'
+
+        result=cls.fromBytes(bytearray(3),1)
+        result._data=view
+        result._width=width
+        result._height=len(view)//3//width
+        return result
 
     # PART B
     # OPERATOR OVERLOADING
@@ -216,6 +576,8 @@ class Image(object):
 
         This special method supports the built-in len function.
         """
+        if self.isCompact():
+            return len(self._data)//3
         return len(self._data)
 
     def __getitem__(self, pos):
@@ -234,10 +596,16 @@ class Image(object):
         Parameter pos: The position in the pixel list
         Precondition: pos is an int and a valid position >= 0 in the pixel list.
         """
-        assert type(pos)==int, repr(pos)+' is not an int.'
-        assert pos>=0, repr(pos)+' is not >= 0.'
-        assert pos<len(self._data), repr(pos)+' is too large.'
-
+        if self._checked:
+            assert type(pos)==int, repr(pos)+' is not an int.'
+            assert pos>=0, repr(pos)+' is not >= 0.'
+            assert pos<len(self), repr(pos)+' is too large.'
+
+        if self._orientation:
+            self._materialize()
+        if self.isCompact():
+            pos*=3
+            return (self._data[pos],self._data[pos+1],self._data[pos+2])
         return self._data[pos]
 
     def __setitem__(self, pos, pixel):
@@ -253,12 +621,17 @@ class Image(object):
         Parameter pixel: The pixel value
         Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
         """
-        assert type(pos)==int, repr(pos)+' is not an int.'
-        assert pos>=0, repr(pos)+' is not >= 0.'
-        assert pos<len(self._data), repr(pos)+' is too large.'
-        assert _is_pixel(pixel), repr(pixel)+' is not a pixel.'
+        if self._checked:
+            assert type(pos)==int, repr(pos)+' is not an int.'
+            assert pos>=0, repr(pos)+' is not >= 0.'
+            assert pos<len(self), repr(pos)+' is too large.'
+            assert _is_pixel(pixel), repr(pixel)+' is not a pixel.'
 
-        self._data[pos]=pixel
+        if self._orientation:
+            self._materialize()
+        self._write(pos,pixel)
+        if self._dirty is not None:
+            self._touch(pos//self._width,pos%self._width)
 
 
     # PART C
@@ -278,14 +651,21 @@ class Image(object):
         Parameter col: The pixel column
         Precondition: col is an int >= 0 and < width
         """
-        assert type(row)==int, repr(row)+' is not an int.'
-        assert row>=0, repr(row)+' is not >= 0.'
-        assert row<self.getHeight(), repr(row)+' is not < height'
-        assert type(col)==int, repr(col)+' is not an int.'
-        assert col>=0, repr(col)+' is not >= 0.'
-        assert col<self.getWidth(), repr(col)+' is not < width.'
-
-        return self._data[row*self.getWidth()+col]
+        if self._checked:
+            assert type(row)==int, repr(row)+' is not an int.'
+            assert row>=0, repr(row)+' is not >= 0.'
+            assert row<self.getHeight(), repr(row)+' is not < height'
+            assert type(col)==int, repr(col)+' is not an int.'
+            assert col>=0, repr(col)+' is not >= 0.'
+            assert col<self.getWidth(), repr(col)+' is not < width.'
+
+        if self._orientation:
+            self._materialize()
+        pos=row*self.getWidth()+col
+        if self.isCompact():
+            pos*=3
+            return (self._data[pos],self._data[pos+1],self._data[pos+2])
+        return self._data[pos]
 
     def setPixel(self, row, col, pixel):
         """
@@ -303,15 +683,20 @@ class Image(object):
         Parameter pixel: The pixel value
         Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
         """
-        assert type(row)==int, repr(row)+' is not an int.'
-        assert row>=0, repr(row)+' is not >= 0.'
-        assert row<self.getHeight(), repr(row)+' is not < height.'
-        assert type(col)==int, repr(col)+' is not an int.'
-        assert col>=0, repr(col)+' is not >= 0.'
-        assert col<self.getWidth(), repr(col)+' is not < height.'
-        assert _is_pixel(pixel), repr(pixel)+' is not a pixel.'
-
-        self._data[row*self.getWidth()+col] = pixel
+        if self._checked:
+            assert type(row)==int, repr(row)+' is not an int.'
+            assert row>=0, repr(row)+' is not >= 0.'
+            assert row<self.getHeight(), repr(row)+' is not < height.'
+            assert type(col)==int, repr(col)+' is not an int.'
+            assert col>=0, repr(col)+' is not >= 0.'
+            assert col<self.getWidth(), repr(col)+' is not < height.'
+            assert _is_pixel(pixel), repr(pixel)+' is not a pixel.'
+
+        if self._orientation:
+            self._materialize()
+        self._write(row*self.getWidth()+col,pixel)
+        if self._dirty is not None:
+            self._touch(row,col)
 
     # PART D
     def __str__(self):
@@ -388,6 +773,669 @@ class Image(object):
         Returns a copy of this image object.
 
         The underlying pixel data must be copied (e.g. the copy cannot refer
-        to the same list of pixels that this object does).
+        to the same list of pixels that this object does). The copy uses the
+        same storage mode as this image, and has the same pending orientation
+        (so the pixels are not moved yet). It also has the same dirty
+        rectangles, so a display showing this image can show the copy by only
+        uploading the rectangles written to the copy later on.
+        """
+        data=bytearray(self._data) if self.isCompact() else self._data[:]
+        result=Image.fromTrusted(data,self.getWidth())
+        result._orientation=self._orientation
+        result._dirty=None if self._dirty is None else self._dirty[:]
+        result._marks=dict(self._marks)
+        result._floor=self._floor
+        return result
+
+    def downscale(self, factor):
+        """
+        Returns a copy of this image that is factor times smaller in each dimension.
+
+        The copy has the pixel in every factor-th column of every factor-th
+        row (starting with the first), so it has ceil(width/factor) columns and
+        ceil(height/factor) rows. It uses the same storage mode as this image.
+        Each of its rows is copied with one extended slice (one for each color
+        channel if the image is compact), so this takes time proportional to
+        the size of the copy, not of this image.
+
+        Parameter factor: The amount to shrink by
+        Precondition: factor is an int > 0
+        """
+        assert type(factor)==int and factor>0, repr(factor)+' is not an int > 0.'
+        if self._orientation:
+            self._materialize()
+        width=self._width
+        cols=-(-width//factor)
+        if not self.isCompact():
+            result=[]
+            for start in range(0,len(self._data),width*factor):
+                result.extend(self._data[start:start+width:factor])
+            return Image.fromTrusted(result,cols)
+
+        line=3*width
+        span=3*cols
+        rows=-(-self._height//factor)
+        result=bytearray(span*rows)
+        for row in range(rows):
+            start=row*factor*line
+            for k in range(3):
+                result[row*span+k:(row+1)*span:3]=self._data[start+k:start+line:3*factor]
+        return Image.fromBytes(result,cols)
+
+    def getOrientation(self):
+        """
+        Returns the pending orientation of this image.
+
+        The value is None if the pixels are stored in order. Otherwise it is
+        a tuple (transposed, flipRows, flipCols) describing how they are
+        stored (see reorient). Any pixel access puts them in order.
+        """
+        return self._orientation
+
+    def reorient(self, operation):
+        """
+        Transposes, rotates or reflects this image symbolically.
+
+        The operation is one of 'transpose', 'reflectHori', 'reflectVert',
+        'rotateRight' and 'rotateLeft', with the same meaning as the Filter
+        methods of the same name. It is combined with any pending orientation
+        in constant time, and the width and height are updated. The pixels
+        are moved the next time they are accessed, in a single pass for all
+        of the operations combined.
+
+        Parameter operation: The operation to apply
+        Precondition: operation is a key of ORIENTATIONS
+        """
+        assert operation in ORIENTATIONS, repr(operation)+' is not an orientation.'
+        (transposed, flipRows, flipCols) = self._orientation or (False,False,False)
+        for step in ORIENTATIONS[operation]:
+            if step=='transpose':
+                transposed=not transposed
+                (self._width,self._height)=(self._height,self._width)
+            elif (step=='reflectHori') != transposed:
+                flipCols=not flipCols
+            else:
+                flipRows=not flipRows
+        self._orientation=(transposed,flipRows,flipCols)
+        if not any(self._orientation):
+            self._orientation=None
+
+    # DRAWING METHODS
+    def fillRect(self, row, col, height, width, pixel):
+        """
+        Fills the rectangle with its top left corner at (row, col) with pixel.
+
+        The rectangle is written with one slice for each row, or one slice in
+        all if it spans the whole width of the image. A rectangle that is much
+        taller than it is wide is written with one extended slice for each
+        column (for each byte, if the image is compact) instead.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int >= 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int >= 0 and col+width <= image width
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        if self._checked:
+            assert type(row)==int and row>=0, repr(row)+' is not an int >= 0.'
+            assert type(col)==int and col>=0, repr(col)+' is not an int >= 0.'
+            assert type(height)==int and height>=0, repr(height)+' is not an int >= 0.'
+            assert type(width)==int and width>=0, repr(width)+' is not an int >= 0.'
+            assert row+height<=self.getHeight(), repr(height)+' rows do not fit at row '+repr(row)+'.'
+            assert col+width<=self.getWidth(), repr(width)+' columns do not fit at column '+repr(col)+'.'
+            assert _is_pixel(pixel), repr(pixel)+' is not a pixel.'
+        self._guard(row,col,height,width)
+
+        if self._orientation:
+            self._materialize()
+        if height==0 or width==0:
+            return
+        if self._dirty is not None:
+            self._touch(row,col,height,width)
+
+        # Work in items of the storage: bytes if compact, pixels otherwise
+        if self.isCompact():
+            item  = 3
+            value = bytes(pixel)
+        else:
+            item  = 1
+            value = [pixel]
+        data  = self._data
+        span  = width*item
+        line  = self.getWidth()*item
+        start = row*line+col*item
+        if span==line:
+            data[start:start+height*line] = value*(width*height)
+        elif height<=span:
+            value = value*width
+            for pos in range(start,start+height*line,line):
+                data[pos:pos+span] = value
+        else:
+            stop = start+(height-1)*line+1
+            for pos in range(span):
+                data[start+pos:stop+pos:line] = value[pos%item:pos%item+1]*height
+
+    def drawHSpan(self, row, col, width, pixel):
+        """
+        Draws a horizontal line of width pixels, starting at (row, col)
+
+        Parameter row: The row of the line
+        Precondition: row is an int >= 0 and < image height
+
+        Parameter col: The left column of the line
+        Precondition: col is an int >= 0
+
+        Parameter width: The number of pixels in the line
+        Precondition: width is an int >= 0 and col+width <= image width
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        self.fillRect(row,col,1,width,pixel)
+
+    def drawVSpan(self, row, col, height, pixel):
+        """
+        Draws a vertical line of height pixels, starting at (row, col)
+
+        Parameter row: The top row of the line
+        Precondition: row is an int >= 0
+
+        Parameter col: The column of the line
+        Precondition: col is an int >= 0 and < image width
+
+        Parameter height: The number of pixels in the line
+        Precondition: height is an int >= 0 and row+height <= image height
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        self.fillRect(row,col,height,1,pixel)
+
+    def drawOutline(self, row, col, height, width, pixel, thickness=1):
+        """
+        Draws the outline of the rectangle with its top left corner at (row, col)
+
+        The outline is drawn inside of the rectangle. If the rectangle is too
+        small for an outline of this thickness, the whole rectangle is filled.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int >= 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int >= 0 and col+width <= image width
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+
+        Parameter thickness: The width of the outline in pixels
+        Precondition: thickness is an int > 0
+        """
+        assert type(thickness)==int and thickness>0, repr(thickness)+' is not an int > 0.'
+        if 2*thickness>=height or 2*thickness>=width:
+            self.fillRect(row,col,height,width,pixel)
+            return
+
+        inside = height-2*thickness
+        self.fillRect(row,col,thickness,width,pixel)
+        self.fillRect(row+height-thickness,col,thickness,width,pixel)
+        self.fillRect(row+thickness,col,inside,thickness,pixel)
+        self.fillRect(row+thickness,col+width-thickness,inside,thickness,pixel)
+
+    def drawGrid(self, rows, cols, pixel, barHeight=1, barWidth=1):
+        """
+        Draws horizontal and vertical bars across the whole image.
+
+        There is a horizontal bar barHeight pixels high starting at each row
+        in rows, and a vertical bar barWidth pixels wide starting at each
+        column in cols. For example, Filter.jail draws a grid with bars at
+        the top and bottom rows and evenly spaced columns.
+
+        Each bar is a rectangle drawn with fillRect, so a whole grid takes a
+        few slices for each bar, no matter how large the image is.
+
+        Parameter rows: The top rows of the horizontal bars
+        Precondition: rows is a list of ints >= 0 and <= image height-barHeight
+
+        Parameter cols: The left columns of the vertical bars
+        Precondition: cols is a list of ints >= 0 and <= image width-barWidth
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+
+        Parameter barHeight: The height of the horizontal bars
+        Precondition: barHeight is an int > 0
+
+        Parameter barWidth: The width of the vertical bars
+        Precondition: barWidth is an int > 0
+        """
+        assert type(rows)==list, repr(rows)+' is not a list.'
+        assert type(cols)==list, repr(cols)+' is not a list.'
+        assert type(barHeight)==int and barHeight>0, repr(barHeight)+' is not an int > 0.'
+        assert type(barWidth)==int and barWidth>0, repr(barWidth)+' is not an int > 0.'
+        width  = self.getWidth()
+        height = self.getHeight()
+        for col in cols:
+            self.fillRect(0,col,height,barWidth,pixel)
+        for row in rows:
+            self.fillRect(row,0,barHeight,width,pixel)
+
+    # DIRTY RECTANGLES
+    def getDirty(self, token):
+        """
+        Returns the rectangles written since markClean(token) was called.
+
+        The value is a list of tuples (row, col, height, width), which may
+        overlap. Every pixel that has changed since the call to markClean is
+        in at least one of them. The value is None if that is not known: if
+        markClean was never called with this token (or its mark was dropped),
+        if the whole image may have changed, or if the image has a pending
+        orientation.
+
+        Parameter token: The value given to markClean
+        Precondition: token is not None
+        """
+        assert token is not None, 'The token cannot be None.'
+        if self._dirty is None or self._orientation or token not in self._marks:
+            return None
+        return self._dirty[self._marks[token]:]
+
+    def markClean(self, token, old=None):
+        """
+        Marks the image as clean, so only later writes are dirty.
+
+        The token identifies the caller (for example, a display). The dirty
+        rectangles are only given to a call to getDirty with the same token,
+        so the display can tell whether this is the image it last showed (or
+        a copy of it). Use a new token (like object()) each time.
+
+        Several callers can mark the same image, as the display and the edit
+        history do, and each of them gets the rectangles written since its own
+        mark. Only the newest MARK_LIMIT marks are kept, so a caller should
+        give its previous token as old, which drops that mark.
+
+        Parameter token: A value that identifies this call
+        Precondition: token is a hashable value, not None
+
+        Parameter old: The token given to the previous call by this caller
+        Precondition: old is any value
+        """
+        assert token is not None, 'The token cannot be None.'
+        if self._dirty is None:
+            self._dirty=[]
+            self._marks={}
+        marks=self._marks
+        marks.pop(old,None)
+        marks.pop(token,None)
+        marks[token]=len(self._dirty)
+        while len(marks) > MARK_LIMIT:
+            del marks[next(iter(marks))]
+        # Forget the rectangles that no mark needs any more
+        start=min(marks.values())
+        if start:
+            del self._dirty[:start]
+            for key in marks:
+                marks[key] -= start
+        self._floor=len(self._dirty)
+
+    def getRegion(self, row, col, height, width):
+        """
+        Returns the pixels in the rectangle at (row, col) as interleaved RGB bytes.
+
+        The bytes are in the same layout as getBytes, for an image that is
+        just this rectangle. Like fillRect, the rectangle is read with one
+        slice for each row (or for each byte of a row, if it is much taller
+        than it is wide).
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int >= 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int >= 0 and col+width <= image width
+        """
+        if self._checked:
+            assert type(row)==int and row>=0, repr(row)+' is not an int >= 0.'
+            assert type(col)==int and col>=0, repr(col)+' is not an int >= 0.'
+            assert type(height)==int and height>=0, repr(height)+' is not an int >= 0.'
+            assert type(width)==int and width>=0, repr(width)+' is not an int >= 0.'
+            assert row+height<=self.getHeight(), repr(height)+' rows do not fit at row '+repr(row)+'.'
+            assert col+width<=self.getWidth(), repr(width)+' columns do not fit at column '+repr(col)+'.'
+
+        if self._orientation:
+            self._materialize()
+        if height==0 or width==0:
+            return bytearray()
+
+        if not self.isCompact():
+            pixels = []
+            for pos in range(row*self._width+col,(row+height)*self._width,self._width):
+                pixels.extend(self._data[pos:pos+width])
+            result=bytearray(3*len(pixels))
+            result[0::3]=bytes(pixel[0] for pixel in pixels)
+            result[1::3]=bytes(pixel[1] for pixel in pixels)
+            result[2::3]=bytes(pixel[2] for pixel in pixels)
+            return result
+
+        data  = self._data
+        span  = 3*width
+        line  = 3*self._width
+        start = row*line+3*col
+        if span==line or height==1:
+            return bytearray(data[start:start+(height-1)*line+span])
+        result = bytearray(span*height)
+        if height<=span:
+            for pos in range(height):
+                result[pos*span:(pos+1)*span] = data[start+pos*line:start+pos*line+span]
+        else:
+            stop = start+(height-1)*line+1
+            for pos in range(span):
+                result[pos::span] = data[start+pos:stop+pos:line]
+        return result
+
+    def setRegion(self, row, col, height, width, buffer):
+        """
+        Replaces the pixels in the rectangle at (row, col) with the given bytes.
+
+        This is the reverse of getRegion: buffer has the pixels of the
+        rectangle as interleaved RGB bytes, one row after another. It is
+        written with the same slices that getRegion reads with, and the
+        rectangle is marked as dirty.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int >= 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int >= 0 and col+width <= image width
+
+        Parameter buffer: The new pixels
+        Precondition: buffer is a pixel buffer (see _is_pixel_buffer) with
+        exactly 3*width*height bytes
+        """
+        if self._checked:
+            assert type(row)==int and row>=0, repr(row)+' is not an int >= 0.'
+            assert type(col)==int and col>=0, repr(col)+' is not an int >= 0.'
+            assert type(height)==int and height>=0, repr(height)+' is not an int >= 0.'
+            assert type(width)==int and width>=0, repr(width)+' is not an int >= 0.'
+            assert row+height<=self.getHeight(), repr(height)+' rows do not fit at row '+repr(row)+'.'
+            assert col+width<=self.getWidth(), repr(width)+' columns do not fit at column '+repr(col)+'.'
+            assert _is_pixel_buffer(buffer), repr(buffer)+' is not a pixel buffer.'
+            assert len(buffer)==3*width*height, repr(buffer)+' does not have '\
+            'the same number of pixels as the rectangle.'
+        self._guard(row,col,height,width)
+        if len(buffer)!=3*width*height:
+            raise ValueError(repr(width)+'x'+repr(height)+' pixels do not fit '+repr(len(buffer))+' bytes')
+
+        if self._orientation:
+            self._materialize()
+        if height==0 or width==0:
+            return
+        if self._dirty is not None:
+            self._touch(row,col,height,width)
+
+        if not self.isCompact():
+            pixels = list(zip(buffer[0::3],buffer[1::3],buffer[2::3]))
+            start  = row*self._width+col
+            for pos in range(height):
+                self._data[start+pos*self._width:start+pos*self._width+width] = pixels[pos*width:(pos+1)*width]
+            return
+
+        data  = self._data
+        span  = 3*width
+        line  = 3*self._width
+        start = row*line+3*col
+        if span==line or height==1:
+            data[start:start+(height-1)*line+span] = buffer
+        elif height<=span:
+            for pos in range(height):
+                data[start+pos*line:start+pos*line+span] = buffer[pos*span:(pos+1)*span]
+        else:
+            stop = start+(height-1)*line+1
+            for pos in range(span):
+                data[start+pos:stop+pos:line] = buffer[pos::span]
+
+    # HELPER METHODS
+    def _write(self, pos, pixel):
+        """
+        Sets the pixel at the given position of the storage to pixel.
+
+        This does not check pixel, but it raises an IndexError if pos is not a
+        position in the image, even if the image is unchecked. For a compact
+        image, the three bytes are set one at a time (which is also faster than
+        a slice), so a bad position or pixel can never resize the storage.
+
+        Parameter pos: The position in the pixel list
+        Precondition: pos is an int
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        if pos<0:
+            raise IndexError('Position '+repr(pos)+' is not in the image')
+        if self.isCompact():
+            data=self._data
+            pos*=3
+            data[pos]=pixel[0]
+            data[pos+1]=pixel[1]
+            data[pos+2]=pixel[2]
+        else:
+            self._data[pos]=pixel
+
+    def _guard(self, row, col, height, width):
+        """
+        Raises an IndexError if the rectangle at (row, col) is not in the image.
+
+        This is checked even if the image is unchecked, as writing a rectangle
+        that is out of range would resize the storage instead of failing.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int
+        """
+        if row<0 or col<0 or height<0 or width<0 or \
+           row+height>self.getHeight() or col+width>self.getWidth():
+            raise IndexError('The rectangle '+repr((row,col,height,width))+' is not in the image')
+
+    def _touch(self, row, col, height=1, width=1):
+        """
+        Adds the rectangle at (row, col) to the dirty rectangles.
+
+        A rectangle one row high that is just to the right of the last
+        rectangle (in the same row) extends that rectangle instead, unless
+        that rectangle was written before the newest mark. If there
+        are more than DIRTY_LIMIT rectangles, the whole image is marked dirty
+        instead, since uploading that many pieces would not save anything.
+        This also stops the tracking (and its cost) for an operation that
+        writes every pixel one at a time.
+
+        Precondition: the image is tracking dirty rectangles (_dirty is a
+        list), and the rectangle is inside of the image
+        """
+        dirty=self._dirty
+        if len(dirty) > self._floor and height==1:
+            (top, left, rows, cols) = dirty[-1]
+            if top==row and rows==1 and left+cols==col:
+                dirty[-1]=(top,left,1,cols+width)
+                return
+        if len(dirty)==DIRTY_LIMIT:
+            self._dirty=None
+        else:
+            dirty.append((row,col,height,width))
+
+    def _materialize(self):
+        """
+        Moves the pixels to match the pending orientation.
+
+        Reflections are done in place, and so is the transpose of a square
+        image, so in those cases no second copy of the image is needed. Any
+        other transpose copies the image in bands that fit in the cache (see
+        _transposeBands). Every step moves whole rows or columns with slices
+        (one per color channel for a compact image), so no Python object is
+        created for an individual pixel. The data is still the same list,
+        bytearray or memoryview afterwards. A memoryview (see fromView) is
+        moved in a bytearray copy, which is then written back.
+
+        Precondition: the image has a pending orientation
+        """
+        (transposed, flipRows, flipCols) = self._orientation
+        self._orientation=None
+        self._dirty=None
+        view=None
+        if type(self._data)==memoryview:
+            view=self._data
+            self._data=bytearray(view)
+        if not transposed:
+            self._reflect(flipRows,flipCols)
+        elif self._width==self._height:
+            self._transposeSquare()
+            # The stored rows are now the columns, and vice versa
+            self._reflect(flipCols,flipRows)
+        else:
+            self._transposeBands(flipRows,flipCols)
+        if view is not None:
+            view[:]=self._data
+            self._data=view
+
+    def _reflect(self, flipRows, flipCols):
+        """
+        Reflects the stored pixels in place.
+
+        Parameter flipRows: Whether to reverse the order of the rows
+        Precondition: flipRows is a bool
+
+        Parameter flipCols: Whether to reverse the order of the pixels in each row
+        Precondition: flipCols is a bool
+        """
+        data=self._data
+        compact=self.isCompact()
+        size=3*self._width if compact else self._width      # One row of _data
+        if flipRows and flipCols:
+            # This is the same as reversing all of the pixels
+            data.reverse()
+            if compact:
+                (data[0::3],data[2::3])=(data[2::3],data[0::3])
+        elif flipRows:
+            for row in range(self._height//2):
+                top=row*size
+                bottom=(self._height-1-row)*size
+                (data[top:top+size],data[bottom:bottom+size])=(data[bottom:bottom+size],data[top:top+size])
+        elif flipCols:
+            for start in range(0,len(data),size):
+                line=data[start:start+size]
+                line.reverse()
+                if compact:
+                    (line[0::3],line[2::3])=(line[2::3],line[0::3])
+                data[start:start+size]=line
+
+    def _transposeSquare(self):
+        """
+        Transposes the stored pixels of a square image in place.
+
+        The transpose swaps the pixels at (row, col) and (col, row), so every
+        cycle of the permutation has length 2. They are followed one row at a
+        time: the part of each row to the right of the diagonal is swapped
+        with the part of the matching column below it.
+
+        Precondition: the image is square
+        """
+        data=self._data
+        size=self._width
+        if self.isCompact():
+            for pos in range(size-1):
+                right=3*(pos*size+pos+1)
+                end=3*(pos+1)*size
+                below=3*((pos+1)*size+pos)
+                for k in range(3):
+                    line=data[right+k:end:3]
+                    data[right+k:end:3]=data[below+k::3*size]
+                    data[below+k::3*size]=line
+        else:
+            for pos in range(size-1):
+                right=pos*size+pos+1
+                below=(pos+1)*size+pos
+                line=data[right:(pos+1)*size]
+                data[right:(pos+1)*size]=data[below::size]
+                data[below::size]=line
+
+    def _transposeBands(self, flipRows, flipCols):
+        """
+        Transposes (and reflects) the stored pixels into a new row-major order.
+
+        Each row of the result is a column of the stored image. Reading that
+        column straight from a large image touches a different cache line for
+        every pixel. So the stored image is split into bands of columns, each
+        about TILE_SIZE bytes. Each band is copied out one row at a time, and
+        its columns are then read from the copy, which is still in the cache.
+
+        Parameter flipRows: Whether to reverse each column of the stored image
+        Precondition: flipRows is a bool
+
+        Parameter flipCols: Whether to reverse the order of those columns
+        Precondition: flipCols is a bool
         """
-        return Image(self.getData(),self.getWidth())
+        data=self._data
+        width=self._width       # The height of the stored image
+        height=self._height     # The width of the stored image
+        compact=self.isCompact()
+        count=max(1,TILE_SIZE//(3*width))
+
+        if compact:
+            result=bytearray(len(data))
+            view=memoryview(data)
+        else:
+            result=[None]*len(data)
+        for first in range(0,height,count):
+            size=min(count,height-first)
+            if compact:
+                band=b''.join([view[pos:pos+3*size] for pos in range(3*first,len(data),3*height)])
+            else:
+                band=[]
+                for pos in range(first,len(data),height):
+                    band+=data[pos:pos+size]
+
+            for col in range(size):
+                row=height-1-first-col if flipCols else first+col
+                if compact:
+                    start=3*row*width
+                    for k in range(3):
+                        piece=band[3*col+k::3*size]
+                        result[start+k:start+3*width:3]=piece[::-1] if flipRows else piece
+                else:
+                    piece=band[col::size]
+                    result[row*width:(row+1)*width]=piece[::-1] if flipRows else piece
+        if compact:
+            view.release()
+        data[:]=result
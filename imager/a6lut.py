@@ -0,0 +1,329 @@
+"""
+Lookup tables for the color transforms of the imager application.
+
+A color transform changes every pixel on its own, so it is really a mapping
+from old colors to new ones. This module applies transforms as lookups in
+precomputed tables instead of computing each pixel. The transforms are
+called looks (see Look), and Filter.look applies any look registered here
+by name. The operations invert and monochromify are looks too.
+
+If each channel of the new color only depends on the same channel of the
+old color, the look is three tables of 256 bytes. This covers adjustments
+like levels, gamma and curves, which have helper functions below. These
+looks are applied with bytes.translate, so there is no Python work for an
+individual pixel, and NumPy is not needed.
+
+If the new color is a tint of a weighted sum of the channels, like greyscale
+and sepia, the look is just the weights and the tint. Without NumPy, it also
+has three tables of 256 weighted values, one for each channel. Adding up the
+values from the tables gives exactly the same sum as computing the weighted
+sum, so the result is the same. Any other color transform is a function of
+the three channels.
+
+Julia Ludwig (jal545)
+11/14/20
+"""
+import a6vector
+
+# The number of 24 bit colors
+COLORS = 1 << 24
+
+# The most colors whose new color is remembered while mixing without NumPy
+MEMO_SIZE = 1 << 16
+
+# The looks that can be applied with Filter.look, by name
+LOOKS = {}
+
+
+class Look(object):
+    """
+    A class representing a color transform made of lookup tables.
+
+    A look is either a table of 256 bytes for each channel, weights for a
+    tinted weighted sum of the channels, or a function that mixes the
+    channels. The function is called as function(red, green, blue), on
+    numbers or on NumPy arrays of floats, and returns a tuple of the new
+    (red, green, blue) values. The values must be >= 0 and < 256, and are
+    truncated like int().
+
+    With weights, the new color of (red, green, blue) is tint[k]*brightness
+    for each channel k, where brightness is
+    weights[0]*red+weights[1]*green+weights[2]*blue. With NumPy, this is
+    computed for whole bands of the image at a time (see a6vector.weigh).
+    Without NumPy, the three terms come from a table of 256 values for each
+    channel.
+
+    With NumPy, a function is applied to whole bands of the image at a time.
+    But an image with at least as many pixels as there are colors is mapped
+    through a table of the new color of every color instead (see
+    a6vector.colormap), as the table costs about as much as the pixels. The
+    table is about 48MB, so it is not kept. Without NumPy, the new value of
+    each distinct color is computed once, remembering up to MEMO_SIZE colors.
+    """
+    # IMMUTABLE ATTRIBUTES (Fixed after initialization)
+    # Attribute _tables: The table for each channel
+    # Invariant: _tables is None or a tuple of three bytes objects of length 256
+    #
+    # Attribute _weights: The weight of each channel in the brightness
+    # Invariant: _weights is None or a tuple of three numbers >= 0
+    #
+    # Attribute _terms: The weighted values of each channel
+    # Invariant: _terms is a tuple of three tuples of 256 floats, where
+    # _terms[k][v] is _weights[k]*v (None if _weights is)
+    #
+    # Attribute _tint: The factor of the brightness in each channel
+    # Invariant: _tint is a tuple of three numbers (None if _weights is)
+    #
+    # Attribute _function: The function mixing the channels
+    # Invariant: _function is None or a function as above. Exactly one of
+    # _tables, _weights and _function is not None.
+
+    # GETTERS
+    def getTables(self):
+        """
+        Returns the tuple of the (red, green, blue) tables of this look.
+
+        The value is None if this look mixes the channels.
+        """
+        return self._tables
+
+    def getWeights(self):
+        """
+        Returns the tuple of the weights of (red, green, blue) in the brightness.
+
+        The value is None if this look does not have weights.
+        """
+        return self._weights
+
+    def getTint(self):
+        """
+        Returns the factors of the brightness in the new (red, green, blue).
+
+        The value is None if this look does not have weights.
+        """
+        return self._tint
+
+    def getFunction(self):
+        """
+        Returns the function mixing the channels for this look.
+
+        The value is None if this look has tables or weights.
+        """
+        return self._function
+
+    # INITIALIZER
+    def __init__(self, red=None, green=None, blue=None, function=None, weights=None, tint=(1,1,1)):
+        """
+        Initializes a look from channel tables, from weights or from a function.
+
+        Either give the red table (and optionally the green and blue tables,
+        which default to the red one), or give only the weights (and
+        optionally the tint), or give only the function.
+
+        Parameter red: The table for the red channel
+        Precondition: red is None or a bytes-like object of length 256
+
+        Parameter green: The table for the green channel
+        Precondition: green is None or a bytes-like object of length 256
+
+        Parameter blue: The table for the blue channel
+        Precondition: blue is None or a bytes-like object of length 256
+
+        Parameter function: The function mixing the channels
+        Precondition: function is None or a function as described above
+
+        Parameter weights: The weights of the (red, green, blue) channels
+        Precondition: weights is None or a tuple of three numbers >= 0 that add
+        up to at most 1, and exactly one of red, function and weights is None
+
+        Parameter tint: The factors of the brightness in the new (red, green, blue)
+        Precondition: tint is a tuple of three numbers in 0..1
+        """
+        kinds = [red is not None, function is not None, weights is not None]
+        assert kinds.count(True) == 1, 'A look needs tables, weights or a function (only one).'
+        self._tables   = None
+        self._weights  = None
+        self._terms    = None
+        self._tint     = None
+        self._function = None
+
+        if red is None:
+            assert green is None and blue is None, 'A look needs tables, weights or a function (only one).'
+        if function is not None:
+            assert callable(function), repr(function)+' is not callable.'
+            self._function = function
+            return
+        if weights is not None:
+            for values in (weights, tint):
+                assert type(values) == tuple and len(values) == 3, repr(values)+' is not a tuple of three numbers.'
+                for value in values:
+                    assert type(value) in [int,float] and value >= 0, repr(value)+' is not a number >= 0.'
+            assert sum(weights) <= 1 and max(tint) <= 1, repr((weights,tint))+' can make values above 255.'
+            self._weights = weights
+            self._terms = tuple(tuple(weight*value for value in range(256)) for weight in weights)
+            self._tint = tint
+            return
+
+        tables = []
+        for table in (red, red if green is None else green, red if blue is None else blue):
+            table = bytes(table)
+            assert len(table) == 256, repr(table)+' does not have 256 entries.'
+            tables.append(table)
+        self._tables = tuple(tables)
+
+    # OPERATIONS
+    def apply(self, image, vectorize=True):
+        """
+        Applies this look to image.
+
+        Parameter image: The image to change
+        Precondition: image is an Image object
+
+        Parameter vectorize: Whether to use NumPy (if it is installed)
+        Precondition: vectorize is a bool
+        """
+        if self._tables is not None:
+            self._translate(image)
+        elif not (vectorize and a6vector.AVAILABLE):
+            self._mix(image)
+        elif self._weights is not None:
+            a6vector.weigh(image,self._weights,self._tint)
+        elif len(image) < COLORS:
+            a6vector.mix(image,self._function)
+        else:
+            a6vector.remap(image,a6vector.colormap(self._function))
+
+    # HELPER METHODS
+    def _translate(self, image):
+        """
+        Applies the channel tables to image, one channel at a time.
+
+        Parameter image: The image to change
+        Precondition: image is an Image object
+        """
+        data = image.getBytes()
+        (red, green, blue) = self._tables
+        if red == green == blue:
+            data = data.translate(red)
+        else:
+            for (k, table) in enumerate(self._tables):
+                data[k::3] = data[k::3].translate(table)
+        image.setBytes(data)
+
+    def _mix(self, image):
+        """
+        Applies the function to image without NumPy.
+
+        The new value of each distinct color is only computed once, as long
+        as there are at most MEMO_SIZE of them. After that the colors are
+        forgotten and computed again.
+
+        Parameter image: The image to change
+        Precondition: image is an Image object
+        """
+        data = image.getBytes()
+        memo = {}
+        function = self._function
+        if function is None:
+            (red, green, blue) = self._terms
+            tint = self._tint
+            def function(r, g, b):
+                brightness = red[r]+green[g]+blue[b]
+                return (tint[0]*brightness,tint[1]*brightness,tint[2]*brightness)
+        def lookup(color):
+            if not color in memo:
+                if len(memo) >= MEMO_SIZE:
+                    memo.clear()
+                memo[color] = bytes(int(value) for value in function(*color))
+            return memo[color]
+        image.setBytes(b''.join([lookup(color) for color in zip(data[0::3],data[1::3],data[2::3])]))
+
+
+# TABLES
+def levels(low, high):
+    """
+    Returns a table that stretches the values from low to high over 0 to 255.
+
+    Values <= low become 0 and values >= high become 255. The values in
+    between are scaled linearly, rounding down.
+
+    Parameter low: The value that becomes black
+    Precondition: low is an int in 0..254
+
+    Parameter high: The value that becomes white
+    Precondition: high is an int in low+1..255
+    """
+    assert type(low) == int and 0 <= low < 255, repr(low)+' is not an int in 0..254.'
+    assert type(high) == int and low < high <= 255, repr(high)+' is not an int in '+str(low+1)+'..255.'
+    return bytes(min(255,max(0,255*(value-low)//(high-low))) for value in range(256))
+
+
+def gamma(value):
+    """
+    Returns a table that applies the given gamma correction.
+
+    Each value v becomes 255*(v/255)**(1/value), rounded to the nearest int.
+    So a gamma above 1 brightens the image and a gamma below 1 darkens it.
+
+    Parameter value: The gamma
+    Precondition: value is a number > 0
+    """
+    assert type(value) in [int,float] and value > 0, repr(value)+' is not a number > 0.'
+    return bytes(int(255*(v/255)**(1/value)+0.5) for v in range(256))
+
+
+def curve(points):
+    """
+    Returns a table that follows a curve through the given points.
+
+    Each point is a pair (old, new), meaning that the value old becomes new.
+    The values between two points are interpolated linearly (rounding down).
+    The first point must start at 0 and the last must end at 255.
+
+    Parameter points: The points of the curve
+    Precondition: points is a list of at least two pairs of ints in 0..255,
+    where the first values increase from 0 to 255
+    """
+    assert type(points) == list and len(points) >= 2, repr(points)+' is not a list of points.'
+    assert points[0][0] == 0 and points[-1][0] == 255, repr(points)+' does not cover 0..255.'
+    for (old, new) in points:
+        assert type(old) == int and type(new) == int, repr((old,new))+' is not a pair of ints.'
+        assert 0 <= new <= 255, repr(new)+' is not in 0..255.'
+
+    result = bytearray()
+    for ((x0, y0), (x1, y1)) in zip(points,points[1:]):
+        assert x0 < x1, repr(points)+' is not increasing.'
+        result.extend(y0+(y1-y0)*(value-x0)//(x1-x0) for value in range(x0,x1))
+    result.append(points[-1][1])
+    return bytes(result)
+
+
+def register(name, look):
+    """
+    Registers look under the given name, so Filter.look can apply it.
+
+    A look already registered under that name is replaced.
+
+    Parameter name: The name of the look
+    Precondition: name is a non-empty string
+
+    Parameter look: The look to register
+    Precondition: look is a Look object
+    """
+    assert type(name) == str and name != '', repr(name)+' is not a non-empty string.'
+    assert isinstance(look,Look), repr(look)+' is not a look.'
+    LOOKS[name] = look
+
+
+# THE BUILT-IN LOOKS
+# The looks used by Filter.invert and Filter.monochromify
+INVERT    = Look(bytes(range(255,-1,-1)))
+GREYSCALE = Look(weights=(0.3,0.6,0.1))
+SEPIA     = Look(weights=(0.3,0.6,0.1),tint=(1,0.6,0.4))
+
+register('invert',INVERT)
+register('greyscale',GREYSCALE)
+register('sepia',SEPIA)
+register('brighten',Look(gamma(1.5)))
+register('contrast',Look(curve([(0,0),(64,48),(192,208),(255,255)])))
+register('warm',Look(curve([(0,0),(128,144),(255,255)]),None,curve([(0,0),(128,112),(255,255)])))
@@ -0,0 +1,283 @@
+"""
+Parallel image processing for the imager application.
+
+A single Filter operation normally runs on one core, no matter how large the
+image is. This module splits the current image into horizontal bands and
+processes the bands at the same time in a pool of worker processes. The image
+is copied once into shared memory, and the result is copied back when every
+band is done. In between, each worker edits its band right in the shared
+memory: the band is a compact Image over a view of that memory (see
+Image.fromView), and the Filter that processes it does not copy it (see
+make_editor). So a worker does not copy its band at all.
+
+The bands are processed by a Filter of the same class as the caller, with
+the same engine flags (see FLAGS), so each band is computed the same way as
+it would be in one piece. That class must be defined at the top level of a
+module, so that it can be sent to the worker processes.
+
+This only works for operations where each band can be computed on its own:
+the pointwise operations (invert, monochromify and vignette) and pixellate,
+as long as every band starts on a multiple of the step. The operation 'fuse'
+is a chain of pointwise operations (see Filter.pipeline). The result is always
+identical to processing the whole image at once.
+
+Julia Ludwig (jal545)
+11/14/20
+"""
+import threading
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+# The operations that can be processed in bands
+OPERATIONS = ('invert','monochromify','vignette','pixellate','fuse')
+
+# The Filter attributes that choose how an operation is computed
+FLAGS = ('VECTORIZE','LOOKUP','SYMBOLIC','UNCHECKED')
+
+# The worker pool, which is shared by all operations
+_executor = None
+# The number of processes in the worker pool
+_workers = 0
+# A lock to protect the pool if filters are run in more than one thread
+_lock = threading.Lock()
+
+
+# HELPER FUNCTIONS
+def _pool(workers):
+    """
+    Returns a pool of the given number of worker processes.
+
+    The pool is created the first time it is needed, and reused afterwards.
+    If the number of workers changes, the old pool is shut down.
+
+    Parameter workers: The number of worker processes
+    Precondition: workers is an int > 1
+    """
+    global _executor, _workers
+    if _executor is None or _workers != workers:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = ProcessPoolExecutor(max_workers=workers)
+        _workers  = workers
+    return _executor
+
+
+def bands(height, count, align=1):
+    """
+    Returns a list of (top, bottom) row ranges that cover an image.
+
+    The ranges are as even as possible, but every one except the last starts
+    and ends on a multiple of align. The bottom row is not included in the
+    range, so the ranges are (0, b1), (b1, b2), ..., (bn, height). There may
+    be fewer than count ranges if the image is short.
+
+    Parameter height: The image height
+    Precondition: height is an int > 0
+
+    Parameter count: The number of bands to make
+    Precondition: count is an int > 0
+
+    Parameter align: The number that band boundaries must be a multiple of
+    Precondition: align is an int > 0
+    """
+    size = -(-height//count)            # Round up
+    size = -(-size//align)*align        # Round up to a multiple of align
+    return [(top,min(top+size,height)) for top in range(0,height,size)]
+
+
+def settings(editor):
+    """
+    Returns the class and flags to process bands with to match editor.
+
+    The value is a tuple (kind, flags), where kind is the class of editor
+    and flags is a dict with the value of each attribute in FLAGS (which
+    may be set on editor itself instead of its class).
+
+    Parameter editor: The Filter whose operation is split into bands
+    Precondition: editor is a Filter object
+    """
+    return (type(editor),{flag : getattr(editor,flag) for flag in FLAGS})
+
+
+def make_editor(image, settings):
+    """
+    Returns a Filter with the given settings that edits image in place.
+
+    Unlike a Filter made with the initializer, the current image of this
+    Filter is image itself, not a copy (just like Editor._rebuild), so the
+    operations change image directly. The Filter has no edit history.
+
+    Parameter image: The image to edit
+    Precondition: image is an Image object
+
+    Parameter settings: The class and flags of the Filter
+    Precondition: settings is a value returned by the function settings
+    """
+    import a6image
+    (kind, flags) = settings
+    editor = kind(a6image.Image.fromBytes(bytearray(3),1))
+    editor._current = image
+    for (flag, value) in flags.items():
+        setattr(editor,flag,value)
+    return editor
+
+
+def apply_band(editor, name, args, top, height):
+    """
+    Applies the given Filter operation to a band of a taller image.
+
+    The current image of editor is the band: the rows starting at top of an
+    image that is height rows tall. The operation is applied to it in this
+    process, just as a worker would. This is also used to show an operation
+    one band at a time (see Filter.setMonitor).
+
+    Parameter editor: The Filter to apply the operation with
+    Precondition: editor is a Filter object
+
+    Parameter name: The operation to apply
+    Precondition: name is an element of OPERATIONS
+
+    Parameter args: The arguments to the operation
+    Precondition: args is a tuple of valid arguments for the operation
+
+    Parameter top: The row of the taller image where the band starts
+    Precondition: top is an int >= 0 (a multiple of the step for pixellate)
+
+    Parameter height: The height of the taller image
+    Precondition: height is an int >= top + band height
+    """
+    editor.WORKERS = 1
+    editor.LAZY = False
+    if name == 'vignette':
+        # The darkening depends on where the band is in the whole image
+        with editor.getCurrent().unchecked():
+            editor._vignette(top,height)
+    elif name == 'fuse':
+        with editor.getCurrent().unchecked():
+            editor._fuse(args[0],top,height)
+    else:
+        getattr(editor,name)(*args)
+
+
+def _work(memory, width, height, top, bottom, name, args, offset, settings):
+    """
+    Applies the given Filter operation to one band of an image in shared memory.
+
+    This is the function run by a worker process. The band is a compact
+    Image over the shared memory (see Image.fromView), which is processed in
+    place by a Filter with the given settings (see make_editor).
+
+    Parameter memory: The name of the shared memory block
+    Precondition: memory is a string naming a SharedMemory with the image pixels
+
+    Parameter width: The image width
+    Precondition: width is an int > 0
+
+    Parameter height: The height of the whole image
+    Precondition: height is an int > 0
+
+    Parameter top: The first row of the band in the shared memory
+    Precondition: top is an int, 0 <= top < bottom
+
+    Parameter bottom: The row after the last row of the band in the shared memory
+    Precondition: bottom is an int, top < bottom
+
+    Parameter name: The operation to apply
+    Precondition: name is an element of OPERATIONS
+
+    Parameter args: The arguments to the operation
+    Precondition: args is a tuple of valid arguments for the operation
+
+    Parameter offset: The row of the whole image where the shared memory starts
+    Precondition: offset is an int >= 0, and offset+bottom <= height
+
+    Parameter settings: The class and flags of the Filter to process the band with
+    Precondition: settings is a value returned by the function settings
+    """
+    import a6image
+
+    shared = shared_memory.SharedMemory(name=memory)
+    try:
+        view = shared.buf[top*width*3:bottom*width*3]
+        image = a6image.Image.fromView(view,width)
+        editor = make_editor(image,settings)
+        apply_band(editor,name,args,offset+top,height)
+        if editor.getCurrent() is not image:
+            # The operation replaced the image instead of changing it
+            view[:] = editor.getCurrent().getView()
+        # The shared memory cannot be closed while anything refers to it
+        del editor, image, view
+    finally:
+        shared.close()
+
+
+# PARALLEL OPERATIONS
+def apply(image, name, args, workers, align=1, offset=0, total=None, editor=None):
+    """
+    Applies the given Filter operation to image using several processes.
+
+    The image is split into bands (see bands) with one band per worker. Each
+    band is processed by a different worker process, and the image is
+    updated in place once all of them are done.
+
+    The image may itself be a band of a taller image (see Filter.setMonitor),
+    given by offset and total.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter name: The operation to apply
+    Precondition: name is an element of OPERATIONS
+
+    Parameter args: The arguments to the operation
+    Precondition: args is a tuple of valid arguments for the operation
+
+    Parameter workers: The number of worker processes
+    Precondition: workers is an int > 1
+
+    Parameter align: The number that band boundaries must be a multiple of
+    Precondition: align is an int > 0
+
+    Parameter offset: The row of the taller image where image starts
+    Precondition: offset is an int >= 0 (a multiple of align)
+
+    Parameter total: The height of the taller image (or None for the height of image)
+    Precondition: total is None or an int >= offset + image height
+
+    Parameter editor: The Filter whose class and flags process the bands (see settings)
+    Precondition: editor is a Filter object whose class is defined at the top
+    level of a module, or None to use a plain Filter
+    """
+    assert name in OPERATIONS, repr(name)+' cannot be processed in bands.'
+    assert type(workers) == int and workers > 1, repr(workers)+' is not an int > 1.'
+    if editor is None:
+        import a6filter
+        config = (a6filter.Filter,{})
+    else:
+        config = settings(editor)
+
+    width  = image.getWidth()
+    height = image.getHeight()
+    size   = 3*len(image)
+    if total is None:
+        total = height
+
+    shared = shared_memory.SharedMemory(create=True,size=size)
+    try:
+        with image.getView() as view:
+            shared.buf[:size] = view
+
+        with _lock:
+            pool = _pool(workers)
+            futures = [pool.submit(_work,shared.name,width,total,top,bottom,name,args,offset,config)
+                       for (top,bottom) in bands(height,workers,align)]
+            for future in futures:
+                future.result()
+
+        if image.isCompact():
+            image.getBuffer()[:] = shared.buf[:size]
+        else:
+            image.setBytes(bytes(shared.buf[:size]))
+    finally:
+        shared.close()
+        shared.unlink()
@@ -28,28 +28,16 @@ def load_image(file):
     Precondition: file is a string
     """
     import os.path
-    from PIL import Image as CoreImage
+    import a6file
     path = os.path.split(__file__)[0]
     path = os.path.join(path,'tests',file+'.png')
 
     try:
-        image = CoreImage.open(path)
-        image = image.convert("RGB")
-        buffer = list(image.getdata())
-        size  = image.size[0]*image.size[1]
-        width = image.size[0]
+        result = a6file.read_image(path)
     except:
         traceback.print_exc()
         print('Could not load the file '+path)
-        buffer = None
-
-    result = None
-    if not buffer is None:
-        try:
-            result = a6image.Image(buffer,width)
-        except:
-            traceback.print_exc()
-            result = None
+        result = None
     return result
 
 
@@ -297,8 +285,627 @@ def test_image_other():
     introcs.assert_error(image.swapPixels, 0, 1, 0, 'a', message='swapPixels does not enforce the precondition on column type')
     introcs.assert_error(image.swapPixels, 0, 1, 0, 8,   message='swapPixels does not enforce the precondition on column value')
 
+
+def test_image_compact():
+    """
+    Tests the compact (byte buffer) storage mode of class Image
+    """
+    print('Testing compact image storage')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    c = bytes([255,64,0, 0,255,64, 64,0,255, 64,255,128, 128,64,255, 255,128,64])
+    b = bytearray(c)  # Need to copy this
+    rgb = (64,128,192)
+
+    introcs.assert_true(a6image._is_pixel_buffer(b))
+    introcs.assert_true(a6image._is_pixel_buffer(bytes(b)))
+    introcs.assert_false(a6image._is_pixel_buffer(b[:5]))
+    introcs.assert_false(a6image._is_pixel_buffer(p))
+
+    image = a6image.Image.fromBytes(b,2)
+    introcs.assert_true(image.isCompact())
+    introcs.assert_equals(id(b),id(image._data))
+    introcs.assert_equals(6,len(image))
+    introcs.assert_equals(2,image.getWidth())
+    introcs.assert_equals(3,image.getHeight())
+    introcs.assert_equals(p,image.getData())
+    introcs.assert_equals(b,image.getBytes())
+    introcs.assert_not_equals(id(b),id(image.getBytes()))
+    for n in range(6):
+        introcs.assert_equals(p[n],image[n])
+        introcs.assert_equals(p[n],image.getPixel(n // 2, n % 2))
+
+    image[4] = rgb
+    introcs.assert_equals(rgb,image[4])
+    introcs.assert_equals(rgb,image.getPixel(2,0))
+    introcs.assert_equals(rgb,tuple(b[12:15]))      # Because image has a reference to b
+    image.setPixel(2,0,p[4])
+    introcs.assert_equals(p[4],image[4])
+
+    image.setWidth(3)
+    introcs.assert_equals(2,image.getHeight())
+    introcs.assert_equals(p[3],image.getPixel(1,0))
+
+    copy = image.copy()
+    introcs.assert_true(copy.isCompact())
+    introcs.assert_not_equals(id(image._data), id(copy._data))
+    introcs.assert_equals(image.getData(),copy.getData())
+    introcs.assert_equals(3,copy.getWidth())
+
+    image.swapPixels(0,0,1,2)
+    introcs.assert_equals(p[5],image.getPixel(0,0))
+    introcs.assert_equals(p[0],image.getPixel(1,2))
+    introcs.assert_equals(p[0],copy.getPixel(0,0))
+
+    # Bulk access works the same in both storage modes
+    image = a6image.Image(p[:],3)
+    introcs.assert_equals(c,image.getBytes())
+    image.setBytes(bytes(reversed(c)))
+    introcs.assert_false(image.isCompact())
+    introcs.assert_equals((64,128,255),image[0])
+    copy.setBytes(image.getBytes())
+    introcs.assert_equals(image.getData(),copy.getData())
+
+    # A view shares the bytes of a compact image, and copies the others
+    with copy.getView() as view:
+        introcs.assert_equals(image.getBytes(),view.tobytes())
+        view[0] = 1
+    introcs.assert_equals(1,copy[0][0])
+    with image.getView() as view:
+        introcs.assert_equals(image.getBytes(),view.tobytes())
+        view[0] = 2
+    introcs.assert_equals((64,128,255),image[0])
+
+    # An image over a memoryview writes to the memory under it
+    store = bytearray(c)
+    shared = a6image.Image.fromView(memoryview(store),3)
+    introcs.assert_true(shared.isCompact())
+    shared[0] = (1,2,3)
+    introcs.assert_equals(b'\x01\x02\x03',store[:3])
+    expected = shared.copy()
+    expected.reorient('reflectHori')
+    shared.reorient('reflectHori')
+    introcs.assert_equals(expected.getBytes(),shared.getBytes())
+    introcs.assert_equals(expected.getBytes(),store)
+    shared.copy()[0] = (4,5,6)
+    introcs.assert_equals(store[:3],shared.getRegion(0,0,1,1))
+
+    # Test enforcement
+    introcs.assert_error(a6image.Image.fromView,store,3,     message='fromView does not enforce the precondition on view')
+    introcs.assert_error(a6image.Image.fromView,memoryview(bytes(c)),3,message='fromView does not enforce the precondition on writing')
+    introcs.assert_error(a6image.Image.fromBytes,p,3,        message='fromBytes does not enforce the precondition on data')
+    introcs.assert_error(a6image.Image.fromBytes,b'',1,      message='fromBytes does not enforce the precondition on data size')
+    introcs.assert_error(a6image.Image.fromBytes,b,'a',      message='fromBytes does not enforce the precondition width type')
+    introcs.assert_error(a6image.Image.fromBytes,b,4,        message='fromBytes does not enforce the precondition width validity')
+    introcs.assert_error(copy.setBytes,b[:15],               message='setBytes does not enforce the precondition on size')
+    introcs.assert_error(copy.__setitem__,0,(0,0,256),       message='__setitem__ does not enforce the precondition on pixel value')
+    introcs.assert_error(copy.getPixel,2,0,                  message='getPixel does not enforce the precondition on row value')
+
+def test_image_trusted():
+    """
+    Tests the trusted constructor and unchecked access in class Image
+    """
+    print('Testing trusted and unchecked images')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+
+    image = a6image.Image.fromTrusted(p,2)
+    introcs.assert_equals(id(p),id(image._data))
+    introcs.assert_false(image.isCompact())
+    introcs.assert_true(image.isChecked())
+    introcs.assert_equals(3,image.getHeight())
+
+    image = a6image.Image.fromTrusted(bytearray(6*3),3)
+    introcs.assert_true(image.isCompact())
+    introcs.assert_equals(2,image.getHeight())
+
+    image = a6image.Image(p,2)
+    introcs.assert_true(image.copy().isChecked())
+    with image.unchecked():
+        introcs.assert_false(image.isChecked())
+        image.setPixel(0,0,(1,2,3))
+        introcs.assert_equals((1,2,3),image[0])
+    introcs.assert_true(image.isChecked())
+
+    image.setChecked(False)
+    image[1] = (0,0,256)                            # Not enforced any more
+    image.setChecked(True)
+    introcs.assert_error(image.__setitem__,1,(0,0,256),message='__setitem__ does not enforce the precondition after setChecked')
+
+    # Unchecked writes out of range fail instead of resizing the storage
+    for image in [a6image.Image([(0,0,0)]*6,2),a6image.Image.fromBytes(bytearray(18),2)]:
+        size = len(image._data)
+        with image.unchecked():
+            introcs.assert_error(image.setPixel,3,0,(1,2,3),error=IndexError,message='setPixel resizes the storage')
+            introcs.assert_error(image.__setitem__,-1,(1,2,3),error=IndexError,message='__setitem__ wraps around')
+            introcs.assert_error(image.__setitem__,6,(1,2,3),error=IndexError,message='__setitem__ resizes the storage')
+            introcs.assert_error(image.fillRect,2,0,2,2,(1,2,3),error=IndexError,message='fillRect resizes the storage')
+            introcs.assert_error(image.setRegion,0,0,1,2,bytes(3),error=ValueError,message='setRegion resizes the storage')
+        introcs.assert_equals(size,len(image._data))
+
+    # Test enforcement
+    introcs.assert_error(a6image.Image.fromTrusted,'aaa',3,message='fromTrusted does not enforce the precondition on data')
+    introcs.assert_error(a6image.Image.fromTrusted,[],3,   message='fromTrusted does not enforce the precondition on data size')
+    introcs.assert_error(a6image.Image.fromTrusted,p,5,    message='fromTrusted does not enforce the precondition width validity')
+    introcs.assert_error(image.setChecked,1,               message='setChecked does not enforce the precondition on value')
+
+def test_image_orientation():
+    """
+    Tests the symbolic orientation methods in class Image
+    """
+    print('Testing symbolic orientation')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+
+    # The pixel order after each operation, for a 3x2 image of positions 0..5
+    expected = {'transpose':([0,2,4,1,3,5],3), 'reflectHori':([1,0,3,2,5,4],2),
+                'reflectVert':([4,5,2,3,0,1],2), 'rotateRight':([4,2,0,5,3,1],3),
+                'rotateLeft':([1,3,5,0,2,4],3)}
+    for compact in [False,True]:
+        for (operation, (order, width)) in expected.items():
+            image = a6image.Image(p[:],2)
+            if compact:
+                image = a6image.Image.fromBytes(image.getBytes(),2)
+            data = image._data
+            image.reorient(operation)
+            introcs.assert_equals(width,image.getWidth())
+            introcs.assert_equals(6//width,image.getHeight())
+            introcs.assert_not_equals(None,image.getOrientation())
+            introcs.assert_equals([p[pos] for pos in order],image.getData())
+            introcs.assert_equals(None,image.getOrientation())
+            introcs.assert_equals(id(data),id(image._data))
+
+    # Compositions are combined into one pending orientation
+    image = a6image.Image(p[:],2)
+    for operation in ['rotateLeft','rotateLeft','reflectHori']:
+        image.reorient(operation)
+    introcs.assert_equals((False,True,False),image.getOrientation())
+    introcs.assert_equals(p[4:]+p[2:4]+p[:2],image.getData())
+    image = a6image.Image(p[:],2)
+    for operation in ['rotateLeft','reflectHori','rotateLeft','reflectHori','transpose','rotateRight','reflectHori']:
+        image.reorient(operation)
+    introcs.assert_equals(None,image.getOrientation())
+    introcs.assert_equals(p,image.getData())
+
+    # Every access sees the reoriented pixels, including a copy
+    image = a6image.Image.fromBytes(a6image.Image(p[:],2).getBytes(),2)
+    image.reorient('rotateRight')
+    copy = image.copy()
+    introcs.assert_equals(image.getOrientation(),copy.getOrientation())
+    introcs.assert_equals((64, 0, 255),copy.getPixel(0,1))
+    introcs.assert_equals((0, 255, 64),copy[5])
+    image.reorient('transpose')
+    image.setPixel(1,0,(1,2,3))
+    introcs.assert_equals([p[4],p[5],(1,2,3),p[3],p[0],p[1]],image.getData())
+
+    # Test enforcement
+    introcs.assert_error(image.reorient,'rotate',message='reorient does not enforce the precondition on operation')
+
+
+def test_image_drawing():
+    """
+    Tests the drawing methods in class Image
+    """
+    print('Testing drawing methods')
+    black = (0,0,0)
+    red   = (255,0,0)
+
+    def expect(width, height, rects):
+        # The pixel list with red in the given (row, col, height, width) rectangles
+        result = []
+        for pos in range(width*height):
+            (row, col) = divmod(pos,width)
+            inside = any(r <= row < r+h and c <= col < c+w for (r,c,h,w) in rects)
+            result.append(red if inside else black)
+        return result
+
+    for compact in [False,True]:
+        def blank(width, height):
+            image = a6image.Image([black]*(width*height),width)
+            if compact:
+                image = a6image.Image.fromBytes(image.getBytes(),width)
+            return image
+
+        # Whole rows, parts of rows, tall and empty rectangles
+        for rect in [(1,0,2,7),(1,2,2,3),(0,5,6,1),(0,1,6,2),(3,3,0,2),(0,0,6,7)]:
+            image = blank(7,6)
+            image.fillRect(*rect,red)
+            introcs.assert_equals(expect(7,6,[rect]),image.getData())
+            introcs.assert_equals(compact,image.isCompact())
+
+        image = blank(7,6)
+        image.drawHSpan(5,1,6,red)
+        image.drawVSpan(0,0,3,red)
+        introcs.assert_equals(expect(7,6,[(5,1,1,6),(0,0,3,1)]),image.getData())
+
+        image = blank(7,6)
+        image.drawOutline(1,1,5,6,red)
+        introcs.assert_equals(expect(7,6,[(1,1,1,6),(5,1,1,6),(1,1,5,1),(1,6,5,1)]),image.getData())
+        image = blank(7,6)
+        image.drawOutline(0,0,6,7,red,3)
+        introcs.assert_equals(expect(7,6,[(0,0,6,7)]),image.getData())
+
+        image = blank(7,6)
+        image.drawGrid([0,4],[1,5],red,2,1)
+        introcs.assert_equals(expect(7,6,[(0,0,2,7),(4,0,2,7),(0,1,6,1),(0,5,6,1)]),image.getData())
+
+        # Drawing puts a pending orientation in place first
+        image = blank(7,6)
+        image.setPixel(0,0,(1,2,3))
+        image.reorient('rotateRight')
+        image.drawHSpan(0,0,3,red)
+        introcs.assert_equals((1,2,3),image.getPixel(0,5))
+        introcs.assert_equals([red,red,red,black],image.getData()[:4])
+
+    # Test enforcement
+    image = a6image.Image([black]*42,7)
+    introcs.assert_error(image.fillRect,0,0,7,1,red,message='fillRect does not enforce the precondition on height')
+    introcs.assert_error(image.fillRect,0,3,1,5,red,message='fillRect does not enforce the precondition on width')
+    introcs.assert_error(image.fillRect,-1,0,1,1,red,message='fillRect does not enforce the precondition on row')
+    introcs.assert_error(image.fillRect,0,0,1,1,(256,0,0),message='fillRect does not enforce the precondition on pixel')
+    introcs.assert_error(image.drawOutline,0,0,2,2,red,0,message='drawOutline does not enforce the precondition on thickness')
+    introcs.assert_error(image.drawGrid,[0],[6],red,1,2,message='drawGrid does not enforce the precondition on cols')
+    with image.unchecked():
+        image.fillRect(0,0,1,1,red)
+    introcs.assert_equals(red,image[0])
+
+
+def test_image_dirty():
+    """
+    Tests the dirty rectangles and regions in class Image
+    """
+    print('Testing dirty rectangles')
+    pixels = [(pos,2*pos,pos//2) for pos in range(42)]
+    for compact in [False,True]:
+        image = a6image.Image(pixels[:],7)
+        if compact:
+            image = a6image.Image.fromBytes(image.getBytes(),7)
+
+        # Regions in the layout of getBytes
+        data = image.getBytes()
+        for (row, col, height, width) in [(0,0,6,7),(2,0,3,7),(1,2,3,4),(0,5,6,1),(3,6,1,1),(2,2,0,3)]:
+            expected = bytearray()
+            for r in range(row,row+height):
+                expected.extend(data[3*(7*r+col):3*(7*r+col+width)])
+            introcs.assert_equals(expected,image.getRegion(row,col,height,width))
+
+            # Writing a region back in reverse order reverses those bytes
+            copy = image.copy()
+            copy.setRegion(row,col,height,width,bytes(reversed(expected)))
+            introcs.assert_equals(bytes(reversed(expected)),copy.getRegion(row,col,height,width))
+            copy.setRegion(row,col,height,width,expected)
+            introcs.assert_equals(data,copy.getBytes())
+
+        token = object()
+        introcs.assert_equals(None,image.getDirty(token))
+        image.markClean(token)
+        introcs.assert_equals([],image.getDirty(token))
+        introcs.assert_equals(None,image.getDirty(object()))
+
+        # Pixels in a row are merged, and copies keep the rectangles
+        image.setPixel(1,2,(0,0,0))
+        image.setPixel(1,3,(0,0,0))
+        image[11] = (0,0,0)
+        image.fillRect(3,0,2,7,(0,0,0))
+        image.drawVSpan(0,6,6,(0,0,0))
+        dirty = [(1,2,1,3),(3,0,2,7),(0,6,6,1)]
+        introcs.assert_equals(dirty,image.getDirty(token))
+        copy = image.copy()
+        introcs.assert_equals(dirty,copy.getDirty(token))
+        image.getData()
+        image.getView().release()
+        introcs.assert_equals(dirty,image.getDirty(token))
+
+        # Writes that can change anything mark the whole image
+        for change in [lambda image : image.setBytes(image.getBytes()),
+                       lambda image : image.reorient('reflectHori'),
+                       lambda image : image.setWidth(6)]:
+            copy = image.copy()
+            change(copy)
+            introcs.assert_equals(None,copy.getDirty(token))
+        if compact:
+            image.getBuffer()
+            introcs.assert_equals(None,image.getDirty(token))
+
+        # Too many rectangles are not worth tracking
+        image.markClean(token)
+        for pos in range(a6image.DIRTY_LIMIT):
+            image.fillRect(pos%6,0,1,1,(0,0,0))
+        introcs.assert_equals(a6image.DIRTY_LIMIT,len(image.getDirty(token)))
+        image.setPixel(5,5,(0,0,0))
+        introcs.assert_equals(None,image.getDirty(token))
+
+        # Each token gets the rectangles since its own mark
+        first = object()
+        image.markClean(first)
+        image.setPixel(1,2,(0,0,0))
+        second = object()
+        image.markClean(second)
+        image.setPixel(1,3,(0,0,0))
+        introcs.assert_equals([(1,2,1,1),(1,3,1,1)],image.getDirty(first))
+        introcs.assert_equals([(1,3,1,1)],image.getDirty(second))
+        image.markClean(token,first)
+        introcs.assert_equals(None,image.getDirty(first))
+        introcs.assert_equals([(1,3,1,1)],image.getDirty(second))
+        introcs.assert_equals([],image.getDirty(token))
+        tokens = [object() for pos in range(a6image.MARK_LIMIT)]
+        for mark in tokens:
+            image.markClean(mark)
+        introcs.assert_equals(None,image.getDirty(second))
+        introcs.assert_equals([],image.getDirty(tokens[0]))
+
+    # Test enforcement
+    introcs.assert_error(image.getRegion,0,1,1,7,message='getRegion does not enforce the precondition on width')
+    introcs.assert_error(image.setRegion,0,0,1,2,bytes(3),message='setRegion does not enforce the precondition on buffer')
+    introcs.assert_error(image.markClean,None,message='markClean does not enforce the precondition on token')
+
+
+def test_image_downscale():
+    """
+    Tests the method downscale in class Image
+    """
+    print('Testing method downscale')
+    pixels = [(pos,2*pos,pos//2) for pos in range(42)]
+    for compact in [False,True]:
+        image = a6image.Image(pixels[:],7)
+        if compact:
+            image = a6image.Image.fromBytes(image.getBytes(),7)
+        for factor in [1,2,3,7,10]:
+            small = image.downscale(factor)
+            introcs.assert_equals(compact,small.isCompact())
+            introcs.assert_equals(-(-7//factor),small.getWidth())
+            introcs.assert_equals(-(-6//factor),small.getHeight())
+            expected = [pixels[7*row+col] for row in range(0,6,factor) for col in range(0,7,factor)]
+            introcs.assert_equals(expected,small.getData())
+        introcs.assert_not_equals(id(image._data),id(image.downscale(1)._data))
+
+        # A pending orientation is put in place first
+        image.reorient('rotateRight')
+        introcs.assert_equals([pixels[35],pixels[21],pixels[7]],image.downscale(2).getData()[:3])
+
+    introcs.assert_error(image.downscale,0,message='downscale does not enforce the precondition on factor')
+
+
+def test_read_image():
+    """
+    Tests the image file reader in module a6file
+    """
+    import os.path
+    import a6file
+    from PIL import Image as CoreImage
+    print('Testing image file reader')
+
+    for file in ['blocks','home']:      # RGBA and RGB files
+        path = os.path.join(os.path.split(__file__)[0],'tests',file+'.png')
+        image = a6file.read_image(path)
+        core  = CoreImage.open(path).convert('RGB')
+        introcs.assert_true(image.isCompact())
+        introcs.assert_equals(core.size[0],image.getWidth())
+        introcs.assert_equals(core.size[1],image.getHeight())
+        introcs.assert_equals(list(core.getdata()),image.getData())
+
+    introcs.assert_error(a6file.read_image,os.path.join('tests','nonexistent.png'),
+                         error=FileNotFoundError,message='read_image does not fail on a missing file')
+
+def test_write_png():
+    """
+    Tests the PNG writers in module a6file
+    """
+    import os.path
+    import tempfile
+    import a6file
+    print('Testing PNG file writer')
+
+    image = load_image('home')
+    with tempfile.TemporaryDirectory() as folder:
+        for compact in [True,False]:
+            if not compact:
+                image = a6image.Image(image.getData(),image.getWidth())
+            for level in [0,9]:
+                path = os.path.join(folder,'home-'+str(level)+'.png')
+                a6file.write_png(image,path,level,level == 9)
+                introcs.assert_equals(image.getData(),a6file.read_image(path).getData())
+
+        results = []
+        path = os.path.join(folder,'home-async.png')
+        thread = a6file.write_png_async(image,path,callback=lambda *args: results.append(args))
+        image.setPixel(0,0,(1,2,3))     # Must not affect the file being saved
+        thread.join()
+        introcs.assert_equals([(path,None)],results)
+        introcs.assert_not_equals((1,2,3),a6file.read_image(path).getPixel(0,0))
+
+        results = []
+        path = os.path.join(folder,'nonexistent','home.png')
+        a6file.write_png_async(image,path,callback=lambda *args: results.append(args)).join()
+        introcs.assert_equals(1,len(results))
+        introcs.assert_true(isinstance(results[0][1],OSError))
+
+    # Test enforcement
+    introcs.assert_error(a6file.write_png,image,'home.png',10,   message='write_png does not enforce the precondition on compress_level')
+    introcs.assert_error(a6file.write_png,image,'home.png',6,1,  message='write_png does not enforce the precondition on optimize')
+
 ## All of these tests hava a familiar form
 
+def test_editor():
+    """
+    Tests the edit history of class Editor
+    """
+    import a6editor
+    import a6history
+    print('Testing edit history')
+    image = load_image('home')
+    original = image.getBytes()
+
+    editor = a6filter.Filter(image)
+    introcs.assert_false(editor.undo())
+    editor.increment()
+    editor.jail()
+    jailed = editor.getCurrent().getBytes()
+    editor.increment()
+    editor.invert()
+    introcs.assert_true(editor.undo())
+    introcs.assert_equals(jailed,editor.getCurrent().getBytes())
+    introcs.assert_true(editor.undo())
+    introcs.assert_equals(original,editor.getCurrent().getBytes())
+    introcs.assert_true(editor.getCurrent().isCompact())
+    introcs.assert_false(editor.undo())
+    introcs.assert_equals(original,image.getBytes())
+
+    editor.increment()
+    editor.invert()
+    editor.clear()
+    introcs.assert_equals(original,editor.getCurrent().getBytes())
+    introcs.assert_false(editor.undo())
+
+    # The history never holds more than MAX_HISTORY-1 undos
+    editor.MAX_HISTORY = 3
+    for step in range(5):
+        editor.increment()
+        editor.invert()
+    introcs.assert_true(editor.undo())
+    introcs.assert_true(editor.undo())
+    introcs.assert_false(editor.undo())
+
+    # Snapshots only copy the chunks that changed
+    old = a6history.Snapshot.CHUNK_SIZE
+    try:
+        a6history.Snapshot.CHUNK_SIZE = 3*image.getWidth()
+        snap1 = a6history.Snapshot(image)
+        copy = image.copy()
+        copy.setPixel(5,5,(0,0,0))
+        snap2 = a6history.Snapshot(copy,snap1)
+        introcs.assert_equals(len(original)-3*image.getWidth(),snap1.shares(snap2))
+        introcs.assert_equals(original,snap1.restore().getBytes())
+        introcs.assert_equals(copy.getBytes(),snap2.restore().getBytes())
+
+        # Given the written rectangles, only the chunks they touch are read
+        for compact in [True,False]:
+            copy = image.copy() if compact else a6image.Image.fromTrusted(image.getData(),image.getWidth())
+            copy.fillRect(3,4,2,5,(0,0,0))
+            copy.setPixel(0,0,(1,2,3))
+            snap3 = a6history.Snapshot(copy,snap1,[(3,4,2,5)])
+            introcs.assert_equals(len(original)-6*image.getWidth(),snap1.shares(snap3))
+            expected = copy.copy()
+            expected.setPixel(0,0,image.getPixel(0,0))
+            introcs.assert_equals(expected.getBytes(),snap3.restore().getBytes())
+    finally:
+        a6history.Snapshot.CHUNK_SIZE = old
+
+    # The editor gives each snapshot the rectangles written since the last one
+    editor = a6filter.Filter(image)
+    token = object()
+    editor.getCurrent().markClean(token)
+    editor.increment()
+    editor.getCurrent().setPixel(5,5,(0,0,0))
+    editor.increment()
+    editor.getCurrent().setPixel(7,5,(0,0,0))
+    history = editor._getSnapshots()
+    introcs.assert_equals([(7,5,1,1)],editor.getCurrent().getDirty(history[-1].getToken()))
+    introcs.assert_equals(None,editor.getCurrent().getDirty(history[0].getToken()))
+    introcs.assert_equals([(5,5,1,1),(7,5,1,1)],editor.getCurrent().getDirty(token))
+    introcs.assert_equals(original,history[0].restore().getBytes())
+    introcs.assert_true(editor.undo())
+    introcs.assert_equals(image.getPixel(7,5),editor.getCurrent().getPixel(7,5))
+    introcs.assert_equals((0,0,0),editor.getCurrent().getPixel(5,5))
+
+    # Older snapshots are spilled to disk past the memory budget
+    image = load_image('home')
+    editor = a6filter.Filter(image)
+    editor.MEMORY_BUDGET = 2*len(original)
+    states = [original]
+    for action in [('invert',),('jail',),('monochromify',True),('reflectHori',)]:
+        editor.increment()
+        getattr(editor,action[0])(*action[1:])
+        states.append(editor.getCurrent().getBytes())
+    stats = editor.getStats()
+    introcs.assert_equals(4,stats['edits'])
+    introcs.assert_equals(4*len(original),stats['size'])
+    introcs.assert_true(stats['memory'] <= editor.MEMORY_BUDGET)
+    introcs.assert_true(stats['spilled'] > 0)
+    introcs.assert_true(stats['disk'] > 0)
+    for pos in range(4):
+        states.pop()
+        introcs.assert_true(editor.undo())
+        introcs.assert_equals(states[-1],editor.getCurrent().getBytes())
+    introcs.assert_equals(0,editor.getStats()['disk'])
+
+    # Spilled snapshots are deleted past the disk budget
+    editor.DISK_BUDGET = 0
+    for pos in range(4):
+        editor.increment()
+        editor.invert()
+    stats = editor.getStats()
+    introcs.assert_equals(0,stats['spilled'])
+    introcs.assert_true(stats['edits'] < 4)
+
+    # Operations are replayed from the nearest keyframe
+    actions = [('invert',),('jail',),('monochromify',True),('reflectHori',),
+               ('pixellate',10),('vignette',),('rotateLeft',)]
+    for limit in [0,0.0001,1000]:
+        editor = a6filter.Filter(image)
+        editor.REPLAY = True
+        editor.REPLAY_LIMIT = limit
+        states = [original]
+        for action in actions:
+            editor.perform(*action)
+            states.append(editor.getCurrent().getBytes())
+        stats = editor.getStats()
+        introcs.assert_equals(len(actions),stats['edits'])
+        if limit == 0:
+            # The first edit is always a keyframe
+            kept = [action for action in actions[1:] if action[0] not in editor.INVERSES]
+            kept.append(actions[0])
+            introcs.assert_equals(len(kept),stats['keyframes'])
+        elif limit == 1000:
+            introcs.assert_equals(1,stats['keyframes'])
+        for action in actions:
+            states.pop()
+            introcs.assert_true(editor.undo())
+            introcs.assert_equals(states[-1],editor.getCurrent().getBytes())
+        introcs.assert_false(editor.undo())
+
+    # Dropping the oldest edit keeps the rest replayable
+    editor = a6filter.Filter(image)
+    editor.REPLAY = True
+    editor.REPLAY_LIMIT = 1000
+    editor.MAX_HISTORY = 4
+    states = [original]
+    for action in actions:
+        editor.perform(*action)
+        states.append(editor.getCurrent().getBytes())
+    introcs.assert_equals(3,editor.getStats()['edits'])
+    for pos in range(3):
+        states.pop()
+        introcs.assert_true(editor.undo())
+        introcs.assert_equals(states[-1],editor.getCurrent().getBytes())
+    introcs.assert_false(editor.undo())
+
+    # Invertible operations are undone without a snapshot
+    actions = [('rotateLeft',),('invert',),('jail',),('transpose',),('reflectVert',),
+               ('rotateRight',),('reflectHori',)]
+    for replay in [False,True]:
+        editor = a6filter.Filter(image)
+        editor.REPLAY = replay
+        states = [original]
+        for action in actions:
+            editor.perform(*action)
+            states.append(editor.getCurrent().getBytes())
+        stats = editor.getStats()
+        introcs.assert_equals(len(actions),stats['edits'])
+        introcs.assert_equals(1,stats['keyframes'])
+        for action in actions:
+            states.pop()
+            introcs.assert_true(editor.undo())
+            introcs.assert_equals(states[-1],editor.getCurrent().getBytes())
+        introcs.assert_false(editor.undo())
+
+    # List-backed images are restored as lists
+    image = a6image.Image(image.getData(),image.getWidth())
+    editor = a6editor.Editor(image)
+    editor.increment()
+    editor.getCurrent()[0] = (1,2,3)
+    introcs.assert_true(editor.undo())
+    introcs.assert_false(editor.getCurrent().isCompact())
+    introcs.assert_equals(image.getData(),editor.getCurrent().getData())
+
+
 def compare_images(image1,image2,file1,file2):
     """
     Compares image1 and image2 via assert functions.
@@ -427,6 +1034,16 @@ def test_jail():
     editor.jail()
     compare_images(editor.getCurrent(),image2,file1,file2)
 
+    # The bars must fit, even though jail does not check each pixel
+    for image in [a6image.Image.fromBytes(bytearray(54),9),a6image.Image([(0,0,0)]*18,9),
+                  a6image.Image([(0,0,0)]*21,7)]:
+        editor = a6filter.Filter(image)
+        introcs.assert_error(editor.jail,message='jail does not enforce the size of the image')
+        introcs.assert_equals(image.getBytes(),editor.getCurrent().getBytes())
+    editor = a6filter.Filter(a6image.Image([(0,0,0)]*24,8))
+    editor.jail()
+    introcs.assert_equals([(255,0,0)]*24,editor.getCurrent().getData())
+
 
 def test_vignette():
     """
@@ -510,6 +1127,633 @@ def test_pixellate():
     compare_images(editor.getCurrent(),image2,file1,file2)
 
 
+def test_vectorized():
+    """
+    Tests that the vectorized engine matches the pure-Python Filter methods
+    """
+    import a6vector
+    if not a6vector.AVAILABLE:
+        print('Skipping vectorized engine (NumPy is not installed)')
+        return
+
+    print('Testing vectorized engine')
+    actions = [('invert',),('transpose',),('reflectHori',),('reflectVert',),
+               ('rotateLeft',),('rotateRight',),('monochromify',False),
+               ('monochromify',True),('jail',),('vignette',),
+               ('pixellate',10),('pixellate',20),('pixellate',50),
+               ('pixellate',1),('pixellate',7),('pixellate',200)]
+
+    for file in ['blocks','home']:
+        image = load_image(file)
+        if file == 'home':
+            image.setWidth(208)     # Make it not square
+        for compact in [False,True]:
+            if compact:
+                image = a6image.Image.fromBytes(image.getBytes(),image.getWidth())
+            else:
+                image = a6image.Image(image.getData(),image.getWidth())
+            for action in actions:
+                name = file+' '+' '.join(map(str,action))
+                editor1 = a6filter.Filter(image)
+                editor1.VECTORIZE = False
+                editor1.SYMBOLIC = False
+                editor1.LOOKUP = False
+                getattr(editor1,action[0])(*action[1:])
+                editor2 = a6filter.Filter(image)
+                editor2.SYMBOLIC = False
+                getattr(editor2,action[0])(*action[1:])
+                introcs.assert_equals(compact,editor2.getCurrent().isCompact())
+                compare_images(editor2.getCurrent(),editor1.getCurrent(),
+                               name+' (vectorized)',name)
+
+    # A summed-area table can be shared by every step it divides
+    image = load_image('home')
+    image.setWidth(208)
+    for grid in [1,5,10]:
+        table = a6vector.integral(image,grid)
+        introcs.assert_equals((-(-52//grid)+1,-(-208//grid)+1,3),table.shape)
+        for step in [10,20,50,100]:
+            name = 'home pixellate '+str(step)
+            result = image.copy()
+            a6vector.pixellate(result,step,table,grid)
+            editor = a6filter.Filter(image)
+            editor.pixellate(step)
+            compare_images(result,editor.getCurrent(),name+' (grid '+str(grid)+')',name)
+
+    # Several steps at once, with or without a shared table
+    for vectorize in [True,False]:
+        for steps in [[10,20,50,100,200],[20,7,1]]:
+            editor = a6filter.Filter(image)
+            editor.VECTORIZE = vectorize
+            results = editor.pixellations(steps)
+            introcs.assert_equals(image.getBytes(),editor.getCurrent().getBytes())
+            introcs.assert_equals(steps,[step for (step,result) in results])
+            for (step,result) in editor.pixellations(steps):
+                name = 'home pixellate '+str(step)
+                other = a6filter.Filter(image)
+                other.pixellate(step)
+                compare_images(result,other.getCurrent(),name+' (shared)',name)
+    introcs.assert_error(editor.pixellations,[],     message='pixellations does not enforce the precondition on steps')
+    introcs.assert_error(editor.pixellations,[10,0], message='pixellations does not enforce the precondition on steps')
+
+    # Vignette masks are cached by size, within a memory budget
+    introcs.assert_true(a6vector.mask(208,52) is a6vector.mask(208,52))
+    introcs.assert_equals((27,105),a6vector.mask(208,52).shape)
+    introcs.assert_equals((27,105),a6vector.mask(209,53).shape)
+    limit = a6vector.MASK_MEMORY
+    a6vector.MASK_MEMORY = 3*a6vector.mask(208,52).nbytes
+    try:
+        first = a6vector.mask(208,52)
+        a6vector.mask(209,53)
+        a6vector.mask(208,52)               # Now the most recently used
+        a6vector.mask(210,54)
+        introcs.assert_true(first is a6vector.mask(208,52))
+        introcs.assert_false((209,53) in a6vector._masks)
+    finally:
+        a6vector.MASK_MEMORY = limit
+    for size in [(208,52),(209,53),(7,1),(1,8)]:
+        data = bytearray(pos*7%256 for pos in range(3*size[0]*size[1]))
+        image = a6image.Image.fromBytes(data,size[0])
+        name = 'vignette '+str(size)
+        editor1 = a6filter.Filter(image)
+        editor1.VECTORIZE = False
+        editor1.vignette()
+        editor2 = a6filter.Filter(image)
+        editor2.vignette()
+        compare_images(editor2.getCurrent(),editor1.getCurrent(),name+' (mask)',name)
+
+
+class FlagFilter(a6filter.Filter):
+    """
+    A Filter whose vignette paints its flags over the image
+
+    This shows which class and flags process each band in test_parallel. It
+    is at the top level so that it can be sent to a worker process.
+    """
+
+    def _vignette(self, top, height):
+        """
+        Fills the current image with the pixel (VECTORIZE, LOOKUP, SYMBOLIC).
+        """
+        current = self.getCurrent()
+        pixel = (int(self.VECTORIZE),int(self.LOOKUP),int(self.SYMBOLIC))
+        current.fillRect(0,0,current.getHeight(),current.getWidth(),pixel)
+
+
+def test_parallel():
+    """
+    Tests that splitting an image into bands matches the serial Filter methods
+    """
+    import a6parallel
+    print('Testing parallel bands')
+    introcs.assert_equals([(0,10)],a6parallel.bands(10,1))
+    introcs.assert_equals([(0,4),(4,8),(8,10)],a6parallel.bands(10,3))
+    introcs.assert_equals([(0,6),(6,10)],a6parallel.bands(10,3,3))
+    introcs.assert_equals([(0,20),(20,23)],a6parallel.bands(23,4,20))
+
+    actions = [('invert',),('monochromify',False),('monochromify',True),
+               ('vignette',),('pixellate',10),('pixellate',7)]
+    image = load_image('home')
+    image.setWidth(208)
+    for vectorize in [False,True]:
+        for action in actions:
+            name = 'home '+' '.join(map(str,action))
+            editor1 = a6filter.Filter(image)
+            editor1.VECTORIZE = vectorize
+            getattr(editor1,action[0])(*action[1:])
+            editor2 = a6filter.Filter(image)
+            editor2.VECTORIZE = vectorize
+            editor2.WORKERS = 3
+            editor2.PARALLEL_MINIMUM = 0
+            getattr(editor2,action[0])(*action[1:])
+            compare_images(editor2.getCurrent(),editor1.getCurrent(),
+                           name+' (parallel)',name)
+
+    # The bands are processed with the class and flags of the caller
+    for flags in [(False,True,False),(True,False,True)]:
+        editor = FlagFilter(image)
+        (editor.VECTORIZE, editor.LOOKUP, editor.SYMBOLIC) = flags
+        editor.WORKERS = 3
+        editor.PARALLEL_MINIMUM = 0
+        editor.vignette()
+        introcs.assert_equals(bytearray(flags)*len(image),editor.getCurrent().getBytes())
+
+    # A worker edits its band in the shared memory itself
+    data = bytearray(image.getBytes())
+    view = memoryview(data)[3*208*10:3*208*20]
+    band = a6image.Image.fromView(view,208)
+    editor = a6parallel.make_editor(band,a6parallel.settings(a6filter.Filter(image)))
+    introcs.assert_true(editor.getCurrent() is band)
+    a6parallel.apply_band(editor,'invert',(),10,image.getHeight())
+    expected = image.getBytes()
+    expected[3*208*10:3*208*20] = bytes(255-value for value in expected[3*208*10:3*208*20])
+    introcs.assert_equals(expected,data)
+    introcs.assert_equals(bytes(view),band.copy().getBytes())
+    introcs.assert_true(band.copy().getBuffer().obj is not data)
+
+
+def test_pipeline():
+    """
+    Tests that fused pipelines match calling the Filter methods in order
+    """
+    import a6vector
+    print('Testing fused pipelines')
+    chains = [[('monochromify',True),('vignette',),('invert',)],
+              [('invert',),('invert',)],
+              [('vignette',),('rotateLeft',),('vignette',),('monochromify',False)],
+              [('jail',),('invert',),('vignette',),('pixellate',10),('vignette',)]]
+
+    source = load_image('home')
+    source.setWidth(208)
+    old = a6vector.BAND_SIZE
+    try:
+        a6vector.BAND_SIZE = 3*208*7     # Bands that do not divide the height
+        for vectorize in [False,True]:
+            for compact in [False,True]:
+                image = source
+                if not compact:
+                    image = a6image.Image(source.getData(),source.getWidth())
+                for chain in chains:
+                    name = 'home '+' '.join(action[0] for action in chain)
+                    editor1 = a6filter.Filter(image)
+                    editor1.VECTORIZE = vectorize
+                    for action in chain:
+                        getattr(editor1,action[0])(*action[1:])
+                    editor2 = a6filter.Filter(image)
+                    editor2.VECTORIZE = vectorize
+                    editor2.pipeline(chain)
+                    compare_images(editor2.getCurrent(),editor1.getCurrent(),
+                                   name+' (fused)',name)
+                    editor2 = a6filter.Filter(image)
+                    editor2.VECTORIZE = vectorize
+                    editor2.WORKERS = 2
+                    editor2.PARALLEL_MINIMUM = 0
+                    editor2.pipeline(chain)
+                    compare_images(editor2.getCurrent(),editor1.getCurrent(),
+                                   name+' (fused, parallel)',name)
+    finally:
+        a6vector.BAND_SIZE = old
+
+    # Steps that are not pointwise leave nothing to fuse
+    import a6parallel
+    apply = a6parallel.apply
+    calls = []
+    a6parallel.apply = lambda *args : calls.append(args)
+    try:
+        editor = a6filter.Filter(image)
+        editor.WORKERS = 2
+        editor.PARALLEL_MINIMUM = 0
+        editor.pipeline([('jail',),('rotateLeft',),('reflectVert',)])
+        introcs.assert_equals([],calls)
+    finally:
+        a6parallel.apply = apply
+
+    editor = a6filter.Filter(image)
+    introcs.assert_error(editor.pipeline,[('monochromify',)])
+    introcs.assert_error(editor.pipeline,[('invert',1),('vignette',)])
+    introcs.assert_error(editor.pipeline,('invert',))
+
+
+def test_lazy():
+    """
+    Tests that lazy mode gives the same images as applying the operations
+    """
+    print('Testing lazy mode')
+    image = load_image('home')
+    original = image.getBytes()
+    actions = [('rotateLeft',),('monochromify',True),('invert',),('vignette',),
+               ('invert',),('rotateRight',),('jail',),('pixellate',10),
+               ('transpose',),('transpose',)]
+
+    editor1 = a6filter.Filter(image)
+    editor2 = a6filter.Filter(image)
+    editor2.LAZY = True
+    states = [original]
+    for action in actions:
+        editor1.perform(*action)
+        editor2.perform(*action)
+        states.append(editor1.getCurrent().getBytes())
+    introcs.assert_equals(original,editor2._current.getBytes())    # Nothing computed yet
+    introcs.assert_equals(states[-1],editor2.getCurrent().getBytes())
+    introcs.assert_equals([],editor2._pending)
+
+    # Undo works on both pending and applied edits
+    for pos in range(4):
+        editor2.perform('invert')
+        editor2.perform('reflectVert')
+        introcs.assert_true(editor2.undo())
+        introcs.assert_true(editor2.undo())
+    introcs.assert_equals([],editor2._pending)
+    for action in actions:
+        states.pop()
+        introcs.assert_true(editor2.undo())
+        introcs.assert_equals(states[-1],editor2.getCurrent().getBytes())
+    introcs.assert_false(editor2.undo())
+
+    # Operations are optimized as a whole
+    editor = a6filter.Filter(image)
+    introcs.assert_equals([],editor._optimize(actions[:1]+actions[2:3]+actions[4:6]))
+    introcs.assert_equals([('jail',)],
+        editor._optimize([('invert',),('pipeline',[('invert',),('jail',)])]))
+    introcs.assert_equals([('pixellate',10)],
+        editor._optimize([('pixellate',10),('rotateRight',),('rotateLeft',)]))
+
+    # Direct calls are deferred too
+    editor.LAZY = True
+    editor.pipeline([('vignette',),('invert',)])
+    editor.invert()
+    introcs.assert_equals(1,len(editor._pending[0][1]))
+    editor1 = a6filter.Filter(image)
+    editor1.vignette()
+    compare_images(editor.getCurrent(),editor1.getCurrent(),'home vignette (lazy)','home vignette')
+
+    # More pending edits than the history can hold
+    for undo in [True,False]:
+        editor1 = a6filter.Filter(image)
+        editor1.MAX_HISTORY = 4
+        editor2 = a6filter.Filter(image)
+        editor2.MAX_HISTORY = 4
+        editor2.LAZY = True
+        for action in actions*2:
+            editor1.perform(*action)
+            editor2.perform(*action)
+        introcs.assert_equals(3,len(editor2._log))
+        introcs.assert_equals(3,len([edit for edit in editor2._pending if edit[2]]))
+        if not undo:
+            introcs.assert_equals(editor1.getCurrent().getBytes(),editor2.getCurrent().getBytes())
+        while editor1.undo():
+            introcs.assert_true(editor2.undo())
+        introcs.assert_false(editor2.undo())
+        introcs.assert_equals(editor1.getCurrent().getBytes(),editor2.getCurrent().getBytes())
+
+
+def test_symbolic():
+    """
+    Tests that symbolic orientation gives the same images as moving the pixels
+    """
+    print('Testing symbolic transposes and rotations')
+    chains = [['rotateLeft','rotateLeft','reflectHori'],['transpose','rotateRight'],
+              ['reflectVert','rotateLeft','transpose','reflectHori','rotateRight'],
+              ['rotateRight','rotateLeft']]
+
+    # Square images are transposed in place, the others in bands of columns
+    tile = a6image.TILE_SIZE
+    a6image.TILE_SIZE = 1000    # Several bands for a test image
+    try:
+        for width in [104,208]:
+            image = load_image('home')
+            image.setWidth(width)
+            for compact in [False,True]:
+                if compact:
+                    image = a6image.Image.fromBytes(image.getBytes(),image.getWidth())
+                for chain in chains:
+                    name = 'home '+str(width)+' '+' '.join(chain)
+                    editor1 = a6filter.Filter(image)
+                    editor1.SYMBOLIC = False
+                    editor2 = a6filter.Filter(image)
+                    data = editor2.getCurrent()._data
+                    for operation in chain:
+                        editor1.perform(operation)
+                        editor2.perform(operation)
+                    # Nothing has been moved yet (and nothing will be for the last chain)
+                    introcs.assert_equals(chain is chains[-1],editor2.getCurrent().getOrientation() is None)
+                    compare_images(editor2.getCurrent(),editor1.getCurrent(),name+' (symbolic)',name)
+                    introcs.assert_equals(id(data),id(editor2.getCurrent()._data))
+
+                    # Undo uses the inverse operations, which are symbolic as well
+                    for operation in chain:
+                        introcs.assert_true(editor2.undo())
+                    introcs.assert_equals(image.getBytes(),editor2.getCurrent().getBytes())
+    finally:
+        a6image.TILE_SIZE = tile
+
+
+def test_lookup():
+    """
+    Tests that the lookup tables in module a6lut match the Filter methods
+    """
+    import a6lut
+    print('Testing lookup tables')
+    introcs.assert_equals(bytes([0,0,0,51,102,153,204,255,255,255]),a6lut.levels(2,7)[:10])
+    introcs.assert_equals(255,a6lut.levels(2,7)[255])
+    introcs.assert_equals(bytes(range(256)),a6lut.gamma(1))
+    introcs.assert_equals(bytes([0,16,23,28]),a6lut.gamma(2)[:4])
+    introcs.assert_equals(bytes(range(256)),a6lut.curve([(0,0),(255,255)]))
+    table = a6lut.curve([(0,255),(100,55),(255,0)])
+    introcs.assert_equals([255,253,55,54,0],[table[0],table[1],table[100],table[101],table[255]])
+    introcs.assert_error(a6lut.levels,5,5,message='levels does not enforce the precondition on high')
+    introcs.assert_error(a6lut.gamma,0,message='gamma does not enforce the precondition on value')
+    introcs.assert_error(a6lut.curve,[(0,0),(100,0),(50,0),(255,0)],
+                         message='curve does not enforce the precondition on points')
+    introcs.assert_error(a6lut.Look,message='Look does not enforce the precondition on red')
+    introcs.assert_error(a6lut.Look,bytes(255),message='Look does not enforce the precondition on red')
+    introcs.assert_error(a6lut.Look,bytes(256),None,None,len,
+                         message='Look does not enforce the precondition on function')
+    introcs.assert_error(a6lut.Look,None,None,None,None,(0.5,0.5,0.5),
+                         message='Look does not enforce the precondition on weights')
+
+    image = load_image('home')
+    image.setWidth(208)     # Make it not square
+    image = a6image.Image.fromBytes(image.getBytes(),image.getWidth())
+    for sepia in [False,True]:
+        name = 'home '+('sepia' if sepia else 'grey')
+        editor1 = a6filter.Filter(image)
+        editor1.VECTORIZE = False
+        editor1.LOOKUP = False
+        editor1.monochromify(sepia)
+
+        # The same transform as weights and as a function
+        tint = (1,0.6,0.4) if sepia else (1,1,1)
+        def mix(red, green, blue):
+            brightness=0.3*red+0.6*green+0.1*blue
+            return (tint[0]*brightness,tint[1]*brightness,tint[2]*brightness)
+        look = a6lut.SEPIA if sepia else a6lut.GREYSCALE
+        introcs.assert_equals(tint,look.getTint())
+        introcs.assert_equals((0.3,0.6,0.1),look.getWeights())
+        for look in [look,a6lut.Look(function=mix)]:
+            # With and without NumPy, forgetting colors, and from the table of every color
+            old = (a6lut.MEMO_SIZE,a6lut.COLORS)
+            for (vectorize, memo, colors) in [(False,old[0],old[1]),(False,100,old[1]),
+                                              (True,old[0],old[1]),(True,old[0],0)]:
+                a6lut.MEMO_SIZE = memo
+                a6lut.COLORS = colors
+                try:
+                    copy = image.copy()
+                    look.apply(copy,vectorize)
+                finally:
+                    (a6lut.MEMO_SIZE,a6lut.COLORS) = old
+                compare_images(copy,editor1.getCurrent(),name+' (lookup)',name)
+
+    # Tables for each channel, in both image modes
+    look = a6lut.Look(a6lut.levels(50,200),None,a6lut.gamma(2))
+    tables = look.getTables()
+    introcs.assert_equals(tables[0],tables[1])
+    for compact in [False,True]:
+        copy = a6image.Image(image.getData(),image.getWidth())
+        if compact:
+            copy = image.copy()
+        look.apply(copy)
+        for pos in range(0,len(image),97):
+            expect = tuple(tables[k][image[pos][k]] for k in range(3))
+            introcs.assert_equals(expect,copy[pos])
+
+    # Filter.invert and Filter.look use the registered looks
+    editor1 = a6filter.Filter(image)
+    editor1.VECTORIZE = False
+    editor1.invert()
+    editor2 = a6filter.Filter(image)
+    editor2.VECTORIZE = False
+    editor2.LOOKUP = False
+    editor2.invert()
+    compare_images(editor1.getCurrent(),editor2.getCurrent(),'home invert (lookup)','home invert')
+    a6lut.register('test',look)
+    try:
+        editor = a6filter.Filter(image)
+        editor.perform('look','test')
+        compare_images(editor.getCurrent(),copy,'home test look','home test look')
+        introcs.assert_true(editor.undo())
+        introcs.assert_equals(image.getBytes(),editor.getCurrent().getBytes())
+    finally:
+        del a6lut.LOOKS['test']
+    introcs.assert_error(editor.look,'test',message='look does not enforce the precondition on name')
+
+
+def test_preview():
+    """
+    Tests the method preview in class Filter
+    """
+    print('Testing method preview')
+    image = load_image('home')
+    image.setWidth(208)     # Make it not square
+    editor = a6filter.Filter(image)
+    introcs.assert_equals(None,editor.preview(208,52,'invert'))
+    introcs.assert_equals(None,editor.preview(300,100,'invert'))
+    introcs.assert_equals(None,editor.preview(100,40,'jail'))    # Bars depend on the width
+
+    for (action, args) in [('invert',()),('monochromify',(True,)),('rotateLeft',()),('pixellate',(20,))]:
+        preview = editor.preview(100,40,action,*args)
+        small = a6filter.Filter(image.downscale(3))
+        getattr(small,action)(*(args if action != 'pixellate' else (6,)))
+        compare_images(preview,small.getCurrent(),'home '+action+' (preview)','home '+action)
+
+    # The preview is made from the shrunk image
+    (small, factor) = editor.shrink(100,40)
+    introcs.assert_equals(3,factor)
+    introcs.assert_equals(image.downscale(3).getBytes(),small.getBytes())
+    (small, factor) = editor.shrink(208,52)
+    introcs.assert_equals(1,factor)
+    introcs.assert_equals(image.getBytes(),small.getBytes())
+    introcs.assert_false(small is editor.getCurrent())
+
+    # The current image and the history are not changed
+    introcs.assert_equals(image.getBytes(),editor.getCurrent().getBytes())
+    introcs.assert_false(editor.undo())
+    introcs.assert_error(editor.preview,0,10,'invert',message='preview does not enforce the precondition on width')
+    introcs.assert_error(editor.shrink,10,0,message='shrink does not enforce the precondition on height')
+
+
+def test_monitor():
+    """
+    Tests processing the operations in bands for a monitor in class Filter
+    """
+    print('Testing monitored bands')
+    image = load_image('home')
+    image.setWidth(208)     # Make it not square
+    image = a6image.Image.fromBytes(image.getBytes(),208)
+    actions = [('invert',),('monochromify',True),('vignette',),('pixellate',20),('jail',)]
+
+    for action in actions:
+        name = 'home '+' '.join(map(str,action))
+        editor1 = a6filter.Filter(image)
+        editor1.perform(*action)
+
+        bands = []
+        def monitor(current, top, bottom):
+            bands.append((top,bottom))
+            introcs.assert_equals([(top,0,bottom-top,208)],current.getDirty(token)[-1:])
+        editor2 = a6filter.Filter(image)
+        editor2.PROGRESS_SIZE = 208*3*8     # Eight rows at a time
+        editor2.setMonitor(monitor)
+        token = object()
+        editor2.getCurrent().markClean(token)
+        introcs.assert_true(editor2.perform(*action))
+        compare_images(editor2.getCurrent(),editor1.getCurrent(),name+' (monitored)',name)
+        if action[0] == 'jail':
+            introcs.assert_equals([],bands)
+        else:
+            # Pixellate bands do not split a block
+            size = 20 if action[0] == 'pixellate' else 8
+            introcs.assert_equals([(top,min(top+size,52)) for top in range(0,52,size)],bands)
+
+        # Stopping after the second band undoes the edit
+        def monitor(current, top, bottom):
+            bands.append((top,bottom))
+            return len(bands) < 2
+        bands = []
+        editor2.setMonitor(monitor)
+        introcs.assert_equals(action[0] == 'jail',editor2.perform(*action))
+        if action[0] != 'jail':
+            introcs.assert_equals(2,len(bands))
+            compare_images(editor2.getCurrent(),editor1.getCurrent(),name+' (stopped)',name)
+            introcs.assert_true(editor2.undo())
+            introcs.assert_equals(image.getBytes(),editor2.getCurrent().getBytes())
+            introcs.assert_false(editor2.undo())
+
+    # In parallel, each band is twice as large and split between the workers
+    for action in actions[:4]:
+        name = 'home '+' '.join(map(str,action))
+        editor1 = a6filter.Filter(image)
+        editor1.perform(*action)
+        bands = []
+        editor2 = a6filter.Filter(image)
+        editor2.PROGRESS_SIZE = 208*3*8
+        editor2.WORKERS = 2
+        editor2.PARALLEL_MINIMUM = 0
+        editor2.setMonitor(lambda current, top, bottom : bands.append((top,bottom)))
+        introcs.assert_true(editor2.perform(*action))
+        compare_images(editor2.getCurrent(),editor1.getCurrent(),name+' (monitored in parallel)',name)
+        if action[0] == 'pixellate':
+            introcs.assert_equals([(0,20),(20,40),(40,52)],bands)
+        else:
+            introcs.assert_equals([(0,13),(13,26),(26,39),(39,52)],bands)
+
+    # The monitor is not used in lazy mode
+    editor = a6filter.Filter(image)
+    editor.LAZY = True
+    editor.setMonitor(lambda current, top, bottom : introcs.assert_true(False))
+    editor.perform('invert')
+    editor.getCurrent()
+    introcs.assert_equals(None,a6filter.Filter(image).getMonitor())
+    introcs.assert_error(editor.setMonitor,1,message='setMonitor does not enforce the precondition on monitor')
+
+
+def test_batch():
+    """
+    Tests the batch processing functions in module a6batch
+    """
+    import io
+    import os.path
+    import tempfile
+    import contextlib
+    import a6batch
+    import a6file
+    print('Testing filter chains and batch runs')
+
+    chain = a6batch.Chain('monochromify:sepia, vignette,pixellate:020')
+    introcs.assert_equals([('monochromify',True),('vignette',),('pixellate',20)],chain.getActions())
+    introcs.assert_equals('sepia-vignette-pixellate-20',chain.getLabel())
+    introcs.assert_equals('reflect-vertical',a6batch.Chain('reflectVert').getLabel())
+    introcs.assert_equals([('look','sepia')],a6batch.Chain('look:sepia').getActions())
+    introcs.assert_equals('look-contrast',a6batch.Chain('look:contrast').getLabel())
+    introcs.assert_error(a6batch.Chain,'blur',           error=ValueError,message='Chain does not reject an unknown filter')
+    introcs.assert_error(a6batch.Chain,'pixellate:0',    error=ValueError,message='Chain does not reject an invalid step')
+    introcs.assert_error(a6batch.Chain,'monochromify',   error=ValueError,message='Chain does not reject a missing argument')
+    introcs.assert_error(a6batch.Chain,'invert:1',       error=ValueError,message='Chain does not reject an extra argument')
+    introcs.assert_error(a6batch.Chain,'look:blur',      error=ValueError,message='Chain does not reject an unknown look')
+
+    # The tests folder has the same layout as the output folder
+    specs  = ['monochromify:grey','monochromify:sepia','jail','vignette',
+              'pixellate:10','pixellate:50','reflectVert']
+    chains = [a6batch.Chain(spec) for spec in specs]
+    folder = os.path.join(os.path.split(__file__)[0],'tests')
+    with tempfile.TemporaryDirectory() as output:
+        inputs = [os.path.join(folder,'blocks.png'),os.path.join(folder,'home.p[n]g')]
+        introcs.assert_equals(0,a6batch.run(inputs,chains,output,quiet=True))
+        for file in ['blocks','home']:
+            for chain in chains:
+                name = file+'-'+chain.getLabel()
+                path = os.path.join(output,file,name+'.png')
+                compare_images(a6file.read_image(path),load_image(name),path,name)
+
+        inputs = [os.path.join(folder,'nonexistent.png'),os.path.join(folder,'blocks.png')]
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            introcs.assert_equals(1,a6batch.run(inputs,chains[:1],output,quiet=True))
+        introcs.assert_true('nonexistent.png' in errors.getvalue())
+
+        # Worker processes, in order and out of order
+        inputs = [os.path.join(folder,'blocks.png'),os.path.join(folder,'nonexistent.png'),
+                  os.path.join(folder,'home.png')]
+        results = list(a6batch.execute(inputs,chains[:2],output,workers=2,chunksize=2,retries=1))
+        introcs.assert_equals(inputs,[result[0] for result in results])
+        introcs.assert_equals([841,0,10816],[result[2] for result in results])
+        introcs.assert_equals(2,len(results[2][1]))
+        introcs.assert_true(results[1][3] is not None)
+        results = list(a6batch.execute(inputs,chains[:2],output,workers=2,ordered=False))
+        introcs.assert_equals(sorted(inputs),sorted([result[0] for result in results]))
+
+        # Inputs with the same name would write the same outputs
+        inputs = [os.path.join(folder,'home.png'),os.path.join(folder,'home.p[n]g')]
+        for workers in [1,2]:
+            results = list(a6batch.execute(inputs,chains[:1],output,workers=workers))
+            introcs.assert_equals(2,len(results))
+            results.sort(key=lambda result : result[3] is not None)
+            introcs.assert_equals(None,results[0][3])
+            introcs.assert_equals([],results[1][1])
+            introcs.assert_true(inputs[0] in results[1][3])
+        rejected = []
+        introcs.assert_equals(['a/x.png','y.png'],list(a6batch.screen(['a/x.png','b/x.png','y.png','x.jpg'],rejected)))
+        introcs.assert_equals(['b/x.png','x.jpg'],[result[0] for result in rejected])
+
+    # Chains that only differ in a final pixellate are applied together
+    chains = [a6batch.Chain(spec) for spec in ['invert,pixellate:10','jail','pixellate:20',
+                                               'invert,pixellate:50','invert']]
+    introcs.assert_equals([[0,3],[1],[2],[4]],
+                          [[chains.index(chain) for chain in shared] for shared in a6batch.group(chains)])
+    with tempfile.TemporaryDirectory() as output:
+        paths, size = a6batch.process(os.path.join(folder,'home.png'),chains,output)
+        introcs.assert_equals(5,len(paths))
+        for chain in chains:
+            editor = a6filter.Filter(load_image('home'))
+            chain.apply(editor)
+            path = a6batch.output_path(output,'home.png',chain)
+            compare_images(a6file.read_image(path),editor.getCurrent(),path,'home '+str(chain))
+
+    introcs.assert_equals([[1,2],[3,4],[5]],list(a6batch.chunk(iter(range(1,6)),2)))
+    introcs.assert_error(lambda : list(a6batch.execute([],chains,'',workers=0)),
+                         message='execute does not enforce the precondition on workers')
+
+
 def test_all():
     """
     Execute all of the test cases.
@@ -526,13 +1770,39 @@ def test_all():
     test_image_access()
     test_image_str()
     test_image_other()
+    test_image_compact()
+    test_image_trusted()
+    test_image_orientation()
+    test_image_drawing()
+    test_image_dirty()
+    test_image_downscale()
+    test_read_image()
+    test_write_png()
     print('Class Image passed all tests.')
     print()
 
+    print('Testing class Editor')
+    test_editor()
+    print('Class Editor passed all tests.')
+    print()
+
     print('Testing class Filter')
     test_reflect_vert()
     test_monochromify()
     test_jail()
     test_vignette()
     test_pixellate()
+    test_vectorized()
+    test_parallel()
+    test_pipeline()
+    test_lazy()
+    test_symbolic()
+    test_lookup()
+    test_preview()
+    test_monitor()
     print('Class Filter passed all tests.')
+    print()
+
+    print('Testing batch processing')
+    test_batch()
+    print('Batch processing passed all tests.')
@@ -0,0 +1,552 @@
+"""
+Vectorized image processing operations for the imager application.
+
+This module contains a NumPy version of every image processing operation in
+a6filter, except for jail (which Image already draws a slice at a time).
+Each function here processes the whole image as a single array instead of one
+pixel at a time, which makes it hundreds of times faster on large images.
+The results are identical to the pure-Python versions, right down to the
+int() truncation of the floating point computations.
+
+Vignetting multiplies each pixel by a factor that only depends on the image
+size, so those factors are computed once per size and cached (see mask).
+
+The pointwise operations (invert, monochromify and vignette) are written as
+kernels that work on any band of rows of the image. The function fuse uses
+them to run a whole chain of pointwise operations in a single pass, one band
+at a time, so each band is still in the cache for every operation.
+
+NumPy is optional. If it is not installed, AVAILABLE is False and Filter uses
+its pure-Python code instead. None of these functions may be called in that
+case.
+
+Julia Ludwig (jal545)
+11/14/20
+"""
+import math
+import threading
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Whether this engine can be used at all
+AVAILABLE = numpy is not None
+
+# The number of bytes in a band of rows processed by fuse (256K)
+BAND_SIZE = 1 << 18
+
+# The most memory used by the cached vignette masks (64M)
+MASK_MEMORY = 64 << 20
+
+# The cached vignette masks by (width, height), least recently used first
+_masks = OrderedDict()
+# A lock to protect the cache if filters are run in more than one thread
+_lock = threading.Lock()
+
+
+# HELPER FUNCTIONS
+def _pixels(image):
+    """
+    Returns the pixels of image as a writable height x width x 3 array.
+
+    For a compact image, the array is a view of the image buffer, so writing
+    to the array writes to the image. For a list-backed image, the array is a
+    copy, and the changes must be stored back with _store.
+
+    Parameter image: The image to access
+    Precondition: image is an Image object
+    """
+    shape = (image.getHeight(),image.getWidth(),3)
+    if image.isCompact():
+        return numpy.frombuffer(image.getBuffer(),dtype=numpy.uint8).reshape(shape)
+    return numpy.frombuffer(image.getBytes(),dtype=numpy.uint8).reshape(shape)
+
+
+def _store(image, pixels):
+    """
+    Stores the array of pixels as the new contents of image.
+
+    The array may have different dimensions than the image (e.g. because of a
+    rotation), but it must have the same number of pixels. The image width is
+    changed to match the array.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter pixels: The new pixels values
+    Precondition: pixels is a uint8 array of shape (height, width, 3) with
+    height*width == len(image)
+    """
+    if image.isCompact():
+        target = numpy.frombuffer(image.getBuffer(),dtype=numpy.uint8)
+        # Skip the copy if pixels is already the image buffer
+        if not (pixels.flags.c_contiguous and numpy.shares_memory(target,pixels)):
+            target[:] = pixels.reshape(-1)
+    else:
+        image.setBytes(pixels.tobytes())
+
+    width = pixels.shape[1]
+    if image.getWidth() != width:
+        image.setWidth(width)
+
+
+def _truncate(values):
+    """
+    Returns the array of non-negative floats values truncated to bytes.
+
+    This is the same as applying int() to every element. Values that are a
+    tiny bit below 0 because of rounding error become 0, as they do with int().
+
+    Parameter values: The values to convert
+    Precondition: values is a float array with elements > -1 and < 256
+    """
+    return numpy.maximum(values,0).astype(numpy.uint8)
+
+
+# POINTWISE KERNELS
+def _invert(pixels, top, height):
+    """
+    Inverts a band of pixels in place.
+
+    Parameter pixels: The pixels to change
+    Precondition: pixels is a uint8 array of shape (rows, width, 3)
+
+    Parameter top: The row of the image where the band starts
+    Precondition: top is an int >= 0
+
+    Parameter height: The height of the image
+    Precondition: height is an int >= top + rows
+    """
+    numpy.subtract(255,pixels,out=pixels)
+
+
+def _monochromify(pixels, top, height, sepia):
+    """
+    Converts a band of pixels to monochrome in place.
+
+    Parameter pixels: The pixels to change
+    Precondition: pixels is a uint8 array of shape (rows, width, 3)
+
+    Parameter top: The row of the image where the band starts
+    Precondition: top is an int >= 0
+
+    Parameter height: The height of the image
+    Precondition: height is an int >= top + rows
+
+    Parameter sepia: Whether to use sepia tone instead of greyscale.
+    Precondition: sepia is a bool
+    """
+    red   = pixels[:,:,0].astype(numpy.float64)
+    green = pixels[:,:,1].astype(numpy.float64)
+    blue  = pixels[:,:,2].astype(numpy.float64)
+    brightness = 0.3*red+0.6*green+0.1*blue
+
+    if sepia:
+        pixels[:,:,0] = _truncate(brightness)
+        pixels[:,:,1] = _truncate(0.6*brightness)
+        pixels[:,:,2] = _truncate(0.4*brightness)
+    else:
+        pixels[:] = _truncate(brightness)[:,:,None]
+
+
+def _vignette(pixels, top, height):
+    """
+    Vignettes a band of pixels in place.
+
+    Each pixel is darkened by its distance to the center of the image, not
+    the center of the band. The factors are read from the cached mask for
+    the image size, so this is a single multiply pass.
+
+    Parameter pixels: The pixels to change
+    Precondition: pixels is a uint8 array of shape (rows, width, 3)
+
+    Parameter top: The row of the image where the band starts
+    Precondition: top is an int >= 0
+
+    Parameter height: The height of the image
+    Precondition: height is an int >= top + rows
+    """
+    width = pixels.shape[1]
+    quarter = mask(width,height)
+
+    # Fold each row and column onto the top left quarter
+    rows = numpy.arange(top,top+pixels.shape[0])
+    cols = numpy.arange(width)
+    v = quarter[numpy.minimum(rows,height-rows)][:,numpy.minimum(cols,width-cols)]
+
+    pixels[:] = _truncate(v[:,:,None]*pixels)
+
+
+def mask(width, height):
+    """
+    Returns the top left quarter of the vignette mask for the given size.
+
+    The mask holds the factor 1-(d/hfD)**2 for every pixel (see
+    Filter.vignette), as float64 values. The value at [row, col] is the
+    factor for the pixels at (row, col), (height-row, col), (row, width-col)
+    and (height-row, width-col). Those pixels are the same distance from the
+    center row and column, with the sign flipped, so their factors are
+    exactly equal and only rows <= height//2 and columns <= width//2 are
+    stored.
+
+    Masks are cached by size. If the cache is larger than MASK_MEMORY bytes,
+    the least recently used masks are dropped. The mask must not be changed.
+
+    Parameter width: The image width
+    Precondition: width is an int > 0
+
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    """
+    key = (width,height)
+    with _lock:
+        if key in _masks:
+            _masks.move_to_end(key)
+            return _masks[key]
+
+    hfD=0.5*math.sqrt((width**2+height**2))
+    rows = (numpy.arange(height//2+1,dtype=numpy.float64)-height/2)**2
+    cols = (numpy.arange(width//2+1,dtype=numpy.float64)-width/2)**2
+    d = numpy.sqrt(rows[:,None]+cols[None,:])
+    result = 1 - (d / hfD)**2
+    result.flags.writeable = False
+
+    with _lock:
+        _masks[key] = result
+        total = sum(item.nbytes for item in _masks.values())
+        while total > MASK_MEMORY and _masks:
+            total -= _masks.popitem(last=False)[1].nbytes
+    return result
+
+
+# The kernel for each pointwise operation
+KERNELS = {'invert':_invert, 'monochromify':_monochromify, 'vignette':_vignette}
+
+
+# IMAGE OPERATIONS
+def invert(image):
+    """
+    Inverts image, replacing each element with its color complement
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+    """
+    pixels = _pixels(image)
+    _invert(pixels,0,image.getHeight())
+    _store(image,pixels)
+
+
+def transpose(image):
+    """
+    Transposes image
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+    """
+    pixels = _pixels(image)
+    _store(image,pixels.transpose(1,0,2))
+
+
+def reflectHori(image):
+    """
+    Reflects image around the horizontal middle.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+    """
+    pixels = _pixels(image)
+    pixels[:] = pixels[:,::-1]
+    _store(image,pixels)
+
+
+def reflectVert(image):
+    """
+    Reflects image around the vertical middle.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+    """
+    pixels = _pixels(image)
+    pixels[:] = pixels[::-1]
+    _store(image,pixels)
+
+
+def rotateRight(image):
+    """
+    Rotates image right by 90 degrees.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+    """
+    pixels = _pixels(image)
+    _store(image,numpy.rot90(pixels,-1))
+
+
+def rotateLeft(image):
+    """
+    Rotates image left by 90 degrees.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+    """
+    pixels = _pixels(image)
+    _store(image,numpy.rot90(pixels,1))
+
+
+def monochromify(image, sepia):
+    """
+    Converts image to monochrome (greyscale or sepia tone).
+
+    See Filter.monochromify for the exact formulas.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter sepia: Whether to use sepia tone instead of greyscale.
+    Precondition: sepia is a bool
+    """
+    pixels = _pixels(image)
+    _monochromify(pixels,0,image.getHeight(),sepia)
+    _store(image,pixels)
+
+
+def vignette(image, top=0, height=None):
+    """
+    Modifies image to simulates vignetting (corner darkening).
+
+    See Filter.vignette for the exact formula. The image may be a band of a
+    taller image (see Filter._vignette), in which case it is darkened by its
+    distance to the center of the taller image.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter top: The row of the taller image where this image starts
+    Precondition: top is an int >= 0
+
+    Parameter height: The height of the taller image (or None for no band)
+    Precondition: height is None or an int >= top + image height
+    """
+    fuse(image,[('vignette',)],top,height)
+
+
+def integral(image, grid):
+    """
+    Returns the summed-area table of image, sampled every grid rows and columns.
+
+    Entry [i,j] of the table is the sum of each color over the pixels above
+    row min(i*grid,height) and to the left of column min(j*grid,width). So
+    the sum of any block with its corners on the grid (or on the bottom and
+    right edges) takes four lookups, whatever its size. The table has shape
+    (ceil(height/grid)+1, ceil(width/grid)+1, 3). It is computed one band of
+    grid rows at a time, so it needs little memory besides the table itself.
+
+    Parameter image: The image to sum
+    Precondition: image is an Image object
+
+    Parameter grid: The spacing of the table rows and columns, in pixels
+    Precondition: grid is an int > 0
+    """
+    pixels = _pixels(image)
+    height = image.getHeight()
+    cols   = numpy.arange(0,image.getWidth(),grid)
+
+    table = numpy.zeros((-(-height//grid)+1,len(cols)+1,3),dtype=numpy.int64)
+    for (pos,top) in enumerate(range(0,height,grid)):
+        sums = pixels[top:top+grid].sum(axis=0,dtype=numpy.int64)
+        table[pos+1,1:] = numpy.add.reduceat(sums,cols,axis=0)
+    numpy.cumsum(table,axis=0,out=table)
+    numpy.cumsum(table,axis=1,out=table)
+    return table
+
+
+def pixellate(image, step, table=None, grid=None):
+    """
+    Pixellates image to give it a blocky feel.
+
+    See Filter.pixellate for the exact formula. The block sums come from a
+    summed-area table (see integral), so the time does not depend on step.
+    The averages use integer division, just like the pure-Python version.
+
+    The table may be computed ahead of time, with any grid that divides step.
+    That way one table can be shared by several step sizes.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter step: The number of pixels in a pixellated block
+    Precondition: step is an int > 0
+
+    Parameter table: The summed-area table of image (or None to compute it)
+    Precondition: table is None or the value of integral(image,grid)
+
+    Parameter grid: The grid of table
+    Precondition: grid is None if table is None, otherwise an int > 0 that
+    divides step
+    """
+    if step == 1:
+        return      # Every block is a single pixel
+    if table is None:
+        (table, grid) = (integral(image,step), step)
+    pixels = _pixels(image)
+    width  = image.getWidth()
+    height = image.getHeight()
+
+    # The table rows and columns on the block corners
+    ratio = step//grid
+    rows  = numpy.append(numpy.arange(0,table.shape[0]-1,ratio),table.shape[0]-1)
+    cols  = numpy.append(numpy.arange(0,table.shape[1]-1,ratio),table.shape[1]-1)
+    corners = table[rows][:,cols]
+    sums = corners[1:,1:]-corners[:-1,1:]-corners[1:,:-1]+corners[:-1,:-1]
+
+    # Blocks on the bottom and right edges may be smaller than step
+    heights = numpy.diff(numpy.minimum(rows*grid,height))
+    widths  = numpy.diff(numpy.minimum(cols*grid,width))
+    counts  = heights[:,None]*widths[None,:]
+
+    average = (sums // counts[:,:,None]).astype(numpy.uint8)
+    for (pos,top) in enumerate(range(0,height,step)):
+        pixels[top:top+step] = numpy.repeat(average[pos],widths,axis=0)
+    _store(image,pixels)
+
+
+def mix(image, function):
+    """
+    Applies a function that mixes the color channels to every pixel of image.
+
+    The function is called on whole bands of the image at once, as
+    function(red, green, blue) on float arrays, and returns a tuple of the new
+    (red, green, blue) values (arrays or numbers). They are truncated like
+    int(). See a6lut.Look.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter function: The color transform
+    Precondition: function returns values > -1 and < 256 for any color
+    """
+    pixels = _pixels(image)
+    rows = max(1,BAND_SIZE//(3*image.getWidth()))
+    for start in range(0,image.getHeight(),rows):
+        band  = pixels[start:start+rows]
+        red   = band[:,:,0].astype(numpy.float64)
+        green = band[:,:,1].astype(numpy.float64)
+        blue  = band[:,:,2].astype(numpy.float64)
+        values = function(red,green,blue)
+        for k in range(3):
+            band[:,:,k] = _truncate(numpy.asarray(values[k],dtype=numpy.float64))
+    _store(image,pixels)
+
+
+def weigh(image, weights, tint):
+    """
+    Applies a tint of a weighted sum of the channels to every pixel of image.
+
+    The brightness of each pixel is weights[0]*red+weights[1]*green+weights[2]*blue,
+    added in that order, and channel k of the new color is tint[k]*brightness,
+    truncated like int(). So the result is the same as mix with that function,
+    but there is no function call and fewer temporary arrays. See a6lut.Look.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter weights: The weight of each channel in the brightness
+    Precondition: weights is a tuple of three numbers
+
+    Parameter tint: The factor of the brightness in each channel
+    Precondition: tint is a tuple of three numbers, and every new value is > -1 and < 256
+    """
+    pixels = _pixels(image)
+    rows = max(1,BAND_SIZE//(3*image.getWidth()))
+    for start in range(0,image.getHeight(),rows):
+        band = pixels[start:start+rows]
+        brightness  = weights[0]*band[:,:,0].astype(numpy.float64)
+        brightness += weights[1]*band[:,:,1].astype(numpy.float64)
+        brightness += weights[2]*band[:,:,2]
+        for k in range(3):
+            band[:,:,k] = _truncate(tint[k]*brightness)
+    _store(image,pixels)
+
+
+def colormap(function):
+    """
+    Returns the new color for every 24 bit color under a color transform.
+
+    The result is a uint8 array of shape (2**24, 3), where the row for the
+    color (red, green, blue) is at red*65536+green*256+blue. The values are
+    exactly the ones mix would compute. The table is built one red value at
+    a time, so it needs little memory besides the table itself.
+
+    Parameter function: The color transform (see mix)
+    Precondition: function returns values > -1 and < 256 for any color
+    """
+    table  = numpy.empty((256,256,256,3),dtype=numpy.uint8)
+    values = numpy.arange(256,dtype=numpy.float64)
+    for red in range(256):
+        result = function(float(red),values[:,None],values[None,:])
+        for k in range(3):
+            table[red,:,:,k] = _truncate(numpy.broadcast_to(result[k],(256,256)))
+    return table.reshape(-1,3)
+
+
+def remap(image, table):
+    """
+    Replaces every color of image with its entry in table.
+
+    Each pixel is a single lookup, done in bands of about BAND_SIZE bytes.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter table: The new color for every color
+    Precondition: table is a value returned by colormap
+    """
+    pixels = _pixels(image)
+    flat = pixels.reshape(-1,3)
+    size = max(1,BAND_SIZE//3)
+    for start in range(0,len(flat),size):
+        band = flat[start:start+size]
+        colors = band[:,0].astype(numpy.uint32)
+        colors <<= 8
+        colors |= band[:,1]
+        colors <<= 8
+        colors |= band[:,2]
+        numpy.take(table,colors,axis=0,out=band,mode='clip')
+    _store(image,pixels)
+
+
+def fuse(image, actions, top=0, height=None):
+    """
+    Applies a chain of pointwise operations to image in a single pass.
+
+    The image is processed in bands of about BAND_SIZE bytes, and every
+    operation is applied to a band before moving on to the next one. The
+    result is identical to applying the operations one after the other.
+    Like vignette, the image may be a band of a taller image.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter actions: The operations to apply, in order
+    Precondition: actions is a list of tuples whose first element is a key of
+    KERNELS, followed by valid arguments for that operation
+
+    Parameter top: The row of the taller image where this image starts
+    Precondition: top is an int >= 0
+
+    Parameter height: The height of the taller image (or None for no band)
+    Precondition: height is None or an int >= top + image height
+    """
+    pixels = _pixels(image)
+    if height is None:
+        height = image.getHeight()
+
+    rows = max(1,BAND_SIZE//(3*image.getWidth()))
+    for start in range(0,image.getHeight(),rows):
+        band = pixels[start:start+rows]
+        for action in actions:
+            KERNELS[action[0]](band,top+start,height,*action[1:])
+    _store(image,pixels)
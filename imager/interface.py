@@ -69,6 +69,9 @@ class InterfacePanel(BoxLayout):
     # For handling the "progress" monitor
     processing = BooleanProperty(False)
     
+    # The least time between two displays of the bands of an action (in seconds)
+    BAND_DELAY = 0.1
+    
     def config(self):
         """
         Configures the application at start-up.
@@ -94,13 +97,24 @@ class InterfacePanel(BoxLayout):
                                        right=[self.do_async,'rotateRight'],
                                        transpose=[self.do_async,'transpose'])
         self.blockdrop = BlockDropDown(choices=['p10','p20','p50','p100', 'p200'],
-                                       p10=[self.do_async,'pixellate',10],
-                                       p20=[self.do_async,'pixellate',20],
-                                       p50=[self.do_async,'pixellate',50],
-                                       p100=[self.do_async,'pixellate',100],
-                                       p200=[self.do_async,'pixellate',200])
+                                       p10=[self.do_pixellate,10],
+                                       p20=[self.do_pixellate,20],
+                                       p50=[self.do_pixellate,50],
+                                       p100=[self.do_pixellate,100],
+                                       p200=[self.do_pixellate,200])
+        import threading
         self.async_action = None
         self.async_thread = None
+        self.save_thread  = None
+        # The bands finished by the running action, but not shown (see publish_band)
+        self.band_image   = None
+        self.band_rows    = None
+        self.band_lock    = threading.Lock()
+        # Whether the user has asked to stop the running action
+        self.abort_requested = False
+        # The pixellated previews of the current image (see open_pixellate)
+        self.previews = {}
+        self.preview_source = None
     
     # DIALOG BOXES
     def error(self, msg):
@@ -215,27 +229,14 @@ class InterfacePanel(BoxLayout):
         Parameter file: An absolute path to an image file
         Precondition: file is a string
         """
-        import a6image
-        from PIL import Image as CoreImage
+        import a6file
         
         try:
-            image = CoreImage.open(file)
-            image = image.convert("RGB")
-            buffer = list(image.getdata())
-            size  = image.size[0]*image.size[1]
-            width = image.size[0]
+            result = a6file.read_image(file)
         except:
             traceback.print_exc()
             self.error('Could not load the image file')
-            buffer = None
-        
-        result = None
-        if not buffer is None:
-            try:
-                result = a6image.Image(buffer,width)
-            except:
-                traceback.print_exc()
-                result = None
+            result = None
         return result
     
     def check_save_png(self, path, filename):
@@ -288,26 +289,35 @@ class InterfacePanel(BoxLayout):
         """
         Saves the current image, without user confirmation.
         
+        The file is written in a background thread (see a6file.write_png_async)
+        so that saving a large image does not freeze the application. Any error
+        is reported by save_complete once the thread is done.
+        
         Parameter filename: An absolute filename
         Precondition: filename is a string
         """
-        import os.path
-        import traceback
+        import a6file
         self.dismiss_popup()
         
-        # prepare image for saving
-        from PIL import Image as CoreImage
-
-        # This worked (Unlike Kivy)!  But is slow.
         current = self.workspace.getCurrent()
-        try:
-            im = CoreImage.new('RGBA',(current.getWidth(),current.getHeight()))
-            im.putdata(tuple(current.getData()))
-            im.save(filename,'PNG')
-        except:
-            traceback.print_exc()
+        self.save_thread = a6file.write_png_async(current, filename, callback=self.save_complete)
+    
+    @mainthread
+    def save_complete(self, filename, error):
+        """
+        Cleans up after a background save, reporting any error to the user.
+        
+        Parameter filename: The file that was written
+        Precondition: filename is a string
+        
+        Parameter error: The error that stopped the save (if any)
+        Precondition: error is an Exception or None
+        """
+        import os.path
+        self.save_thread = None
+        if error:
+            traceback.print_exception(type(error),error,error.__traceback__)
             self.error('Cannot save image file ' + os.path.split(filename)[1])
-                # These fields are 'hooks' to connect to the imager.kv file
     
     def place_image(self, path, filename):
         """
@@ -332,8 +342,10 @@ class InterfacePanel(BoxLayout):
         
         import a6filter
         self.picture = self.read_image(file)
+        self.drop_previews()
         try:
             self.workspace = a6filter.Filter(self.picture)
+            self.workspace.setMonitor(self.publish_band)
             self.workimage.setImage(self.workspace.getCurrent())
             self.origimage.setImage(self.workspace.getOriginal())
         except:
@@ -474,6 +486,7 @@ class InterfacePanel(BoxLayout):
         This method will undo the last edit to the image.
         """
         try:
+            self.drop_previews()
             self.workspace.undo()
             self.workimage.update(self.workspace.getCurrent())
             self.canvas.ask_update()
@@ -488,6 +501,7 @@ class InterfacePanel(BoxLayout):
         This method will remove all edits to the image.
         """
         try:
+            self.drop_previews()
             self.workspace.clear()
             self.workimage.update(self.workspace.getCurrent())
             self.canvas.ask_update()
@@ -525,16 +539,38 @@ class InterfacePanel(BoxLayout):
         The thread progress is monitored by async_monitor.  When the thread 
         is done, it will call async_complete in the main event thread.
         
+        Before the action, the thread applies it to a copy of the image sized 
+        to the panel (see show_proxy), so the user sees its effect right away. 
+        The full-size result replaces it when the thread is done.
+        
+        Parameter(s) *action: An expanded list defining the action
+        Precondition: The first element of action is callable
+        """
+        width, height = self.workimage.inside
+        self.run_async((int(width),int(height)),*action)
+    
+    def run_async(self,size,*action):
+        """
+        Launchs the given action in an asynchronous thread, with a proxy of the given size
+        
+        This is do_async, except that the size of the proxy is given. If size 
+        is None, there is no proxy (e.g. as a better preview is showing).
+        
+        Parameter size: The most columns and rows of the proxy
+        Precondition: size is None or a tuple of two ints
+        
         Parameter(s) *action: An expanded list defining the action
         Precondition: The first element of action is callable
         """
         import threading
+        self.drop_previews()
+        self.abort_requested = False
         self.menubar.disabled = True
         self.processing = True
-        self.async_thread = threading.Thread(target=self.async_work,args=action)
+        self.async_thread = threading.Thread(target=self.async_work,args=(size,)+action)
         self.async_thread.start()
 
-    def async_work(self,*action):
+    def async_work(self,size,*action):
         """
         Performs the given action asynchronously.
         
@@ -544,12 +580,16 @@ class InterfacePanel(BoxLayout):
         This is the function that is launched in a separate thread.  Even if 
         the action fails, it is guaranteed to call async_complete for clean-up
         
+        Parameter size: The most columns and rows of the proxy (see run_async)
+        Precondition: size is None or a tuple of two ints
+        
         Parameter(s) *action: An expanded list defining the action
         Precondition: The first element of action is callable
         """
+        if size is not None:
+            self.show_proxy(self.make_proxy(size,*action))
         try:
-            self.workspace.increment()
-            getattr(self.workspace,action[0])(*action[1:])
+            self.workspace.perform(*action)
         except:
             traceback.print_exc()
             self.error('Action '+action[0]+' could not be completed')
@@ -560,6 +600,10 @@ class InterfacePanel(BoxLayout):
         """
         Cleans up an asynchronous thread after completion.
         """
+        Clock.unschedule(self.show_bands)
+        with self.band_lock:
+            self.band_image = None
+            self.band_rows  = None
         self.workimage.update(self.workspace.getCurrent())
         self.async_thread.join()
         Clock.unschedule(self.async_action)
@@ -571,6 +615,204 @@ class InterfacePanel(BoxLayout):
         self.canvas.ask_update()
 
 
+    def abort_async(self):
+        """
+        Asks the running action to stop.
+        
+        Operations that are processed in bands stop after the current band, 
+        and the edit is undone (see Filter.setMonitor). Other operations run 
+        to the end, as the user can still undo them.
+        """
+        if self.processing:
+            self.abort_requested = True
+    
+    def publish_band(self,image,top,bottom):
+        """
+        Returns False if the running action should stop, after noting a finished band.
+        
+        This is the monitor of the workspace (see Filter.setMonitor), so it is 
+        called from the thread running the action. It only records the rows 
+        top up to bottom of image, and schedules show_bands to display them 
+        in the main thread. The bands are shown at most once every BAND_DELAY 
+        seconds, so the display keeps up no matter how small they are.
+        
+        Parameter image: The image being computed
+        Precondition: image is an Image object
+        
+        Parameter top: The first finished row
+        Precondition: top is an int, 0 <= top < bottom
+        
+        Parameter bottom: The row after the last finished row
+        Precondition: bottom is an int, top < bottom <= image height
+        """
+        with self.band_lock:
+            if self.band_rows is None:
+                self.band_rows = (top,bottom)
+                Clock.schedule_once(self.show_bands,self.BAND_DELAY)
+            else:
+                self.band_rows = (min(top,self.band_rows[0]),max(bottom,self.band_rows[1]))
+            self.band_image = image
+        return not self.abort_requested
+    
+    def show_bands(self,dt):
+        """
+        Displays the bands finished since the last call (see publish_band).
+        
+        The bands are only drawn over the image they belong to. If a preview 
+        of the action is showing (see show_proxy and do_pixellate), it stays 
+        until the action is done (see ImagePanel.update_rows).
+        
+        Parameter dt: The time since the call was scheduled
+        Precondition: dt is a number >= 0
+        """
+        with self.band_lock:
+            image = self.band_image
+            rows  = self.band_rows
+            self.band_image = None
+            self.band_rows  = None
+        if image is not None and self.processing:
+            self.workimage.update_rows(image,*rows)
+            self.canvas.ask_update()
+    
+    def make_proxy(self,size,*action):
+        """
+        Returns the given action applied to a copy of the image sized to fit size.
+
+        The copy is shrunk to fit (see Filter.preview), so the action takes a 
+        small fraction of the time it takes on the full image. This is called 
+        from the thread running the action (see async_work). The value is None 
+        if the image already fits, or if the preview fails (the action itself 
+        will report any error).
+
+        Parameter size: The most columns and rows of the proxy
+        Precondition: size is a tuple of two ints
+
+        Parameter(s) *action: An expanded list defining the action
+        Precondition: The first element of action is the name of a Filter method
+        """
+        if self.workspace is None or size[0] < 1 or size[1] < 1:
+            return None
+        try:
+            return self.workspace.preview(size[0],size[1],*action)
+        except:
+            traceback.print_exc()
+            return None
+
+    @mainthread
+    def show_proxy(self,proxy):
+        """
+        Shows the proxy of the running action (see make_proxy).
+
+        Parameter proxy: The proxy to show
+        Precondition: proxy is an Image object or None
+        """
+        if proxy is not None and self.processing:
+            self.workimage.update(proxy)
+            self.canvas.ask_update()
+
+    # PIXELLATE PREVIEWS
+    def open_pixellate(self,widget):
+        """
+        Opens the pixellate drop-down, preparing a preview for each block size.
+
+        The previews are computed in a background thread while the user looks
+        at the menu. Like the preview do_async shows, they are made from a copy 
+        of the current image shrunk to fit the work panel (see Filter.shrink), 
+        with the block sizes shrunk by the same amount. They all come from one 
+        summed-area table of that copy (see Filter.pixellations), so they cost 
+        little more than a single small pixellate. Once they are ready, choosing 
+        a block size shows its preview right away (see do_pixellate).
+
+        A preview thread for an image that has since changed is not waited 
+        for. Its results are ignored (see preview_complete).
+
+        Parameter widget: The button that opens the drop-down
+        Precondition: widget is a Kivy Widget
+        """
+        import threading
+        self.blockdrop.open(widget)
+        width, height = self.workimage.inside
+        if self.workspace is None or self.preview_source is not None or width < 1 or height < 1:
+            return
+
+        # Work on a small copy, since the next action may change the current image
+        steps  = [callback[1] for callback in self.blockdrop.options.values()]
+        source, factor = self.workspace.shrink(int(width),int(height))
+        self.preview_source = source
+        thread = threading.Thread(target=self.preview_work,args=(source,steps,factor))
+        thread.start()
+
+    def preview_work(self,source,steps,factor):
+        """
+        Computes the pixellated previews of source.
+
+        This is the function that is launched in a separate thread. It always
+        calls preview_complete, even if the previews fail.
+
+        Parameter source: The image to pixellate
+        Precondition: source is an Image object
+
+        Parameter steps: The block sizes in the current image
+        Precondition: steps is a non-empty list of ints > 0
+
+        Parameter factor: The amount source is shrunk from the current image
+        Precondition: factor is an int > 0
+        """
+        import a6filter
+        try:
+            scaled = [max(1,step//factor) for step in steps]
+            pixellations = a6filter.Filter(source).pixellations(scaled)
+            previews = {step:image for (step,(scale,image)) in zip(steps,pixellations)}
+        except:
+            traceback.print_exc()
+            previews = {}
+        self.preview_complete(source,previews)
+
+    @mainthread
+    def preview_complete(self,source,previews):
+        """
+        Stores the previews of source, unless the image has changed since.
+
+        Parameter source: The image that was pixellated
+        Precondition: source is an Image object
+
+        Parameter previews: The pixellated images for each block size
+        Precondition: previews is a dictionary of ints to Image objects
+        """
+        if source is self.preview_source:
+            self.previews = previews
+
+    def drop_previews(self):
+        """
+        Forgets the pixellated previews, as the current image is changing.
+
+        A preview thread that is still running finishes, but its results are
+        ignored. The next time the menu opens, new previews are started at once.
+        """
+        self.previews = {}
+        self.preview_source = None
+
+    def do_pixellate(self,step):
+        """
+        Pixellates the current image, showing the preview first if it is ready.
+
+        The edit itself is still made in the background, so it can be undone 
+        like any other. The preview just means the user does not wait to see 
+        it. As it is the same as the preview do_async would make, do_async 
+        does not make another one.
+
+        Parameter step: The number of pixels in a pixellated block
+        Precondition: step is an int > 0
+        """
+        preview = self.previews.get(step)
+        if preview is None:
+            self.do_async('pixellate',step)
+            return
+        self.workimage.update(preview)
+        self.canvas.ask_update()
+        self.run_async(None,'pixellate',step)
+
+
 class InterfaceApp(App):
     """
     This class is the imager filter application.
@@ -20,7 +20,6 @@ from kivy.metrics import sp
 
 from kivy.properties import *
 
-from array import array             # Byte buffers
 from io import StringIO             # Making complex strings
 import traceback
 
@@ -307,6 +306,8 @@ class ImagePanel(Widget):
     imagesize = ListProperty((0,0))
     # The position offset of the current image
     imageoff  = ListProperty((0,0))
+    # The token the texture was last synced with (see blit)
+    _token = None
     
     @classmethod
     def getResource(self,filename):
@@ -326,12 +327,33 @@ class ImagePanel(Widget):
         return os.path.join(dir,filename)
     
     def blit(self,picture):
-        for pos in range(len(picture)):
-            pixel = picture[pos]
-            self._blitter[pos*3  ] = pixel[0]
-            self._blitter[pos*3+1] = pixel[1]
-            self._blitter[pos*3+2] = pixel[2]
-        return self._blitter
+        """
+        Copies the pixels of picture that the texture does not show yet.
+
+        Each time the panel shows an image, it marks that image as clean with
+        a new token (see Image.markClean). If picture is the image shown last
+        (or a copy of it), only the rectangles written to it since then are
+        uploaded (see Image.getDirty). Otherwise all of the pixels are, and the
+        texture reads them directly from picture (see Image.getView), so a
+        compact image is uploaded without any copy or per-pixel work in Python.
+
+        Parameter picture: The image to display
+        Precondition: picture is an Image object the size of the texture
+        """
+        dirty = None
+        if self._token is not None:
+            dirty = picture.getDirty(self._token)
+        if dirty is None or sum(rect[2]*rect[3] for rect in dirty) >= len(picture):
+            with picture.getView() as view:
+                self.texture.blit_buffer(view, colorfmt='rgb', bufferfmt='ubyte')
+        else:
+            for (row, col, height, width) in dirty:
+                self.texture.blit_buffer(picture.getRegion(row,col,height,width),
+                                         pos=(col,row), size=(width,height),
+                                         colorfmt='rgb', bufferfmt='ubyte')
+        token = object()
+        picture.markClean(token,self._token)
+        self._token = token
     
     def setImage(self,picture):
         """
@@ -358,8 +380,8 @@ class ImagePanel(Widget):
             self.picture  = picture
             self.texture  = Texture.create(size=(picture.getWidth(), picture.getHeight()), 
                                            colorfmt='rgb', bufferfmt='ubyte')
-            self._blitter = array('B',[0]*len(picture)*3)
-            self.texture.blit_buffer(self.blit(picture), colorfmt='rgb', bufferfmt='ubyte')
+            self._token   = None
+            self.blit(picture)
             self.texture.flip_vertical()
             
             if self.texture.width < self.texture.height:
@@ -382,23 +404,61 @@ class ImagePanel(Widget):
         """
         Returns True if the image panel successfully displayed picture
         
-        This method is slightly faster than setImage in the case where the 
-        picture is a (dimension-preserving) modification of the current one.  
-        Otherwise it calls setImage.
+        This method is faster than setImage in the case where the picture is 
+        a (dimension-preserving) modification of the current one, since it 
+        reuses the texture and only uploads the rectangles that changed (see 
+        blit). Otherwise it calls setImage.
         
         Parameter picture: The image to display
         Precondition: picture is an Image object or None
         """
         try:
             assert picture.getWidth() == self.texture.width
+            assert picture.getHeight() == self.texture.height
             self.picture = picture
-            self.texture.blit_buffer(self.blit(picture), colorfmt='rgb', bufferfmt='ubyte')
+            self.blit(picture)
             return True
         except:
             pass
         print('REMAKING')
         return self.setImage(picture)
     
+    def update_rows(self,picture,top,bottom):
+        """
+        Returns True if the image panel successfully displayed the given rows of picture
+        
+        This is for showing an image while it is being computed, one band of 
+        rows at a time. Only the rows from top up to (but not including) bottom 
+        are uploaded, and only if picture is already on display. Otherwise the 
+        panel is showing something else, like a smaller preview of the result, 
+        and the other rows of picture are not ready to show. So this method 
+        leaves the panel alone and returns False. As other rows of picture may 
+        be changing at the same time, the next call to blit uploads all of it.
+        
+        Parameter picture: The image to display
+        Precondition: picture is an Image object
+        
+        Parameter top: The first row to upload
+        Precondition: top is an int, 0 <= top < bottom
+        
+        Parameter bottom: The row after the last row to upload
+        Precondition: bottom is an int, top < bottom <= picture height
+        """
+        if picture is not self.picture or self.texture is None or \
+           picture.getWidth() != self.texture.width or picture.getHeight() != self.texture.height:
+            return False
+        
+        self._token = None
+        try:
+            width = picture.getWidth()
+            self.texture.blit_buffer(picture.getRegion(top,0,bottom-top,width),
+                                     pos=(0,top), size=(width,bottom-top),
+                                     colorfmt='rgb', bufferfmt='ubyte')
+            return True
+        except:
+            traceback.print_exc()
+            return False
+    
     def hide_widget(self, dohide=True):
         """
         Hides or shows this widget on screen.